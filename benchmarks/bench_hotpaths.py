@@ -0,0 +1,219 @@
+"""
+Benchmarks of the coordinate-system and optimizer hot paths.
+
+Runs on synthetic alkane chains (CnH2n+2) with the Morse model potential
+(ModelLot), so no electronic structure code is needed. Each stage is run
+--repeat times and the minimum and median wall times are reported.
+
+    python benchmarks/bench_hotpaths.py --sizes 11 50 200 --output bench.json
+
+Compare two JSON files (e.g. from two commits) with
+
+    python benchmarks/bench_hotpaths.py --compare old.json new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pygsm.coordinate_systems import DelocalizedInternalCoordinates, PrimitiveInternalCoordinates, Topology
+from pygsm.level_of_theories.model_lot import ModelLot
+from pygsm.optimizers import eigenvector_follow
+from pygsm.potential_energy_surfaces import PES
+from pygsm.utilities import elements, manage_xyz
+from pygsm.wrappers import Molecule
+
+ELEMENT_TABLE = elements.ElementData()
+
+
+def alkane(natoms):
+    """ Zig-zag alkane chain with about natoms atoms (3n+2) """
+    ncarbons = max(1, int(round((natoms - 2) / 3.)))
+    geom = []
+    for i in range(ncarbons):
+        side = 1. if i % 2 else -1.
+        c = np.array([1.26 * i, 0.445 * side, 0.])
+        geom.append(['C'] + list(c))
+        geom.append(['H'] + list(c + [0., 0.51 * side, 0.89]))
+        geom.append(['H'] + list(c + [0., 0.51 * side, -0.89]))
+    geom.append(['H', -1.09, -0.445, 0.])
+    last = np.array(geom[3 * (ncarbons - 1)][1:])
+    geom.append(['H'] + list(last + [1.09, 0., 0.]))
+    return geom
+
+
+def timeit(func, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func()
+        times.append(time.perf_counter() - t)
+    return {'min': min(times), 'median': float(np.median(times)), 'repeat': repeat}, result
+
+
+def bench_system(natoms, repeat, max_dlc_atoms, max_opt_atoms, opt_steps):
+    geom = alkane(natoms)
+    xyz = manage_xyz.xyz_to_np(geom)
+    atoms = [ELEMENT_TABLE.from_symbol(a) for a in manage_xyz.get_atoms(geom)]
+    rng = np.random.RandomState(0)
+    results = {'natoms': len(geom)}
+
+    results['build_topology'], top = timeit(lambda: Topology.build_topology(xyz, atoms), repeat)
+    results['primitives'], prims = timeit(
+        lambda: PrimitiveInternalCoordinates.from_options(xyz=xyz, atoms=atoms, addtr=True, topology=top), repeat)
+    results['nprims'] = len(prims.Internals)
+
+    def wilsonB():
+        prims.clearCache()
+        return prims.wilsonB(xyz)
+    results['wilsonB'], _ = timeit(wilsonB, repeat)
+
+    def GMatrix():
+        prims.clearCache()
+        return prims.GMatrix(xyz)
+    results['GMatrix'], _ = timeit(GMatrix, repeat)
+
+    if len(geom) > max_dlc_atoms:
+        results['skipped'] = 'DLC stages skipped above {} atoms'.format(max_dlc_atoms)
+        return results
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        coords = DelocalizedInternalCoordinates.from_options(xyz=xyz, atoms=atoms, addtr=True, primitives=prims)
+
+    def build_dlc():
+        coords.clearCache()
+        coords.Prims.clearCache()
+        return coords.build_dlc(xyz)
+    results['build_dlc'], _ = timeit(build_dlc, repeat)
+
+    dq = 0.01 * rng.randn(coords.Vecs.shape[1])
+
+    def newCartesian():
+        coords.clearCache()
+        coords.Prims.clearCache()
+        return coords.newCartesian(xyz, dq, verbose=False)
+    results['newCartesian'], _ = timeit(newCartesian, repeat)
+
+    results['guess_hessian'], _ = timeit(lambda: coords.Prims.guess_hessian(xyz), repeat)
+
+    if len(geom) > max_opt_atoms:
+        results['skipped'] = 'optimize skipped above {} atoms'.format(max_opt_atoms)
+        return results
+
+    # optimize a distorted structure back to the model minimum
+    xyz_distorted = xyz + 0.05 * rng.randn(*xyz.shape)
+
+    scratch = os.path.abspath('bench_scratch')
+
+    def optimize():
+        lot = ModelLot.from_options(geom=geom, result_cache_size=0)
+        pes = PES.from_options(lot=lot, ad_idx=0, multiplicity=1)
+        c = DelocalizedInternalCoordinates.from_options(xyz=xyz_distorted, atoms=atoms, addtr=True, primitives=prims)
+        mol = Molecule.from_options(geom=manage_xyz.np_to_xyz(geom, xyz_distorted), PES=pes, coord_obj=c, Form_Hessian=True)
+        optimizer = eigenvector_follow.from_options(Linesearch='backtrack', DMAX=0.1, conv_Ediff=0.01)
+        optimizer.optimize(molecule=mol, refE=0., opt_steps=opt_steps, path=scratch)
+        return mol.energy
+    cwd = os.getcwd()
+    os.makedirs(scratch, exist_ok=True)
+    os.chdir(scratch)
+    try:
+        results['optimize'], E = timeit(optimize, repeat)
+    finally:
+        os.chdir(cwd)
+    results['optimize']['opt_steps'] = opt_steps
+    results['optimize']['final_energy'] = float(E)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+STAGES = ['build_topology', 'primitives', 'wilsonB', 'GMatrix', 'build_dlc', 'newCartesian', 'guess_hessian', 'optimize']
+
+
+def print_table(report):
+    print(" {:>7s} {:>7s}".format('natoms', 'nprims') + ''.join(" {:>14s}".format(s) for s in STAGES))
+    for res in report['systems']:
+        row = " {:>7d} {:>7d}".format(res['natoms'], res['nprims'])
+        for s in STAGES:
+            row += " {:>14s}".format('{:.4f}'.format(res[s]['min']) if s in res else '-')
+        print(row)
+
+
+def compare(old_file, new_file):
+    old = json.load(open(old_file))
+    new = json.load(open(new_file))
+    print(" {} ({}) -> {} ({}), ratio of minimum times (new/old)".format(
+        old_file, old.get('commit'), new_file, new.get('commit')))
+    old_systems = {res['natoms']: res for res in old['systems']}
+    print(" {:>7s}".format('natoms') + ''.join(" {:>14s}".format(s) for s in STAGES))
+    for res in new['systems']:
+        o = old_systems.get(res['natoms'])
+        if o is None:
+            continue
+        row = " {:>7d}".format(res['natoms'])
+        for s in STAGES:
+            if s in res and s in o:
+                row += " {:>14.2f}".format(res[s]['min'] / o[s]['min'])
+            else:
+                row += " {:>14s}".format('-')
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200, 500, 1000, 2000],
+                        help='approximate number of atoms of the systems (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions of each stage (default: %(default)s)')
+    parser.add_argument('--max-dlc-atoms', type=int, default=500,
+                        help='skip build_dlc, newCartesian, guess_hessian and optimize above this size (default: %(default)s)')
+    parser.add_argument('--max-opt-atoms', type=int, default=200,
+                        help='skip optimize above this size (default: %(default)s)')
+    parser.add_argument('--opt-steps', type=int, default=5, help='optimization steps (default: %(default)s)')
+    parser.add_argument('--output', type=str, default='benchmark.json', help='JSON output (default: %(default)s)')
+    parser.add_argument('--compare', type=str, nargs=2, metavar=('OLD', 'NEW'), help='compare two JSON outputs and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'systems': [],
+    }
+    for natoms in args.sizes:
+        print(" benchmarking {} atoms".format(natoms))
+        sys.stdout.flush()
+        report['systems'].append(bench_system(natoms, args.repeat, args.max_dlc_atoms, args.max_opt_atoms, args.opt_steps))
+
+    print_table(report)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(" wrote {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
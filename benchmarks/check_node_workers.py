@@ -0,0 +1,78 @@
+"""
+Checks that optimizing the string nodes with a pool of workers (-node_workers)
+gives the same string as the serial run.
+
+Runs the same DE-GSM job on the Diels-Alder example with the Morse model
+potential (ModelLot) serially and with --workers node workers, and compares
+the energy profiles of opt_converged_000.xyz. Exits with status 1 if they
+differ.
+
+    python benchmarks/check_node_workers.py --workers 3
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def read_profile(path):
+    """ Energies of the [GEOCONV] energy block of a molden string file """
+    energies = []
+    with open(path) as f:
+        lines = iter(f)
+        for line in lines:
+            if line.strip() == 'energy':
+                for line in lines:
+                    try:
+                        energies.append(float(line))
+                    except ValueError:
+                        break
+                break
+    return np.array(energies)
+
+
+def run_gsm(workers, args):
+    rundir = tempfile.mkdtemp(prefix='node_workers_{}_'.format(workers))
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT))
+    cmd = [sys.executable, '-m', 'pygsm.wrappers.main',
+           '-xyzfile', os.path.abspath(args.xyzfile),
+           '-package', 'ModelLot',
+           '-mode', 'DE_GSM',
+           '-num_nodes', str(args.num_nodes),
+           '-max_gsm_iters', str(args.max_gsm_iters),
+           '-max_opt_steps', str(args.max_opt_steps),
+           '-reactant_geom_fixed', '-product_geom_fixed',
+           '-node_workers', str(workers)]
+    with open(os.path.join(rundir, 'gsm.log'), 'w') as log:
+        subprocess.check_call(cmd, cwd=rundir, stdout=log, stderr=subprocess.STDOUT, env=env)
+    return rundir, read_profile(os.path.join(rundir, 'opt_converged_000.xyz'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=3, help='node workers of the parallel run (default: %(default)s)')
+    parser.add_argument('--xyzfile', type=str, default=os.path.join(ROOT, 'data', 'diels_alder.xyz'))
+    parser.add_argument('--num-nodes', dest='num_nodes', type=int, default=9)
+    parser.add_argument('--max-gsm-iters', dest='max_gsm_iters', type=int, default=6)
+    parser.add_argument('--max-opt-steps', dest='max_opt_steps', type=int, default=3)
+    parser.add_argument('--atol', type=float, default=1e-6, help='tolerance on the energies in kcal/mol (default: %(default)s)')
+    args = parser.parse_args()
+
+    serial_dir, serial = run_gsm(1, args)
+    parallel_dir, parallel = run_gsm(args.workers, args)
+    print("serial     {} ({})".format(' '.join('{:8.3f}'.format(e) for e in serial), serial_dir))
+    print("{:2d} workers {} ({})".format(args.workers, ' '.join('{:8.3f}'.format(e) for e in parallel), parallel_dir))
+
+    if serial.shape != parallel.shape or not np.allclose(serial, parallel, rtol=0., atol=args.atol):
+        print("the energy profiles differ")
+        sys.exit(1)
+    print("the energy profiles agree")
+
+
+if __name__ == '__main__':
+    main()
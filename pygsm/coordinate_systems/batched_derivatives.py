@@ -0,0 +1,153 @@
+from __future__ import print_function
+
+# third party
+import numpy as np
+import scipy.sparse as sparse
+
+# local application imports
+try:
+    from .slots import Distance,Angle,Dihedral,OutOfPlane
+except:
+    from slots import Distance,Angle,Dihedral,OutOfPlane
+
+'''
+Vectorized first derivatives of the common primitive internal coordinates.
+Each function takes the Cartesian coordinates (natoms,3) and one index array
+per atom of the primitive, and returns an array of shape (nprims,natoms_per_prim,3).
+The formulas (and the special cases) are the same as the derivative methods in slots.py.
+'''
+
+VECTOR1 = np.array([1, -1, 1]) / np.sqrt(3)
+VECTOR2 = np.array([-1, 1, 1]) / np.sqrt(3)
+
+
+def _unit(vecs):
+    norms = np.linalg.norm(vecs, axis=1)
+    return vecs / norms[:, None], norms
+
+
+def distance_derivatives(xyz, a, b):
+    u, _ = _unit(xyz[a] - xyz[b])
+    return np.stack((u, -u), axis=1)
+
+
+def angle_derivatives(xyz, a, b, c):
+    u, u_norm = _unit(xyz[a] - xyz[b])
+    v, v_norm = _unit(xyz[c] - xyz[b])
+    w_prime = np.cross(u, v)
+
+    # (anti)parallel vectors, pick an arbitrary perpendicular direction
+    parallel = (np.linalg.norm(u + v, axis=1) < 1e-10) | (np.linalg.norm(u - v, axis=1) < 1e-10)
+    if parallel.any():
+        up = u[parallel]
+        use2 = (np.linalg.norm(up + VECTOR1, axis=1) < 1e-10) | (np.linalg.norm(up - VECTOR2, axis=1) < 1e-10)
+        w_prime[parallel] = np.where(use2[:, None], np.cross(up, VECTOR2), np.cross(up, VECTOR1))
+
+    w, _ = _unit(w_prime)
+    term1 = np.cross(u, w) / u_norm[:, None]
+    term2 = np.cross(w, v) / v_norm[:, None]
+    return np.stack((term1, -(term1 + term2), term2), axis=1)
+
+
+def dihedral_derivatives(xyz, a, b, c, d):
+    ''' Also used for OutOfPlane, which has the same derivative '''
+    u, u_norm = _unit(xyz[a] - xyz[b])
+    w, w_norm = _unit(xyz[c] - xyz[b])
+    v, v_norm = _unit(xyz[d] - xyz[c])
+
+    uw = np.einsum('ij,ij->i', u, w)
+    vw = np.einsum('ij,ij->i', v, w)
+    su = 1 - uw**2
+    sv = 1 - vw**2
+    okay_u = su >= 1e-6
+    okay_v = sv >= 1e-6
+    su = np.where(okay_u, su, 1.)
+    sv = np.where(okay_v, sv, 1.)
+
+    uxw = np.cross(u, w) * okay_u[:, None]
+    vxw = np.cross(v, w) * okay_v[:, None]
+    term1 = uxw / (u_norm * su)[:, None]
+    term3 = uxw * (uw / (w_norm * su))[:, None]
+    term2 = vxw / (v_norm * sv)[:, None]
+    term4 = vxw * (vw / (w_norm * sv))[:, None]
+    return np.stack((term1, -term1 + term3 - term4, term2 - term3 + term4, -term2), axis=1)
+
+
+BATCHED_TYPES = [
+        (Distance, ('a', 'b'), distance_derivatives),
+        (Angle, ('a', 'b', 'c'), angle_derivatives),
+        (Dihedral, ('a', 'b', 'c', 'd'), dihedral_derivatives),
+        (OutOfPlane, ('a', 'b', 'c', 'd'), dihedral_derivatives),
+        ]
+
+
+class BatchedWilsonB(object):
+    '''
+    Index-array representation of the primitives of a PrimitiveInternalCoordinates
+    object, grouped by block and by type. compute() returns the list of B-matrix
+    blocks, dense or CSR. Primitives of other types (translations, rotations, cartesians ...)
+    are evaluated with their own derivative method.
+    '''
+
+    def __init__(self, Internals, block_info):
+        # Internals is a PrimitiveList, the atom indices come from its arrays.
+        # Hold on to it so the id in the signature stays valid
+        self.Internals = Internals
+        self.block_info = [tuple(info) for info in block_info]
+        self.signature = BatchedWilsonB.make_signature(Internals, block_info)
+
+        self.blocks = []
+        for sa, ea, sp, ep in self.block_info:
+            groups = []
+            batched = set()
+            for prim_type, attrs, func in BATCHED_TYPES:
+                rows, idx = Internals.kind_rows(prim_type, sp, ep)
+                if not len(rows):
+                    continue
+                idx = idx.astype(int)
+                # columns in the block of each atom x,y,z
+                cols = (3*(idx - sa)[:, :, None] + np.arange(3)).reshape(len(rows), -1)
+                groups.append((func, idx.T, rows - sp, cols))
+                batched.update(rows.tolist())
+            others = [(i, Internals[i]) for i in range(sp, ep) if i not in batched]
+            self.blocks.append((groups, others))
+
+    @staticmethod
+    def make_signature(Internals, block_info):
+        return (id(Internals), Internals.version, tuple(tuple(info) for info in block_info))
+
+    def matches(self, Internals, block_info):
+        return self.signature == BatchedWilsonB.make_signature(Internals, block_info)
+
+    def compute(self, xyz, as_sparse=False):
+        xyz = xyz.reshape(-1, 3)
+        Blist = []
+        for (sa, ea, sp, ep), (groups, others) in zip(self.block_info, self.blocks):
+            shape = (ep-sp, 3*(ea-sa))
+            if as_sparse:
+                # assemble the nonzeros directly in COO form
+                data, irow, icol = [], [], []
+                for func, idx, rows, cols in groups:
+                    der = func(xyz, *idx)
+                    data.append(der.reshape(-1))
+                    irow.append(np.repeat(rows, cols.shape[1]))
+                    icol.append(cols.reshape(-1))
+                for i, prim in others:
+                    row = prim.derivative(xyz[sa:ea, :], start_idx=sa).flatten()
+                    nz = np.nonzero(row)[0]
+                    data.append(row[nz])
+                    irow.append(np.full(len(nz), i-sp))
+                    icol.append(nz)
+                if data:
+                    B = sparse.csr_matrix((np.concatenate(data), (np.concatenate(irow), np.concatenate(icol))), shape=shape)
+                else:
+                    B = sparse.csr_matrix(shape)
+            else:
+                B = np.zeros(shape)
+                for func, idx, rows, cols in groups:
+                    der = func(xyz, *idx)
+                    B[rows[:, None], cols] = der.reshape(len(rows), -1)
+                for i, prim in others:
+                    B[i-sp] = prim.derivative(xyz[sa:ea, :], start_idx=sa).flatten()
+            Blist.append(B)
+        return Blist
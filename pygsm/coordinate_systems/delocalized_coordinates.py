@@ -10,6 +10,7 @@ from collections import OrderedDict, defaultdict
 import itertools
 from numpy.linalg import multi_dot
 import numpy as np
+from scipy.linalg import solve_triangular
 np.set_printoptions(precision=4,suppress=True)
 
 # local application imports
@@ -79,14 +80,38 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
         else:
             pass
 
+        # non-redundant eigenvectors and eigenvalues of the G blocks of the last build_dlc
+        self.dlc_basis = None
         self.build_dlc(xyz)
         #print("vecs after build")
         #print(self.Vecs)
 
+    @property
+    def Vecs(self):
+        return self._Vecs
+
+    @Vecs.setter
+    def Vecs(self, value):
+        # the G-matrix of the DLCs changes with the basis
+        self._Vecs = value
+        self.G_factor = None
+        self.basis_version += 1
+
+    def basis_key(self):
+        # the DLCs are combinations of the primitives, they change with either
+        return (self.basis_version,self.Prims.basis_version)
+
     def clearCache(self):
         super(DelocalizedInternalCoordinates, self).clearCache()
         self.Prims.clearCache()
 
+    def cache_stats(self):
+        return {'DLC':self.stored_wilsonB.stats(),'Prims':self.Prims.stored_wilsonB.stats()}
+
+    def print_cache_stats(self,label=''):
+        print(" {} DLC cache: {}".format(label,self.stored_wilsonB))
+        print(" {} primitive cache: {}".format(label,self.Prims.stored_wilsonB))
+
     def __repr__(self):
         return self.Prims.__repr__()
             
@@ -293,6 +318,83 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
         Gxc = multi_dot([Bmat.T, Gqc.T]).flatten()
         return Gxc
     
+    def nonredundant_basis(self, G):
+        '''
+        Returns the eigenvectors with non-zero (>1e-6) eigenvalues of each block of G.
+
+        With incremental_dlc the basis of the previous call is updated instead of
+        diagonalizing the blocks again (see rayleigh_ritz). The full eigh is used
+        for the first call, when the block sizes change or when the update is not
+        reliable, e.g. the number of non-redundant coordinates changed.
+        '''
+        previous = self.dlc_basis if self.options['incremental_dlc'] else None
+        if previous is not None and len(previous) != len(G.matlist):
+            previous = None
+
+        basis = []
+        for i,A in enumerate(G.matlist):
+            A = block_matrix.dense_block(A)
+            Q = None
+            if previous is not None and previous[i][0].shape[0] == A.shape[0]:
+                Q, L = self.rayleigh_ritz(A, *previous[i])
+            if Q is None:
+                L, Q = np.linalg.eigh(A)
+                LargeIdx = np.abs(L) > 1e-6
+                L, Q = L[LargeIdx], Q[:,LargeIdx]
+                profiler.count('build_dlc full eigh')
+            else:
+                profiler.count('build_dlc incremental')
+            basis.append((Q, L))
+        self.dlc_basis = basis
+        return [Q for Q,L in basis]
+
+    @staticmethod
+    def rayleigh_ritz(A, Q0, L0, thre=1e-6, nprobe=4):
+        '''
+        One subspace iteration and a Rayleigh-Ritz step on the block A, starting from
+        the eigenvectors Q0 (eigenvalues L0) of the previous geometry.
+
+        Z=A*Q0 lies in the range of A and Z/L0 is close to Q0, so it is orthonormalized
+        (Y) with Cholesky factorizations, Z = Y*R^T*L0. If span(Y) is the range of A it
+        is invariant, A*Y = Y*H, and the Rayleigh quotient follows without a second
+        product with A: H = Y^T*Z*(Y^T*Q0)^-1 = R^T*L0*(Y^T*Q0)^-1. That span(Y)
+        contains the range is checked with a few random vectors, and a Ritz value
+        below thre means the range shrank. Costs one n*n*k product and a k*k eigh
+        instead of the n*n eigh.
+        Returns (Q,L) or (None,None) if the update is not reliable.
+        '''
+        k = Q0.shape[1]
+        if k == 0:
+            return None, None
+        Z = np.dot(A, Q0)
+        # CholeskyQR2, the second pass restores the orthogonality lost to the conditioning of Z/L0
+        Y = Z/L0
+        RT = np.diag(L0)
+        for it in range(2):
+            try:
+                R = np.linalg.cholesky(np.dot(Y.T, Y))
+            except np.linalg.LinAlgError:
+                return None, None
+            Y = solve_triangular(R, Y.T, lower=True).T
+            RT = np.dot(R.T, RT)
+
+        # the range of A must be in span(Y)
+        V = np.random.RandomState(k).randn(A.shape[0], nprobe)
+        AV = np.dot(A, V)
+        AV -= np.dot(Y, np.dot(Y.T, AV))
+        if np.max(np.linalg.norm(AV, axis=0)/np.linalg.norm(V, axis=0)) > 1e-2*thre:
+            return None, None
+
+        try:
+            H = np.linalg.solve(np.dot(Y.T, Q0).T, RT.T).T
+        except np.linalg.LinAlgError:
+            return None, None
+        L, W = np.linalg.eigh(0.5*(H+H.T))
+        if L[0] < thre:
+            return None, None
+        return np.dot(Y, W), L
+
+    @profiler.timed('build_dlc')
     def build_dlc(self, xyz, C=None):
         """
         Build the delocalized internal coordinates (DLCs) which are linear 
@@ -323,19 +425,7 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
         time_G = nifty.click()
         #print(" Timings: Build G: %.3f " % (time_G))
 
-        tmpvecs=[]
-        for A in G.matlist:
-            L,Q = np.linalg.eigh(A)
-            LargeVals = 0
-            LargeIdx = []
-            for ival, value in enumerate(L):
-                #print("val=%.4f" %value,end=' ')
-                if np.abs(value) > 1e-6:
-                    LargeVals += 1
-                    LargeIdx.append(ival)
-            #print('\n')
-            #print("LargeVals %i" % LargeVals)
-            tmpvecs.append(Q[:,LargeIdx])
+        tmpvecs = self.nonredundant_basis(G)
 
         self.Vecs = block_matrix(tmpvecs)
         #print(" shape of DLC")
@@ -382,6 +472,7 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
         return self.Vecs
 
 
+    @profiler.timed('build_dlc_conjugate')
     def build_dlc_conjugate(self, xyz, C=None):
         """
         Build the delocalized internal coordinates (DLCs) which are linear 
@@ -414,7 +505,7 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
 
         tmpvecs=[]
         for A in G.matlist:
-            L,Q = np.linalg.eigh(A)
+            L,Q = np.linalg.eigh(block_matrix.dense_block(A))
             LargeVals = 0
             LargeIdx = []
             for ival, value in enumerate(L):
@@ -772,7 +863,7 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
         Gp = self.Prims.GMatrix(xyz)
         Vt = block_matrix.transpose(self.Vecs)
         for vt,G,v in zip(Vt.matlist,Gp.matlist,self.Vecs.matlist):
-            tmpvecs.append( np.dot(np.dot(vt,G),v))
+            tmpvecs.append( np.dot(vt,block_matrix.block_dot(G,v)))
         return block_matrix(tmpvecs)
 
     def MW_GMatrix(self,xyz,mass):
@@ -785,6 +876,7 @@ class DelocalizedInternalCoordinates(InternalCoordinates):
         s3a = 0
         for vt,b,v in zip(Vt.matlist,Bp.matlist,self.Vecs.matlist):
             e3a = s3a + b.shape[1]
+            b = block_matrix.dense_block(b)
             tmpvecs.append( np.linalg.multi_dot([vt,b/mass[s3a:e3a],b.T,v]))
             s3a = e3a
         return block_matrix(tmpvecs)
@@ -10,6 +10,7 @@ from numpy.linalg import multi_dot
 import itertools
 import networkx as nx
 from pkg_resources import parse_version
+from scipy.linalg import cho_factor, cho_solve
 
 # local application imports
 try:
@@ -17,12 +18,11 @@ try:
 except:
     from slots import *
 from utilities import *
+from utilities.lru_cache import LRUCache
 
 
 ELEMENT_TABLE = elements.ElementData()
 
-CacheWarning = False
-
 class InternalCoordinates(object):
 
     @staticmethod
@@ -117,6 +117,63 @@ class InternalCoordinates(object):
                 allowed_types=[int],
                 doc='0-- no printing, 1-- printing')
 
+        opt.add_option(
+                key='batched_wilsonB',
+                value=True,
+                required=False,
+                allowed_types=[bool],
+                doc='Build the primitive B-matrix with vectorized derivatives for \
+                        Distance, Angle, Dihedral and OutOfPlane primitives (see batched_derivatives.py).\
+                        False calls the derivative method of each primitive.')
+
+        opt.add_option(
+                key='sparse_wilsonB',
+                value=False,
+                required=False,
+                allowed_types=[bool],
+                doc='Store the primitive B-matrix and G-matrix blocks as scipy.sparse CSR matrices.\
+                        Saves memory for large fragments, e.g. QM/MM systems with prim_idx_file.')
+
+        opt.add_option(
+                key='incremental_dlc',
+                value=True,
+                required=False,
+                allowed_types=[bool],
+                doc='Update the DLC basis from the previous one (one subspace iteration and a Rayleigh-Ritz step \
+                        on each G block) instead of a full diagonalization. Falls back to the full \
+                        diagonalization when the number of non-redundant coordinates changes.')
+
+        opt.add_option(
+                key='G_solver',
+                value='cholesky',
+                required=False,
+                allowed_values=['cholesky','inverse'],
+                doc='How newCartesian applies G^-1 to dQ. cholesky solves with Cholesky factors of the G blocks, \
+                        which are reused (as preconditioner of CG) over microiterations while the geometry \
+                        moved less than G_reuse_thre. inverse forms GInverse at every microiteration.')
+
+        opt.add_option(
+                key='G_reuse_thre',
+                value=0.05,
+                required=False,
+                allowed_types=[float],
+                doc='Largest Cartesian change (Angstrom) for which the Cholesky factors of G are reused.')
+
+        opt.add_option(
+                key='cache_max_bytes',
+                value=100*1024**2,
+                required=False,
+                allowed_types=[int,type(None)],
+                doc='Memory budget in bytes of the LRU cache holding B-matrices and newCartesian results \
+                        of this coordinate object. None means no byte limit.')
+
+        opt.add_option(
+                key='cache_max_entries',
+                value=1000,
+                required=False,
+                allowed_types=[int],
+                doc='Maximum number of entries in the LRU cache of this coordinate object.')
+
         InternalCoordinates._default_options = opt
         return InternalCoordinates._default_options.copy()
 
@@ -130,7 +187,11 @@ class InternalCoordinates(object):
             ):
 
         self.options = options
-        self.stored_wilsonB = OrderedDict()
+        self.stored_wilsonB = LRUCache(options['cache_max_bytes'],options['cache_max_entries'])
+        # (xyz,Cholesky factors of the G blocks or None if G was not positive definite,basis_key) used by GSolve
+        self.G_factor = None
+        # bumped when the coordinates (basis vectors or primitives) change, see Molecule.memoize
+        self.basis_version = 0
 
     def addConstraint(self, cPrim, cVal):
         raise NotImplementedError("Constraints not supported with Cartesian coordinates")
@@ -145,29 +206,34 @@ class InternalCoordinates(object):
         raise NotImplementedError("Constraints not supported with Cartesian coordinates")
 
     def clearCache(self):
-        self.stored_wilsonB = OrderedDict()
+        self.stored_wilsonB.clear()
+        self.G_factor = None
+
+    def basis_key(self):
+        ''' Part of the cache keys, the cached B-matrices and steps are of this basis only '''
+        return self.basis_version
+
+    def cache_stats(self):
+        return self.stored_wilsonB.stats()
+
+    def print_cache_stats(self,label=''):
+        print(" {} cache: {}".format(label,self.stored_wilsonB))
 
     def wilsonB(self, xyz):
         """
         Given Cartesian coordinates xyz, return the Wilson B-matrix
         given by dq_i/dx_j where x is flattened (i.e. x1, y1, z1, x2, y2, z2)
         """
-        global CacheWarning
-        t0 = time.time()
-        xhash = hash(xyz.tostring())
-        ht = time.time() - t0
-        if xhash in self.stored_wilsonB:
-            ans = self.stored_wilsonB[xhash]
+        xhash = (hash(xyz.tostring()),self.basis_key())
+        ans = self.stored_wilsonB.get(xhash)
+        if ans is not None:
             return ans
         WilsonB = []
         Der = self.derivatives(xyz)
         for i in range(Der.shape[0]):
             WilsonB.append(Der[i].flatten())
-        self.stored_wilsonB[xhash] = np.array(WilsonB)
-        if len(self.stored_wilsonB) > 1000 and not CacheWarning:
-            nifty.logger.warning("\x1b[91mWarning: more than 100 B-matrices stored, memory leaks likely\x1b[0m")
-            CacheWarning = True
         ans = np.array(WilsonB)
+        self.stored_wilsonB.put(xhash,ans)
         return ans
 
     def GMatrix(self, xyz,u=None):
@@ -234,6 +300,104 @@ class InternalCoordinates(object):
         # print "G-time: %.3f Inv-time: %.3f" % (time_G, time_inv)
         return Gi
 
+    def GSolve(self, xyz, dQ):
+        '''
+        Returns G^-1*dQ (flat) without forming the inverse (see the G_solver option).
+
+        The Cholesky factors of the G blocks are kept with the geometry they were
+        built for. At a geometry within G_reuse_thre of it they precondition a CG
+        solve that applies G = B*B^T through the (cached) Wilson B-matrix, which
+        takes a few matrix-vector products instead of building and factorizing G.
+        If CG does not converge, G is factorized again. Blocks that are not positive
+        definite (e.g. redundant primitives) fall back to GInverse; the failure is
+        kept in G_factor (without factors), so that the following calls at or near
+        that geometry in the same basis skip the factorization.
+        '''
+        dQ = np.asarray(dQ, dtype=float).flatten()
+        if self.options['G_solver'] == 'inverse':
+            return np.asarray(block_matrix.dot(self.GInverse(xyz), dQ)).flatten()
+
+        xyz = xyz.reshape(-1,3)
+        factor = self.G_factor
+        if factor is not None and factor[2] != self.basis_key():
+            factor = None
+        if factor is not None:
+            diff = np.max(np.abs(xyz-factor[0]))
+            if factor[1] is None:
+                # G was not positive definite at (or near) this geometry in this basis
+                if diff == 0. or diff < self.options['G_reuse_thre']:
+                    profiler.count('GSolve known not positive definite')
+                    return np.asarray(block_matrix.dot(self.GInverse(xyz), dQ)).flatten()
+            elif diff == 0.:
+                return self.G_factor_solve(factor[1], dQ)
+            elif diff < self.options['G_reuse_thre']:
+                x = self.G_pcg(self.wilsonB(xyz), factor[1], dQ)
+                if x is not None:
+                    profiler.count('GSolve reused factorization')
+                    return x
+
+        profiler.count('GSolve factorization')
+        G = self.GMatrix(xyz)
+        try:
+            factors = [ cho_factor(block_matrix.dense_block(g)) for g in self.G_blocks(G) ]
+        except np.linalg.LinAlgError:
+            # remembered (factors None), the next calls here go straight to GInverse
+            self.G_factor = (xyz.copy(), None, self.basis_key())
+            return np.asarray(block_matrix.dot(self.GInverse(xyz), dQ)).flatten()
+        self.G_factor = (xyz.copy(), factors, self.basis_key())
+        return self.G_factor_solve(factors, dQ)
+
+    @staticmethod
+    def G_blocks(M):
+        return M.matlist if isinstance(M, block_matrix) else [M]
+
+    @staticmethod
+    def G_factor_solve(factors, dQ):
+        result = []
+        s = 0
+        for f in factors:
+            e = s + f[0].shape[0]
+            result.append(cho_solve(f, dQ[s:e]))
+            s = e
+        return np.concatenate(result)
+
+    def G_pcg(self, Bmat, factors, dQ, tol=1e-10, maxiter=10):
+        ''' CG solve of B*B^T x = dQ per block, preconditioned with old Cholesky factors. Returns None if not converged '''
+        Bblocks = self.G_blocks(Bmat)
+        if len(Bblocks) != len(factors):
+            return None
+        result = []
+        s = 0
+        for B, f in zip(Bblocks, factors):
+            e = s + f[0].shape[0]
+            if B.shape[0] != e-s:
+                return None
+            b = dQ[s:e]
+            bnorm = np.linalg.norm(b)
+            x = cho_solve(f, b)
+            if bnorm > 0.:
+                r = b - block_matrix.block_dot(B, block_matrix.block_dot(B.T, x))
+                z = cho_solve(f, r)
+                p = z.copy()
+                rz = np.dot(r, z)
+                for it in range(maxiter):
+                    if np.linalg.norm(r) <= tol*bnorm:
+                        break
+                    Gp = block_matrix.block_dot(B, block_matrix.block_dot(B.T, p))
+                    alpha = rz/np.dot(p, Gp)
+                    x += alpha*p
+                    r -= alpha*Gp
+                    z = cho_solve(f, r)
+                    rz_new = np.dot(r, z)
+                    p = z + (rz_new/rz)*p
+                    rz = rz_new
+                else:
+                    if np.linalg.norm(r) > tol*bnorm:
+                        return None
+            result.append(x)
+            s = e
+        return np.concatenate(result)
+
     def checkFiniteDifference(self, xyz):
         xyz = xyz.reshape(-1,3)
         Analytical = self.derivatives(xyz)
@@ -360,23 +524,17 @@ class InternalCoordinates(object):
          Hq = np.einsum('ps,sm,mn,nr,rq', Ginv, Bmat, Hx_BptGq, Bmat.T, Ginv, optimize=True)
          return Hq
 
+    # newCartesian results share the LRU cache with the B-matrices, keyed on (xyz,dQ,basis)
     def readCache(self, xyz, dQ):
-        if not hasattr(self, 'stored_xyz'):
-            return None
-        #xyz = xyz.flatten()
-        #dQ = dQ.flatten()
-        if np.linalg.norm(self.stored_xyz - xyz) < 1e-10:
-            if np.linalg.norm(self.stored_dQ - dQ) < 1e-10:
-                return self.stored_newxyz
+        key = ('newCartesian',hash(xyz.tostring()),hash(np.asarray(dQ,dtype=float).tostring()),self.basis_key())
+        cached = self.stored_wilsonB.get(key)
+        if cached is not None:
+            return cached.copy()
         return None
 
     def writeCache(self, xyz, dQ, newxyz):
-        #xyz = xyz.flatten()
-        #dQ = dQ.flatten()
-        #newxyz = newxyz.flatten()
-        self.stored_xyz = xyz.copy()
-        self.stored_dQ = dQ.copy()
-        self.stored_newxyz = newxyz.copy()
+        key = ('newCartesian',hash(xyz.tostring()),hash(np.asarray(dQ,dtype=float).tostring()),self.basis_key())
+        self.stored_wilsonB.put(key,newxyz.copy())
 
     
     #TODO this does not work!!! 8/29/2019
@@ -459,6 +617,7 @@ class InternalCoordinates(object):
             xyz1 = xyz2.copy()
 
 
+    @profiler.timed('newCartesian')
     def newCartesian(self, xyz, dQ, frozen_atoms=None, verbose=True):
         cached = self.readCache(xyz, dQ)
         if cached is not None:
@@ -489,11 +648,11 @@ class InternalCoordinates(object):
         fail_counter = 0
         while True:
             microiter += 1
+            profiler.count('newCartesian microiterations')
             Bmat = self.wilsonB(xyz1)
-            Ginv = self.GInverse(xyz1)
 
             # Get new Cartesian coordinates
-            dxyz = damp*block_matrix.dot(block_matrix.transpose(Bmat),block_matrix.dot(Ginv,dQ1))
+            dxyz = damp*block_matrix.dot(block_matrix.transpose(Bmat),self.GSolve(xyz1,dQ1))
 
             if frozen_atoms is not None:
                 for a in [3*i for i in frozen_atoms]:
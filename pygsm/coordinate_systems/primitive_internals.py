@@ -15,6 +15,7 @@ import networkx as nx
 np.set_printoptions(precision=4,suppress=True)
 import itertools
 from collections import OrderedDict, defaultdict
+import scipy.sparse as sparse
 
 # local application imports
 
@@ -22,14 +23,17 @@ try:
     from .internal_coordinates import InternalCoordinates
     from .topology import Topology,MyG
     from .slots import *
+    from .batched_derivatives import BatchedWilsonB
+    from .primitive_store import PrimitiveList,primitive_key
 except:
     from internal_coordinates import InternalCoordinates
     from topology import Topology,MyG
     from slots import *
+    from batched_derivatives import BatchedWilsonB
+    from primitive_store import PrimitiveList,primitive_key
 
 from utilities import *
 
-CacheWarning = False
 
 class PrimitiveInternalCoordinates(InternalCoordinates):
 
@@ -136,7 +140,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
                 dgraph.add_edge(k[0], k[1], weight=v)
             mst = sorted(list(nx.minimum_spanning_edges(dgraph, data=False)))
             for edge in mst:
-                if edge not in list(self.topology.edges()):
+                if not self.topology.has_edge(*edge):
                     print("Adding %s from minimum spanning tree" % str(edge))
                     self.topology.add_edge(edge[0], edge[1])
                     noncov.append(edge)
@@ -294,35 +298,39 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
                             self.add(Dihedral(a, b, c, d))
 
     # overwritting parent internal coordinate wilsonB with a block matrix representation
+    @profiler.timed('wilsonB')
     def wilsonB(self,xyz):
         """
         Given Cartesian coordinates xyz, return the Wilson B-matrix
         given by dq_i/dx_j where x is flattened (i.e. x1, y1, z1, x2, y2, z2)
         """
-        global CacheWarning
-        t0 = time.time()
-        xhash = hash(xyz.tostring())
-        ht = time.time() - t0
-        if xhash in self.stored_wilsonB:
-            #print(" returning stored")
-            ans = self.stored_wilsonB[xhash]
+        xhash = (hash(xyz.tostring()),self.basis_key())
+        ans = self.stored_wilsonB.get(xhash)
+        if ans is not None:
             return ans
         xyz = xyz.reshape(-1,3)
 
-        Blist = []
-        for info in self.block_info:
-            WilsonB = []
-            sa = info[0]
-            ea = info[1]
-            sp = info[2]
-            ep = info[3]
-            #nprim = info[2]
-            #ep=sp+nprim
-            #Der = np.array( [ p.derivative(xyz[sa:ea,:],start_idx=sa) for p in self.Internals[sp:ep] ])
-            #for i in range(Der.shape[0]):
-            #    WilsonB.append(Der[i].flatten())
-            #Blist.append(np.asarray(WilsonB))
-            Blist.append(np.array( [ p.derivative(xyz[sa:ea,:],start_idx=sa).flatten() for p in self.Internals[sp:ep] ]))
+        if self.options['batched_wilsonB']:
+            # index arrays are rebuilt whenever the primitives or blocks change
+            if getattr(self,'batched_B',None) is None or not self.batched_B.matches(self.Internals,self.block_info):
+                self.batched_B = BatchedWilsonB(self.Internals,self.block_info)
+            Blist = self.batched_B.compute(xyz,as_sparse=self.options['sparse_wilsonB'])
+        else:
+            Blist = []
+            for info in self.block_info:
+                sa = info[0]
+                ea = info[1]
+                sp = info[2]
+                ep = info[3]
+                #nprim = info[2]
+                #ep=sp+nprim
+                #Der = np.array( [ p.derivative(xyz[sa:ea,:],start_idx=sa) for p in self.Internals[sp:ep] ])
+                #for i in range(Der.shape[0]):
+                #    WilsonB.append(Der[i].flatten())
+                #Blist.append(np.asarray(WilsonB))
+                Blist.append(np.array( [ p.derivative(xyz[sa:ea,:],start_idx=sa).flatten() for p in self.Internals[sp:ep] ]))
+            if self.options['sparse_wilsonB']:
+                Blist = [ sparse.csr_matrix(B) for B in Blist ]
 
         ans = block_matrix(Blist)
         #print(block_matrix.full_matrix(ans))
@@ -332,12 +340,10 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         #    print(block)
         #    print(block.shape)
 
-        self.stored_wilsonB[xhash] = ans
-        if len(self.stored_wilsonB) > 1000 and not CacheWarning:
-            nifty.logger.warning("\x1b[91mWarning: more than 100 B-matrices stored, memory leaks likely\x1b[0m")
-            CacheWarning = True
+        self.stored_wilsonB.put(xhash,ans)
         return ans
     
+    @profiler.timed('GMatrix')
     def GMatrix(self,xyz):
         #if len(self.nprims_frag)==1:
         #    return block_matrix(super(PrimitiveInternalCoordinates,self).GMatrix(xyz))
@@ -371,7 +377,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
                 tmpVvecs=[]
                 tmpSvecs=[]
                 for Gmat in G.matlist:
-                    U, s, VT = np.linalg.svd(Gmat)
+                    U, s, VT = np.linalg.svd(block_matrix.dense_block(Gmat))
                     tmpVvecs.append(VT.T)
                     tmpUvecs.append(U.T)
                     tmpSvecs.append(np.diag(s))
@@ -417,7 +423,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
 
         matlist=[]
         for Gmat in G.matlist:
-            matlist.append(np.linalg.inv(Gmat))
+            matlist.append(np.linalg.inv(block_matrix.dense_block(Gmat)))
         
         Gt = block_matrix(matlist)
         #time_inv = nifty.click()
@@ -469,11 +475,11 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
     def __eq__(self, other):
         answer = True
         for i in self.Internals:
-            if i not in other.Internals:
+            if not other.has_prim(i):
                 print("this prim is in p1 but not p2 ",i)
                 answer = False
         for i in other.Internals:
-            if i not in self.Internals:
+            if not self.has_prim(i):
                 print("this prim is in p2 but not p1",i)
                 answer = False
         return answer
@@ -483,46 +489,48 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
 
     def update(self, other):
         Changed = False
+        # the primitives of Internals are views, count their inactive updates here
+        if not hasattr(self, 'inactive'):
+            self.inactive = {}
         for i in self.Internals:
-            if i not in other.Internals:
-                if hasattr(i, 'inactive'):
-                    i.inactive += 1
-                else:
-                    i.inactive = 0
-                if i.inactive == 1:
+            key = (type(i).__name__, tuple(i.atoms))
+            if not other.has_prim(i):
+                self.inactive[key] = self.inactive[key]+1 if key in self.inactive else 0
+                if self.inactive[key] == 1:
                     logger.info("Deleting:", i)
-                    self.Internals.remove(i)
+                    self._Internals.remove(i)
+                    self.basis_version += 1
                     Changed = True
             else:
-                i.inactive = 0
+                self.inactive[key] = 0
         for i in other.Internals:
-            if i not in self.Internals:
+            if not self.has_prim(i):
                 logger.info("Adding:  ", i)
-                self.Internals.append(i)
+                self.append_internal(i)
                 Changed = True
         return Changed
 
     def join(self, other,bonds_only=False):
         Changed = False
         for i in other.Internals:
-            if i not in self.Internals:
+            if not self.has_prim(i):
                 if bonds_only and type(i)!="Distance":
                     pass
                 else:
                     #logger.info("Adding:  ", i)
                     print(("Adding ",i))
-                    self.Internals.append(i)
+                    self.append_internal(i)
                     Changed = True
         return Changed
 
     def repr_diff(self, other):
         alines = ["-- Added: --"]
         for i in other.Internals:
-            if i not in self.Internals:
+            if not self.has_prim(i):
                 alines.append(i.__repr__())
         dlines = ["-- Deleted: --"]
         for i in self.Internals:
-            if i not in other.Internals:
+            if not other.has_prim(i):
                 dlines.append(i.__repr__())
         output = []
         if len(alines) > 1:
@@ -617,15 +625,39 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         return self.GInverse_EIG(xyz)
         #return self.GInverse_SVD(xyz)
 
+    # Internals is a PrimitiveList (primitive_store.py): the types, atoms and weights of the
+    # primitives in arrays, with a hash index for the lookups. A list assigned to Internals
+    # is converted. Modify Internals through the methods of this class (add, delete,
+    # append_prim_to_block ...) or by reassigning it, so that basis_version follows.
+    @property
+    def Internals(self):
+        return self._Internals
+
+    @Internals.setter
+    def Internals(self, value):
+        self._Internals = value if isinstance(value, PrimitiveList) else PrimitiveList(value)
+        self.basis_version += 1
+
+    def find_prim(self, dof):
+        ''' Returns the positions of the primitives equal to dof '''
+        return self._Internals.find(dof)
+
+    def has_prim(self, dof):
+        return len(self.find_prim(dof)) > 0
+
+    def append_internal(self, dof):
+        self._Internals.append(dof)
+        self.basis_version += 1
+
     def add(self, dof,verbose=False):
         if dof.__class__.__name__ in ['CartesianX', 'CartesianY','CartesianZ']:
             if verbose:
                 print((" adding ",dof))
-            self.Internals.append(dof)
-        elif dof not in self.Internals:
+            self.append_internal(dof)
+        elif not self.has_prim(dof):
             if verbose:
                 print((" adding ",dof))
-            self.Internals.append(dof)
+            self.append_internal(dof)
             return True
         else:
             return False
@@ -643,11 +675,11 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         else:
             return False
     
-    def dof_index(self,dof):
-        return self.Internals.index(dof)
-
     def dof_index(self,indice_tuple,dtype='Distance'):
-        if dtype == "Distance":
+        ''' Position of a primitive in Internals, given as a primitive or as atom indices and type '''
+        if isinstance(indice_tuple,PrimitiveCoordinate):
+            prim = indice_tuple
+        elif dtype == "Distance":
             i,j = indice_tuple
             prim = Distance(i,j)
         elif dtype == "Angle":
@@ -662,15 +694,18 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         else:
             print(dtype)
             raise NotImplementedError
-        return self.Internals.index(prim)
+        positions = self.find_prim(prim)
+        if not positions:
+            raise ValueError("{} is not in Internals".format(prim))
+        return positions[0]
 
     def delete(self, dof):
-        found=False
-        for ii in range(len(self.Internals))[::-1]:
-            if dof == self.Internals[ii]:
-                del self.Internals[ii]
-                found=True
-        return found
+        positions = self.find_prim(dof)
+        for ii in positions[::-1]:
+            del self._Internals[ii]
+        if positions:
+            self.basis_version += 1
+        return len(positions) > 0
 
     def tmp_delete(self,dof):
         found=False
@@ -696,8 +731,8 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
                 logger.info("Updating constraint value to %.4e" % cVal)
             self.cVals[iPrim] = cVal
         else:
-            if cPrim not in self.Internals:
-                self.Internals.append(cPrim)
+            if not self.has_prim(cPrim):
+                self.append_internal(cPrim)
             self.cPrims.append(cPrim)
             self.cVals.append(cVal)
 
@@ -707,9 +742,13 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         for cPrim in self.cPrims:
             newPrims.append(cPrim)
 
+        # constraints by primitive_key, only the few with the same key are compared
+        cPrims_by_key = defaultdict(list)
+        for cPrim in self.cPrims:
+            cPrims_by_key[primitive_key(cPrim)].append(cPrim)
         for typ in [Distance, Angle, LinearAngle, MultiAngle, OutOfPlane, Dihedral, MultiDihedral, CartesianX, CartesianY, CartesianZ, TranslationX, TranslationY, TranslationZ, RotationA, RotationB, RotationC]:
             for p in self.Internals:
-                if type(p) is typ and p not in self.cPrims:
+                if type(p) is typ and p not in cPrims_by_key.get(primitive_key(p),()):
                     newPrims.append(p)
         if len(newPrims) != len(self.Internals):
             raise RuntimeError("Not all internal coordinates have been accounted for. You may need to add something to reorderPrimitives()")
@@ -777,7 +816,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
                         dgraph.add_edge(k[0], k[1], weight=v)
                     mst = sorted(list(nx.minimum_spanning_edges(dgraph, data=False)))
                     for edge in mst:
-                        if edge not in list(self.topology.edges()):
+                        if not self.topology.has_edge(*edge):
                             print("Adding %s from minimum spanning tree" % str(edge))
                             self.topology.add_edge(edge[0], edge[1])
                             noncov.append(edge)
@@ -1382,7 +1421,8 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         # the third element is the end index for that blocks prims
         elem = self.block_info[count][3]
 
-        self.Internals.insert(elem,prim)
+        self._Internals.insert(elem,prim)
+        self.basis_version += 1
         #print(" prims after inserting at elem {}".format(elem))
         #print(self.Internals)
 
@@ -1439,12 +1479,17 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
         for info1,info2 in zip(block_info,other.block_info):
             sa1,ea1,sp1,ep1 = info1
             sa2,ea2,sp2,ep2 = info2
+            # the primitives of the block by primitive_key, O(1) membership instead of a scan of the block
+            block_prims = defaultdict(list)
+            for p in tmp_internals[sp1:ep1]:
+                block_prims[primitive_key(p)].append(p)
             for i in other.Internals[sp2:ep2]:
                 # Dont check Cartesians
                 if type(i) not in [CartesianX,CartesianY,CartesianZ]:
-                    if i not in self.Internals[sp1:ep1]:
+                    if i not in block_prims[primitive_key(i)]:
                         print("Adding prim {} that is in Other to Internals".format(i))
                         self.append_prim_to_block(i,count)
+                        block_prims[primitive_key(i)].append(i)
             count+=1
 
 
@@ -1462,7 +1507,7 @@ class PrimitiveInternalCoordinates(InternalCoordinates):
                 driving_coord_prims.append(prim)
         for dc in driving_coord_prims:
             if type(dc)!=Distance: # Already handled in topology
-                if dc not in self.Internals:
+                if not self.has_prim(dc):
                     print("Adding driving coord prim {} to Internals".format(dc))
                     self.append_prim_to_block(dc)
 
@@ -0,0 +1,285 @@
+from __future__ import print_function
+
+# third party
+from collections import defaultdict
+from itertools import count
+import numpy as np
+
+# local application imports
+try:
+    from .slots import Distance,Angle,Dihedral,OutOfPlane,CartesianX,CartesianY,CartesianZ
+except:
+    from slots import Distance,Angle,Dihedral,OutOfPlane,CartesianX,CartesianY,CartesianZ
+
+'''
+Array storage of the primitive internal coordinates, behind
+PrimitiveInternalCoordinates.Internals.
+
+The primitives that are defined by their atoms (and a weight) alone, Distance,
+Angle, Dihedral, OutOfPlane and CartesianX/Y/Z, are stored as a row of a kind
+code (int8), up to four atom indices (int32) and the weight (float64). The
+primitives that carry state (translations, rotations, linear angles ...) are
+kept as objects. Indexing returns a primitive object, built on the fly for the
+array kinds: a view, compare it with == and not with is, attributes set on it
+are not kept.
+
+The list keeps a hash index primitive_key -> positions, so "prim in Internals",
+Internals.index(prim) and find cost O(1) instead of a scan with __eq__. The index
+is built when first needed, extended by append and dropped by the changes that
+shift the positions (insert, del, remove).
+'''
+
+# kind code -> (class, atom attributes, weighted)
+ARRAY_TYPES = [
+        (Distance, ('a', 'b'), False),
+        (Angle, ('a', 'b', 'c'), False),
+        (Dihedral, ('a', 'b', 'c', 'd'), False),
+        (OutOfPlane, ('a', 'b', 'c', 'd'), False),
+        (CartesianX, ('a',), True),
+        (CartesianY, ('a',), True),
+        (CartesianZ, ('a',), True),
+        ]
+KIND_CODES = {typ: code for code, (typ, attrs, weighted) in enumerate(ARRAY_TYPES)}
+OBJECT = -1
+
+# versions are unique over all the lists, so (id(list), list.version) can't come back
+# after a list is freed and its id is reused
+_versions = count(1)
+
+
+def primitive_key(prim):
+    '''
+    Hash key of a primitive. Equal primitives (__eq__ in slots.py) are of the same
+    type and on the same set of atoms, so they have the same key. Primitives with
+    the same key can still differ (e.g. a Dihedral and its permutations), the
+    candidates are compared with __eq__.
+    '''
+    try:
+        atoms = frozenset(prim.atoms)
+    except AttributeError:
+        atoms = None
+    return (type(prim).__name__, atoms)
+
+
+class PrimitiveList(object):
+    ''' List of primitives (append, insert, del, remove, index, in, slices ...) on arrays '''
+
+    def __init__(self, prims=()):
+        self._n = 0
+        self._kind = np.zeros(0, dtype=np.int8)
+        self._atoms = np.zeros((0, 4), dtype=np.int32)
+        self._weight = np.zeros(0, dtype=np.float64)
+        # the object primitives, None for the array kinds
+        self._objects = []
+        self._index = None
+        # changes with every modification, e.g. for the BatchedWilsonB signature
+        self.version = next(_versions)
+        self.extend(prims)
+
+    @staticmethod
+    def kind_code(typ):
+        return KIND_CODES.get(typ, OBJECT)
+
+    def _reserve(self, n):
+        ''' Room for n primitives, the capacity doubles so that append is amortized O(1) '''
+        capacity = len(self._kind)
+        if n <= capacity:
+            return
+        capacity = max(n, 2*capacity, 16)
+        kind = np.full(capacity, OBJECT, dtype=np.int8)
+        atoms = np.zeros((capacity, 4), dtype=np.int32)
+        weight = np.ones(capacity, dtype=np.float64)
+        kind[:self._n] = self._kind[:self._n]
+        atoms[:self._n] = self._atoms[:self._n]
+        weight[:self._n] = self._weight[:self._n]
+        self._kind, self._atoms, self._weight = kind, atoms, weight
+
+    def _set(self, pos, prim):
+        code = KIND_CODES.get(type(prim), OBJECT)
+        self._kind[pos] = code
+        if code == OBJECT:
+            self._objects[pos] = prim
+            return
+        typ, attrs, weighted = ARRAY_TYPES[code]
+        self._objects[pos] = None
+        self._atoms[pos, :len(attrs)] = [getattr(prim, attr) for attr in attrs]
+        self._weight[pos] = prim.w if weighted else 1.
+
+    def _get(self, pos):
+        return self._view(int(self._kind[pos]), self._atoms[pos].tolist(), pos)
+
+    def _view(self, code, atoms, pos):
+        if code == OBJECT:
+            return self._objects[pos]
+        typ, attrs, weighted = ARRAY_TYPES[code]
+        if weighted:
+            return typ(atoms[0], w=float(self._weight[pos]))
+        return typ(*atoms[:len(attrs)])
+
+    def _key(self, pos):
+        code = self._kind[pos]
+        if code == OBJECT:
+            return primitive_key(self._objects[pos])
+        typ, attrs, weighted = ARRAY_TYPES[code]
+        return (typ.__name__, frozenset(int(i) for i in self._atoms[pos, :len(attrs)]))
+
+    def _changed(self, shifted=False):
+        self.version = next(_versions)
+        if shifted:
+            self._index = None
+
+    def _positions(self, pos):
+        if pos < 0:
+            pos += self._n
+        if not 0 <= pos < self._n:
+            raise IndexError("primitive index out of range")
+        return pos
+
+    # list interface
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self._get(i) for i in range(*pos.indices(self._n))]
+        return self._get(self._positions(pos))
+
+    def __setitem__(self, pos, prim):
+        pos = self._positions(pos)
+        self._set(pos, prim)
+        self._changed(shifted=True)
+
+    def __delitem__(self, pos):
+        if isinstance(pos, slice):
+            positions = list(range(*pos.indices(self._n)))
+        else:
+            positions = [self._positions(pos)]
+        keep = np.ones(self._n, dtype=bool)
+        keep[positions] = False
+        n = int(keep.sum())
+        self._kind[:n] = self._kind[:self._n][keep]
+        self._atoms[:n] = self._atoms[:self._n][keep]
+        self._weight[:n] = self._weight[:self._n][keep]
+        self._objects = [obj for obj, k in zip(self._objects, keep) if k]
+        self._n = n
+        self._changed(shifted=True)
+
+    def __iter__(self):
+        # like a list, follows appends and deletions during the iteration: the rows are
+        # read in bulk and read again after a modification
+        pos = 0
+        while pos < self._n:
+            version = self.version
+            kinds = self._kind[pos:self._n].tolist()
+            atoms = self._atoms[pos:self._n].tolist()
+            for code, row in zip(kinds, atoms):
+                yield self._view(code, row, pos)
+                pos += 1
+                if self.version != version:
+                    break
+
+    def __contains__(self, prim):
+        return len(self.find(prim)) > 0
+
+    def __eq__(self, other):
+        if isinstance(other, (PrimitiveList, list, tuple)):
+            return len(self) == len(other) and all(p == q for p, q in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        answer = self.__eq__(other)
+        return answer if answer is NotImplemented else not answer
+
+    def __add__(self, other):
+        new = self.__copy__()
+        new.extend(other)
+        return new
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, prim):
+        self._reserve(self._n + 1)
+        self._objects.append(None)
+        self._n += 1
+        self._set(self._n - 1, prim)
+        if self._index is not None:
+            self._index[self._key(self._n - 1)].append(self._n - 1)
+        self._changed()
+
+    def extend(self, prims):
+        for prim in prims:
+            self.append(prim)
+
+    def insert(self, pos, prim):
+        pos = min(max(pos + self._n if pos < 0 else pos, 0), self._n)
+        self._reserve(self._n + 1)
+        self._kind[pos+1:self._n+1] = self._kind[pos:self._n].copy()
+        self._atoms[pos+1:self._n+1] = self._atoms[pos:self._n].copy()
+        self._weight[pos+1:self._n+1] = self._weight[pos:self._n].copy()
+        self._objects.insert(pos, None)
+        self._n += 1
+        self._set(pos, prim)
+        self._changed(shifted=True)
+
+    def remove(self, prim):
+        del self[self.index(prim)]
+
+    def find(self, prim):
+        ''' Returns the positions of the primitives equal to prim '''
+        if self._index is None:
+            self._index = defaultdict(list)
+            for pos in range(self._n):
+                self._index[self._key(pos)].append(pos)
+        return [pos for pos in self._index.get(primitive_key(prim), []) if self._get(pos) == prim]
+
+    def index(self, prim):
+        positions = self.find(prim)
+        if not positions:
+            raise ValueError("{} is not in the primitives".format(prim))
+        return positions[0]
+
+    def count(self, prim):
+        return len(self.find(prim))
+
+    def kind_rows(self, typ, start=0, stop=None):
+        '''
+        Positions (between start and stop) of the primitives of an array kind and
+        their atom indices, (nprims,) and (nprims,natoms_per_prim)
+        '''
+        stop = self._n if stop is None else stop
+        code = KIND_CODES[typ]
+        positions = start + np.nonzero(self._kind[start:stop] == code)[0]
+        return positions, self._atoms[positions, :len(ARRAY_TYPES[code][1])]
+
+    @property
+    def nbytes(self):
+        ''' Memory of the arrays and the object slots (not of the objects themselves) '''
+        return self._kind.nbytes + self._atoms.nbytes + self._weight.nbytes + 8*len(self._objects)
+
+    def __copy__(self):
+        new = PrimitiveList.__new__(PrimitiveList)
+        new._n = self._n
+        new._kind = self._kind[:self._n].copy()
+        new._atoms = self._atoms[:self._n].copy()
+        new._weight = self._weight[:self._n].copy()
+        new._objects = list(self._objects)
+        new._index = None
+        new.version = next(_versions)
+        return new
+
+    def __deepcopy__(self, memo):
+        from copy import deepcopy
+        new = self.__copy__()
+        new._objects = [deepcopy(obj, memo) for obj in self._objects]
+        return new
+
+    def __getstate__(self):
+        # the index is rebuilt on first use
+        state = self.__copy__().__dict__
+        return state
@@ -10,6 +10,7 @@ sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
 
 import numpy as np
 import itertools
+from scipy.spatial import cKDTree
 from pkg_resources import parse_version
 from collections import OrderedDict, defaultdict
 
@@ -166,17 +167,15 @@ class Topology():
             primitive_indices = range(len(atoms))
         else:
             # specify Hybrid TRIC we need to specify which atoms to build topology for
-            primitive_indices = []
-            for i in range(len(atoms)):
-                if i not in hybrid_indices:
-                    primitive_indices.append(i)
+            hybrid_set = set(hybrid_indices)
+            primitive_indices = [ i for i in range(len(atoms)) if i not in hybrid_set ]
             #print("non-cartesian indices")
             #print(primitive_indices)
 
             # get the hybrid start and stop indices
             new=True
             for i in range(natoms+1):
-                if i in hybrid_indices:
+                if i in hybrid_set:
                     if new==True:
                         start=i
                         new=False
@@ -300,228 +299,52 @@ class Topology():
         # Molecule object can have its own set of radii that overrides the global ones
         #R = np.array([top_settings['radii'].get(i.symbol, i.covalent_radius) for i in atoms])
         R = np.array([atom.covalent_radius for atom in atoms ])
-        # Create a list of 2-tuples corresponding to combinations of atomic indices using a grid algorithm.
-        mins = np.min(xyz,axis=0)
-        maxs = np.max(xyz,axis=0)
-        # Grid size in Angstrom.  This number is optimized for speed in a 15,000 atom system (united atom pentadecane).
-        gsz = 6.0
-        #if hasattr( 'boxes'):
+
         if top_settings['toppbc']:
             raise NotImplementedError
-            xmin = 0.0
-            ymin = 0.0
-            zmin = 0.0
-            xmax = boxes[sn].a
-            ymax = boxes[sn].b
-            zmax = boxes[sn].c
-            if any([i != 90.0 for i in [boxes[sn].alpha, boxes[sn].beta, boxes[sn].gamma]]):
-                nifty.logger.warning("Warning: Topology building will not work with broken molecules in nonorthogonal cells.")
-                toppbc = False
-        else:
-            xmin = mins[0]
-            ymin = mins[1]
-            zmin = mins[2]
-            xmax = maxs[0]
-            ymax = maxs[1]
-            zmax = maxs[2]
-            toppbc = False
-
-        xext = xmax-xmin
-        yext = ymax-ymin
-        zext = zmax-zmin
-
-        if toppbc:
-            gszx = xext/int(xext/gsz)
-            gszy = yext/int(yext/gsz)
-            gszz = zext/int(zext/gsz)
-        else:
-            gszx = gsz
-            gszy = gsz
-            gszz = gsz
-
-        # Run algorithm to determine bonds.
-        # Decide if we want to use the grid algorithm.
-        use_grid = toppbc or (np.min([xext, yext, zext]) > 2.0*gsz)
-        if use_grid and prim_idx_start_stop is None:
+        toppbc = False
+
+        # Atoms are only bonded within a segment. Without prim_idx_start_stop all the
+        # primitive atoms form one segment in large systems, otherwise the segments
+        # are the given (or the consecutive) ranges of primitive atoms.
+        primitive_indices = np.asarray(list(primitive_indices),dtype=int)
+        if len(primitive_indices) == 0:
+            return []
+        segment = np.full(natoms,-1,dtype=int)
+        # grid size (Angstrom) of the former grid algorithm, which was used when all extents were larger than 2*gsz
+        gsz = 6.0
+        ext = np.ptp(xyz,axis=0)
+        if prim_idx_start_stop is None and np.min(ext) > 2.0*gsz:
             print(" Using grid")
-            # Inside the grid algorithm.
-            # 1) Determine the left edges of the grid cells.
-            # Note that we leave out the rightmost grid cell,
-            # because this may cause spurious partitionings.
-            xgrd = np.arange(xmin, xmax-gszx, gszx)
-            ygrd = np.arange(ymin, ymax-gszy, gszy)
-            zgrd = np.arange(zmin, zmax-gszz, gszz)
-            # 2) Grid cells are denoted by a three-index tuple.
-            gidx = list(itertools.product(list(range(len(xgrd))), list(range(len(ygrd))), list(range(len(zgrd)))))
-            # 3) Build a dictionary which maps a grid cell to itplus its neighboring grid cells.
-            # Two grid cells are defined to be neighbors if the differences between their x, y, z indices are at most 1.
-            gngh = OrderedDict()
-            amax = np.array(gidx[-1])
-            amin = np.array(gidx[0])
-            n27 = np.array(list(itertools.product([-1,0,1],repeat=3)))
-            for i in gidx:
-                gngh[i] = []
-                ai = np.array(i)
-                for j in n27:
-                    nj = ai+j
-                    for k in range(3):
-                        mod = amax[k]-amin[k]+1
-                        if nj[k] < amin[k]:
-                            nj[k] += mod
-                        elif nj[k] > amax[k]:
-                            nj[k] -= mod
-                    gngh[i].append(tuple(nj))
-            # 4) Loop over the atoms and assign each to a grid cell.
-            # Note: I think this step becomes the bottleneck if we choose very small grid sizes.
-
-            # TODO 9/2019 build-bonds only for non-cartesian indices
-            gasn = OrderedDict([(i, []) for i in gidx])
-            #for i in range(natoms):
-            for i in primitive_indices:
-                xidx = -1
-                yidx = -1
-                zidx = -1
-                for j in xgrd:
-                    xi = xyz[i][0]
-                    while xi < xmin: xi += xext
-                    while xi > xmax: xi -= xext
-                    if xi < j: break
-                    xidx += 1
-                for j in ygrd:
-                    yi = xyz[i][1]
-                    while yi < ymin: yi += yext
-                    while yi > ymax: yi -= yext
-                    if yi < j: break
-                    yidx += 1
-                for j in zgrd:
-                    zi = xyz[i][2]
-                    while zi < zmin: zi += zext
-                    while zi > zmax: zi -= zext
-                    if zi < j: break
-                    zidx += 1
-                gasn[(xidx,yidx,zidx)].append(i)
-
-            # 5) Create list of 2-tuples corresponding to combinations of atomic indices.
-            # This is done by looping over pairs of neighboring grid cells and getting Cartesian products of atom indices inside.
-            # It may be possible to get a 2x speedup by eliminating forward-reverse pairs (e.g. (5, 4) and (4, 5) and duplicates (5,5).)
-            AtomIterator = []
-            for i in gasn:
-                for j in gngh[i]:
-                    apairs = nifty.cartesian_product2([gasn[i], gasn[j]])
-                    if len(apairs) > 0: AtomIterator.append(apairs[apairs[:,0]>apairs[:,1]])
-            AtomIterator = np.ascontiguousarray(np.vstack(AtomIterator))
+            segment[primitive_indices] = 0
         else:
-            # Create a list of 2-tuples corresponding to combinations of atomic indices.
-            # This is much faster than using itertools.combinations.
-            # TODO 9/2019 build-bonds only for non-cartesian indices
-            num_atoms_nc = len(primitive_indices)
-
-            # the original version
-            # AtomIterator = np.ascontiguousarray(np.vstack((np.fromiter(itertools.chain(*[[i]*(natoms-i-1) for i in range(natoms)]),dtype=np.int32), np.fromiter(itertools.chain(*[list(range(i+1,natoms)) for i in range(natoms)]),dtype=np.int32))).T)
-
-
-            #first_o =np.fromiter(itertools.chain(*[[i]*(natoms-i-1) for i in range(natoms)]),dtype=np.int32)
-
-
-            #print("prim indices")
-            # need the primitive start and stop indices
-
             if prim_idx_start_stop is None:
-                prim_idx_start_stop = []
-                new=True
-                for i in range(natoms+1):
-                    if i in primitive_indices:
-                        if new==True:
-                            start=i
-                            new=False
-                    else:
-                        if new==False:
-                            end=i-1
-                            new=True
-                            prim_idx_start_stop.append((start,end))
+                # runs of consecutive primitive atoms
+                breaks = np.where(np.diff(primitive_indices) != 1)[0]
+                starts = np.concatenate(([0],breaks+1))
+                ends = np.concatenate((breaks,[len(primitive_indices)-1]))
+                prim_idx_start_stop = list(zip(primitive_indices[starts],primitive_indices[ends]))
             else:
                 print(" using user defined primitive start stop values")
+            for iseg,(start,end) in enumerate(prim_idx_start_stop):
+                segment[start:end+1] = iseg
 
-            #print(prim_idx_start_stop)
-            first_list =[]
-            for tup in prim_idx_start_stop:
-                for i in range(tup[0],tup[1]):
-                    first_list.append([i]*(tup[1]-i))
-                    #first_list.append([i]*(tup[1]-i-1) for i in range(tup[0],tup[1]))
-            #print(first_list)
-
-            second_list =[]
-            for tup in prim_idx_start_stop:
-                for i in range(tup[0],tup[1]):
-                    second_list.append(list(range(i+1,tup[1]+1)))
-            #print(second_list)
-
-            #first = np.fromiter(itertools.chain(*[[i]*(natoms-i-1) for i in primitive_indices]),dtype=np.int32)
-            first = np.fromiter(itertools.chain(*first_list),dtype=np.int32)
-            second = np.fromiter(itertools.chain(*second_list),dtype=np.int32)
-
-            #print("HERE")
-            #print(first_o.T)
-            #print("\n")
-            #print(first.T)
-            ##print(second.T)
-
-            AtomIterator = np.ascontiguousarray(
-                    np.vstack((
-                            np.fromiter(itertools.chain(*first_list),dtype=np.int32),
-                            np.fromiter(itertools.chain(*second_list),dtype=np.int32)
-                            )).T
-                    )
-                    #np.fromiter(itertools.chain(*[[i]*(natoms-i-1) for i in primitive_indices]),dtype=np.int32), 
-
+        # Neighbour search with a k-d tree, pairs closer than the largest threshold are candidates
+        candidates = np.where(segment >= 0)[0]
+        cutoff = max(2.0*np.max(R[candidates])*Fac, mindist)
+        tree = cKDTree(xyz[candidates])
+        AtomIterator = candidates[tree.query_pairs(cutoff,output_type='ndarray')]
+        AtomIterator = AtomIterator[segment[AtomIterator[:,0]] == segment[AtomIterator[:,1]]]
 
         # Create a list of thresholds for determining whether a certain interatomic distance is considered to be a bond.
-        BT0 = R[AtomIterator[:,0]]
-        BT1 = R[AtomIterator[:,1]]
-        BondThresh = (BT0+BT1) * Fac
-        BondThresh = (BondThresh > mindist) * BondThresh + (BondThresh < mindist) * mindist
-        #if hasattr( 'boxes') and toppbc:
-        if toppbc:
-            raise NotImplementedError
-            dxij = AtomContact(xyz, AtomIterator, box=np.array([boxes[sn].a, boxes[sn].b, boxes[sn].c]))
-        else:
-            dxij = AtomContact(xyz, AtomIterator)
+        BondThresh = np.maximum((R[AtomIterator[:,0]]+R[AtomIterator[:,1]])*Fac, mindist)
+        dxij = np.linalg.norm(xyz[AtomIterator[:,0]]-xyz[AtomIterator[:,1]],axis=1)
 
         # Update topology settings with what we learned
         top_settings['toppbc'] = toppbc
 
-        # Create a list of atoms that each atom is bonded to.
-        atom_bonds = [[] for i in range(natoms)]
-        #atom_bonds = [[] for i in primitive_indices]
-
-        bond_bool = dxij < BondThresh
-        for i, a in enumerate(bond_bool):
-            if not a: continue
-            (ii, jj) = AtomIterator[i]
-            if ii == jj: continue
-            atom_bonds[ii].append(jj)
-            atom_bonds[jj].append(ii)
-        bondlist = []
-
-        #print("atom_bonds")
-        #print(atom_bonds)
-
-        for i, bi in enumerate(atom_bonds):
-            for j in bi:
-                if i == j: continue
-                # Do not add a bond between resids if fragment is set to True.
-                #if top_settings['fragment'] and 'resid' in Data.keys() and resid[i] != resid[j]:
-                #    continue
-                elif i < j:
-                    bondlist.append((i, j))
-                else:
-                    bondlist.append((j, i))
-        bondlist = sorted(list(set(bondlist)))
-        bonds = sorted(list(set(bondlist)))
-        built_bonds = True
-
-        #print('bond list')
-        #print(bondlist)
+        bonded = np.sort(AtomIterator[dxij < BondThresh],axis=1)
+        bonds = sorted(set(map(tuple,bonded.tolist())))
 
         return bonds
 
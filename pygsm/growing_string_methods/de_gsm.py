@@ -142,14 +142,19 @@ class DE_GSM(MainGSM):
         Grow nodes
         '''
 
+        added = []
         if self.nodes[self.nR-1].gradrms < self.gaddmax and self.growth_direction!=2:
             if self.nodes[self.nR] == None:
                 self.add_GSM_nodeR()
-                print(" getting energy for node %d: %5.4f" %(self.nR-1,self.nodes[self.nR-1].energy - self.nodes[0].V0))
+                added.append(self.nR-1)
         if self.nodes[self.nnodes-self.nP].gradrms < self.gaddmax and self.growth_direction!=1:
             if self.nodes[-self.nP-1] == None:
                 self.add_GSM_nodeP()
-                print(" getting energy for node %d: %5.4f" %(self.nnodes-self.nP,self.nodes[-self.nP].energy - self.nodes[0].V0))
+                added.append(self.nnodes-self.nP)
+        # the new nodes of both ends are calculated together
+        self.evaluate_nodes(added)
+        for n in added:
+            print(" getting energy for node %d: %5.4f" %(n,self.nodes[n].energy - self.nodes[0].V0))
         return
 
 
@@ -13,18 +13,25 @@ from itertools import chain
 
 # local application imports
 sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
-from utilities import nifty,options,manage_xyz
+from utilities import nifty,options,manage_xyz,profiler
 from utilities.manage_xyz import write_molden_geoms
 from wrappers import Molecule
 from coordinate_systems import DelocalizedInternalCoordinates
 from optimizers._linesearch import double_golden_section
 from coordinate_systems import Distance,Angle,Dihedral,OutOfPlane,TranslationX,TranslationY,TranslationZ,RotationA,RotationB,RotationC
 from coordinate_systems.rotate import get_quat,calc_fac_dfac
+try:
+    from .worker_pool import CoordinateWorkerPool
+except:
+    from worker_pool import CoordinateWorkerPool
 
 def worker(arg):
    obj, methname = arg[:2]
    return getattr(obj, methname)(*arg[2:])
 
+# node_id of the level of theory that calculates the batches of evaluate_nodes
+BATCH_NODE_ID = 999
+
 
 #######################################################################################
 #### This class contains the main constructor, object properties and staticmethods ####
@@ -159,6 +166,34 @@ class GSM(object):
                 doc='multiprocessing cores for parallel programming. Use this with caution.',
                 )
 
+        opt.add_option(
+                key='node_workers',
+                value=1,
+                allowed_types=[int],
+                required=False,
+                doc='Number of worker processes used to optimize the active nodes of the string concurrently \
+                        in optimize_iteration. 1 optimizes the nodes one at a time.',
+                )
+
+        opt.add_option(
+                key='async_lot',
+                value=False,
+                allowed_types=[bool],
+                required=False,
+                doc='Submit the energy/gradient jobs of the active nodes at once (Lot.submit) before \
+                        the nodes are optimized, so the external programs run concurrently.',
+                )
+
+        opt.add_option(
+                key='ts_mode_hvp',
+                value=False,
+                allowed_types=[bool],
+                required=False,
+                doc='When the TS Hessian is modified with the reaction path, find the lowest Hessian mode of \
+                        the TS node from finite difference Hessian-vector products (Davidson, a few gradients each) \
+                        seeded with the tangent, put its curvature in the Hessian and follow it in the TS step.',
+                )
+
         opt.add_option(
                 key="BDIST_RATIO",
                 value=0.5,
@@ -231,6 +266,12 @@ class GSM(object):
         self.CONV_TOL = self.options['CONV_TOL']
         self.noise = self.options['noise']
         self.mp_cores = self.options['mp_cores']
+        self.node_workers = self.options['node_workers']
+        self.async_lot = self.options['async_lot']
+        self.ts_mode_hvp = self.options['ts_mode_hvp']
+        self._coordinate_pool = None
+        self._node_pool = None
+        self._batch_lot = None
         self.xyz_writer = self.options['xyz_writer']
 
         optimizer = options['optimizer']
@@ -329,6 +370,25 @@ class GSM(object):
                 E.append(ico.energy - self.nodes[0].energy)
         return E
 
+    def evaluate_string(self,runtype=None):
+        '''
+        Calculates the nodes of the string that moved (optimization steps, reparametrization)
+        together, once per iteration, before their energies are read
+        '''
+        self.evaluate_nodes([n for n,node in enumerate(self.nodes) if node is not None],runtype)
+
+    def node_energies(self,runtype=None):
+        '''
+        Energies of string, runtype energy for the callers that do not need the gradients
+        '''
+        self.evaluate_string(runtype)
+        E0 = self.nodes[0].PES.get_energy(self.nodes[0].xyz,runtype)
+        E = []
+        for ico in self.nodes:
+            if ico != None:
+                E.append(ico.PES.get_energy(ico.xyz,runtype) - E0)
+        return E
+
     @property
     def geometries(self):
         geoms = []
@@ -369,6 +429,88 @@ class GSM(object):
     def dqmaga(self,value):
         self._dqmaga = value
 
+    @property
+    def coordinate_pool(self):
+        '''
+        Worker pool for the build_dlc/newCartesian fan-out, created on first use when mp_cores>1
+        and kept for the lifetime of the string.
+        '''
+        if self._coordinate_pool is None and self.mp_cores>1:
+            self._coordinate_pool = CoordinateWorkerPool(self.mp_cores)
+        return self._coordinate_pool
+
+    @property
+    def node_pool(self):
+        '''
+        Pool of node_workers processes optimizing the nodes, created on first use and
+        kept for the lifetime of the string, so the workers keep their resident servers
+        (driver resident) from one iteration to the next.
+        '''
+        if self._node_pool is None:
+            self._node_pool = mp.Pool(self.node_workers)
+        return self._node_pool
+
+    def batch_lot(self,lot):
+        '''
+        Level of theory object that calculates the batches of evaluate_nodes, a copy of
+        lot made on first use. The node objects keep their own geometry and cache, they
+        only receive the results.
+        '''
+        if type(self._batch_lot) is not type(lot):
+            self._batch_lot = type(lot).copy(lot,{
+                'node_id': BATCH_NODE_ID,
+                'result_cache_size': 0,
+                'result_cache_file': None,
+                'energy_file_interval': 0,
+                },copy_wavefunction=False)
+        return self._batch_lot
+
+    def evaluate_nodes(self,nlist,runtype=None):
+        '''
+        Calculates the energies/gradients of the nodes in nlist before they are used.
+        In-process level of theories (xTB, ASE, OpenMM) calculate them in one
+        runall_batch call, others submit the jobs at once if async_lot.
+        The following energy/gradient calls of the nodes are then answered from
+        the result cache of their level of theory.
+        '''
+        todo = [n for n in nlist if not self.nodes[n].PES.lot.has_results(self.nodes[n].xyz,runtype)]
+
+        batch = [n for n in todo if self.nodes[n].PES.lot.batch_capable and self.nodes[n].PES.lot.result_cache is not None]
+        if len(batch)>1:
+            print(" Calculating {} nodes in one batch".format(len(batch)))
+            lot = self.batch_lot(self.nodes[batch[0]].PES.lot)
+            results = lot.runall_batch([manage_xyz.np_to_xyz(lot.geom,self.nodes[n].xyz) for n in batch],runtype)
+            for n,res in zip(batch,results):
+                self.nodes[n].PES.lot.store_results(self.nodes[n].xyz,res,record=False)
+            todo = [n for n in todo if n not in batch]
+
+        if not self.async_lot:
+            return
+        jobs = [self.nodes[n].PES.lot.submit(self.nodes[n].xyz,runtype) for n in todo]
+        if jobs:
+            print(" Running {} node calculations concurrently".format(len(jobs)))
+            jobs[0].lot.gather(jobs)
+
+    def close_pool(self):
+        if self._coordinate_pool is not None:
+            self._coordinate_pool.close()
+            self._coordinate_pool = None
+        if self._node_pool is not None:
+            # close and join (not terminate), the workers stop their resident servers on exit
+            self._node_pool.close()
+            self._node_pool.join()
+            self._node_pool = None
+
+    def timing_report(self):
+        '''
+        Prints the timers and counters of the run and writes them to timings_<ID>.json
+        '''
+        nifty.printcool("Timings")
+        profiler.print_report()
+        filename = 'timings_{:03d}.json'.format(self.ID)
+        profiler.write_report(filename,ID=self.ID,gsm_type=self.__class__.__name__,nnodes=self.nnodes)
+        print(" wrote {}".format(filename))
+
 
     @staticmethod
     def add_xyz_along_tangent(
@@ -813,7 +955,8 @@ class GSM(object):
     
    
     @staticmethod
-    def ic_reparam(nodes,energies,climbing=False,ic_reparam_steps=8,print_level=1,NUM_CORE=1,MAXRE=0.25):
+    @profiler.timed('ic_reparam')
+    def ic_reparam(nodes,energies,climbing=False,ic_reparam_steps=8,print_level=1,NUM_CORE=1,MAXRE=0.25,pool=None):
         '''
         Reparameterizes the string using Delocalizedin internal coordinatesusing three-way tangents at the TS node
         Only pushes nodes outwards during reparameterization because otherwise too many things change.
@@ -826,9 +969,15 @@ class GSM(object):
         energies : list of energies in kcal/mol
         ic_reparam_steps : int max number of reparameterization steps
         print_level : int verbosity
+        pool : CoordinateWorkerPool, used when NUM_CORE>1. A temporary one is made if not given
     
         '''
         nifty.printcool("reparametrizing string nodes")
+
+        own_pool = False
+        if NUM_CORE>1 and pool is None:
+            pool = CoordinateWorkerPool(NUM_CORE)
+            own_pool = True
     
         nnodes=len(nodes)
         rpart = np.zeros(nnodes)
@@ -937,20 +1086,15 @@ class GSM(object):
 
                     # 5/14/2021 TS node fucks this up?!
                     tans = [ictan[n] if deltadqs[n]<0 else ictan[n+1] for n in chain(range(1,TSnode),range(TSnode+1,nnodes-1))] #+ [ ictan[n] if deltadqs[n]<0 else ictan[n+1] for n in range(TSnode+1,nnodes-1)]
-                    pool = mp.Pool(NUM_CORE)
-                    Vecs = pool.map(worker,((nodes[0].coord_obj,"build_dlc",node.xyz,tan) for node,tan in zip(nodes[1:TSnode] + nodes[TSnode+1:nnodes-1],tans)))
-                    pool.close()
-                    pool.join()
-                    for n,node in enumerate(nodes[1:TSnode] + nodes[TSnode+1:nnodes-1]):
+                    moving = nodes[1:TSnode] + nodes[TSnode+1:nnodes-1]
+                    Vecs = pool.build_dlc(nodes[0].coord_obj,[node.xyz for node in moving],tans)
+                    for n,node in enumerate(moving):
                         node.coord_basis = Vecs[n]
             
                     # move the positions
                     dqs = [deltadqs[n]*nodes[n].constraints[:,0] for n in chain(range(1,TSnode),range(TSnode+1,nnodes-1))]
-                    pool = mp.Pool(NUM_CORE)
-                    newXyzs = pool.map(worker,((node.coord_obj,"newCartesian",node.xyz,dq) for node,dq in zip(nodes[1:TSnode] + nodes[TSnode+1:nnodes-1],dqs)))
-                    pool.close()
-                    pool.join()
-                    for n,node in enumerate(nodes[1:TSnode] + nodes[TSnode+1:nnodes-1]):
+                    newXyzs = pool.newCartesian(nodes[0].coord_obj,[node.xyz for node in moving],dqs,Vecs)
+                    for n,node in enumerate(moving):
                         node.xyz = newXyzs[n]
                 else:
                     for n in chain(range(1,TSnode),range(TSnode+1,nnodes-1)):
@@ -983,18 +1127,12 @@ class GSM(object):
                 if NUM_CORE>1:
                     # Update the coordinate basis
                     tans = [ictan[n] if deltadqs[n]<0 else ictan[n+1] for n in range(1,nnodes-1)]
-                    pool = mp.Pool(NUM_CORE)
-                    Vecs = pool.map(worker,((nodes[0].coord_obj,"build_dlc",node.xyz,tan) for node,tan in zip(nodes[1:nnodes-1],tans)))
-                    pool.close()
-                    pool.join()
+                    Vecs = pool.build_dlc(nodes[0].coord_obj,[node.xyz for node in nodes[1:nnodes-1]],tans)
                     for n,node in enumerate(nodes[1:nnodes-1]):
                         node.coord_basis = Vecs[n]
                     ## move the positions
                     dqs = [deltadqs[n]*nodes[n].constraints[:,0] for n in range(1,nnodes-1)]
-                    pool = mp.Pool(NUM_CORE)
-                    newXyzs = pool.map(worker,((node.coord_obj,"newCartesian",node.xyz,dq) for node,dq in zip(nodes[1:nnodes-1],dqs)))
-                    pool.close()
-                    pool.join()
+                    newXyzs = pool.newCartesian(nodes[0].coord_obj,[node.xyz for node in nodes[1:nnodes-1]],dqs,Vecs)
                     for n,node in enumerate(nodes[1:nnodes-1]):
                         node.xyz = newXyzs[n]
                 else:
@@ -1052,7 +1190,9 @@ class GSM(object):
         for n in range(nnodes):
             print(" {:1.2}".format(dqmaga[n]), end=' ')
         print("\n  disprms: {:1.3}".format(disprms))
-    
+
+        if own_pool:
+            pool.close()
         return
 
     # TODO move to string utils or delete altogether
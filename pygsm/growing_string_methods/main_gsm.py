@@ -10,16 +10,30 @@ except:
 from wrappers.molecule import Molecule
 from utilities.nifty import printcool
 from utilities.manage_xyz import write_molden_geoms,xyz_to_np,get_atoms,np_to_xyz
-from utilities import block_matrix
+from utilities import block_matrix,profiler
 from coordinate_systems import rotate
 from optimizers import eigenvector_follow
 import multiprocessing as mp
 from itertools import chain
+from contextlib import redirect_stdout
+from io import StringIO
 
 def worker(arg):
    obj, methname = arg[:2]
    return getattr(obj, methname)(*arg[2:])
 
+def opt_worker(arg):
+    '''
+    Optimize one node in a worker process. The optimizer and molecule are
+    modified in the child, so both are sent back together with the printout.
+    '''
+    n, optimizer, molecule, kwargs = arg
+    profiler.reset()
+    buf = StringIO()
+    with redirect_stdout(buf):
+        optimizer.optimize(molecule=molecule,**kwargs)
+    return n,optimizer,molecule,buf.getvalue(),profiler.snapshot()
+
 #######################################################################################
 ############### This class contains the main GSM functions  ###########################
 #######################################################################################
@@ -55,6 +69,7 @@ class MainGSM(GSM):
                 # raise Exception(" Ran out of iterations")
             printcool("Starting growth iteration %i" % iteration)
             self.optimize_iteration(max_opt_steps)
+            self.evaluate_string()
             totalgrad,gradrms,sum_gradrms = self.calc_optimization_metrics(self.nodes)
             self.xyz_writer('scratch/growth_iters_{:03}_{:03}.xyz'.format(self.ID,iteration),self.geometries,self.energies,self.gradrmss,self.dEs)
             print(" gopt_iter: {:2} totalgrad: {:4.3} gradrms: {:5.4} max E: {:5.4}\n".format(iteration,float(totalgrad),float(gradrms),float(self.emax)))
@@ -162,6 +177,7 @@ class MainGSM(GSM):
             # => do opt steps <= #
             self.set_node_convergence()
             self.optimize_iteration(opt_steps)
+            self.evaluate_string()
 
             print(" V_profile: ", end=' ')
             self.print_energies()
@@ -263,6 +279,7 @@ class MainGSM(GSM):
             # => Reparam the String <= #
             if oi<max_iter and not isConverged:
                 self.reparameterize(nconstraints=nconstraints)
+                self.evaluate_string()
                 self.get_tangents_opting()
                 self.refresh_coordinates()
                 if self.pTSnode!=self.TSnode and self.climb:
@@ -295,16 +312,10 @@ class MainGSM(GSM):
                         self.nodes[n].coord_basis = Vecs
 
             else:
-                pool = mp.Pool(self.mp_cores)
-                Vecs = pool.map(worker,((self.newic.coord_obj,"build_dlc",self.nodes[n].xyz,self.ictan[n]) for n in range(1,self.nnodes-1) if self.nodes[n] is not None ))
-                pool.close()
-                pool.join()
-    
-                i=0
-                for n in range(1,self.nnodes-1):
-                    if self.nodes[n] is not None:
-                        self.nodes[n].coord_basis = Vecs[i]
-                        i+=1
+                nlist = [n for n in range(1,self.nnodes-1) if self.nodes[n] is not None]
+                Vecs = self.coordinate_pool.build_dlc(self.newic.coord_obj,[self.nodes[n].xyz for n in nlist],[self.ictan[n] for n in nlist])
+                for n,Vec in zip(nlist,Vecs):
+                    self.nodes[n].coord_basis = Vec
         else:
             if self.find or self.climb:            
                 energies = self.energies
@@ -316,12 +327,10 @@ class MainGSM(GSM):
                             Vecs = self.newic.coord_obj.build_dlc(self.nodes[n].xyz,self.ictan[n])
                             self.nodes[n].coord_basis = Vecs
                 else:
-                    pool = mp.Pool(self.mp_cores)
-                    Vecs = pool.map(worker,((self.newic.coord_obj,"build_dlc",self.nodes[n].xyz,self.ictan[n]) for n in range(1,self.nnodes-1) if n!=TSnode))
-                    pool.close()
-                    pool.join()
-                    for i,n in enumerate(chain(range(1,TSnode),range(TSnode+1,self.nnodes-1))):
-                        self.nodes[n].coord_basis = Vecs[i]
+                    nlist = list(chain(range(1,TSnode),range(TSnode+1,self.nnodes-1)))
+                    Vecs = self.coordinate_pool.build_dlc(self.newic.coord_obj,[self.nodes[n].xyz for n in nlist],[self.ictan[n] for n in nlist])
+                    for n,Vec in zip(nlist,Vecs):
+                        self.nodes[n].coord_basis = Vec
 
                     if update_TS:
                         Vec = self.newic.coord_obj.build_dlc(self.nodes[TSnode].xyz,self.ictan[TSnode])
@@ -336,10 +345,8 @@ class MainGSM(GSM):
                     for n in range(1,self.nnodes-1):
                         Vecs.append(self.newic.coord_obj.build_dlc(self.nodes[n].xyz,self.ictan[n]))
                 elif self.mp_cores>1:
-                    pool = mp.Pool(self.mp_cores)
-                    Vecs = pool.map(worker,((self.newic.coord_obj,"build_dlc",self.nodes[n].xyz,self.ictan[n]) for n in range(1,self.nnodes-1)))
-                    pool.close()
-                    pool.join()
+                    nlist = range(1,self.nnodes-1)
+                    Vecs = self.coordinate_pool.build_dlc(self.newic.coord_obj,[self.nodes[n].xyz for n in nlist],[self.ictan[n] for n in nlist])
                 for n,node in enumerate(self.nodes[1:self.nnodes-1]):
                     node.coord_basis = Vecs[n]
 
@@ -351,22 +358,33 @@ class MainGSM(GSM):
 
         refE=self.nodes[0].energy
 
-        for n in range(self.nnodes):
-            if self.nodes[n] and self.active[n]:
-                print()
-                path=os.path.join(os.getcwd(),'scratch/{:03d}/{}'.format(self.ID,n))
-                printcool("Optimizing node {}".format(n))
-                opt_type = self.set_opt_type(n)
-                osteps = self.mult_steps(n,opt_steps)
-                self.optimizer[n].optimize(
-                        molecule=self.nodes[n],
-                        refE=refE,
-                        opt_type=opt_type,
-                        opt_steps=osteps,
-                        ictan=self.ictan[n],
-                        xyzframerate=1,
-                        path=path,
-                        )
+        self.evaluate_nodes([n for n in range(self.nnodes) if self.nodes[n] and self.active[n]])
+        if self.node_workers>1:
+            self.optimize_nodes_parallel(refE,opt_steps)
+        else:
+            for n in range(self.nnodes):
+                if self.nodes[n] and self.active[n]:
+                    print()
+                    path=os.path.join(os.getcwd(),'scratch/{:03d}/{}'.format(self.ID,n))
+                    printcool("Optimizing node {}".format(n))
+                    opt_type = self.set_opt_type(n)
+                    osteps = self.mult_steps(n,opt_steps)
+                    self.optimizer[n].optimize(
+                            molecule=self.nodes[n],
+                            refE=refE,
+                            opt_type=opt_type,
+                            opt_steps=osteps,
+                            ictan=self.ictan[n],
+                            xyzframerate=1,
+                            path=path,
+                            )
+
+        if self.print_level>1:
+            for n in range(self.nnodes):
+                if self.nodes[n] and self.active[n] and hasattr(self.nodes[n].coord_obj,'print_cache_stats'):
+                    self.nodes[n].coord_obj.print_cache_stats('node {}'.format(n))
+                if self.nodes[n] and self.active[n] and hasattr(self.nodes[n].PES.lot,'print_result_cache_stats'):
+                    self.nodes[n].PES.lot.print_result_cache_stats('node {}'.format(n))
 
         if self.__class__.__name__=="SE-GSM" and self.done_growing:
             fp = self.find_peaks('opting')
@@ -377,13 +395,50 @@ class MainGSM(GSM):
                         molecule=self.nodes[self.nnodes-1],
                         refE=refE,
                         opt_type='UNCONSTRAINED',
-                        opt_steps=osteps,
+                        opt_steps=self.mult_steps(self.nnodes-1,opt_steps),
                         ictan=None,
                         path=path
                         )
 
 
 
+    def optimize_nodes_parallel(self,refE,opt_steps):
+        '''
+        Optimize the active nodes at the same time with the pool of node_workers processes.
+        opt_type and steps are set in node order before dispatching, and the optimized
+        molecule and optimizer are written back to the same node index.
+        '''
+
+        jobs=[]
+        for n in range(self.nnodes):
+            if self.nodes[n] and self.active[n]:
+                path=os.path.join(os.getcwd(),'scratch/{:03d}/{}'.format(self.ID,n))
+                opt_type = self.set_opt_type(n)
+                osteps = self.mult_steps(n,opt_steps)
+                kwargs = {
+                        'refE':refE,
+                        'opt_type':opt_type,
+                        'opt_steps':osteps,
+                        'ictan':self.ictan[n],
+                        'xyzframerate':1,
+                        'path':path,
+                        }
+                jobs.append((n,self.optimizer[n],self.nodes[n],kwargs))
+        if not jobs:
+            return
+
+        printcool("Optimizing nodes {} with {} workers".format([job[0] for job in jobs],self.node_workers))
+        results = self.node_pool.map(opt_worker,jobs,chunksize=1)
+
+        for n,optimizer,molecule,output,timings in results:
+            print()
+            printcool("Optimizing node {}".format(n))
+            print(output,end='')
+            profiler.merge(timings)
+            self.optimizer[n] = optimizer
+            self.nodes[n] = molecule
+        return
+
     def get_tangents_opting(self,print_level=1):
         if self.climb or self.find:
             self.ictan,self.dqmaga = self.get_three_way_tangents(self.nodes,self.energies)
@@ -624,11 +679,12 @@ class MainGSM(GSM):
         '''
         if self.interp_method == 'DLC':
             # print('reparameterizing')
-            self.ic_reparam(nodes=self.nodes,energies=self.energies,climbing=(self.climb or self.find),ic_reparam_steps=ic_reparam_steps,NUM_CORE=self.mp_cores)
+            self.ic_reparam(nodes=self.nodes,energies=self.energies,climbing=(self.climb or self.find),ic_reparam_steps=ic_reparam_steps,NUM_CORE=self.mp_cores,pool=self.coordinate_pool)
         return
 
     
 
+    @profiler.timed('ic_reparam_g')
     def ic_reparam_g(self,ic_reparam_steps=4,n0=0,reparam_interior=True):  #see line 3863 of gstring.cpp
         """
         Reparameterize during growth phase        
@@ -721,27 +777,16 @@ class MainGSM(GSM):
 
 
             if self.mp_cores>1:
-                pool = mp.Pool(self.mp_cores)
-                Vecs = pool.map(worker,((self.nodes[0].coord_obj,"build_dlc",self.nodes[n].xyz,self.ictan[ntan]) for n,ntan in zip(move_list,tan_list) if rpmove[n]<0))
-                pool.close()
-                pool.join()
-
-                i=0
-                for n in move_list:
-                    if rpmove[n]<0:
-                        self.nodes[n].coord_basis = Vecs[i]
-                        i+=1
+                moving = [(n,ntan) for n,ntan in zip(move_list,tan_list) if rpmove[n]<0]
+                Vecs = self.coordinate_pool.build_dlc(self.nodes[0].coord_obj,[self.nodes[n].xyz for n,ntan in moving],[self.ictan[ntan] for n,ntan in moving])
+                for (n,ntan),Vec in zip(moving,Vecs):
+                    self.nodes[n].coord_basis = Vec
             
                 # move the positions
-                pool = mp.Pool(self.mp_cores)
-                newXyzs = pool.map(worker,((self.nodes[n].coord_obj,"newCartesian",self.nodes[n].xyz,rpmove[n]*self.nodes[n].constraints[:,0]) for n in move_list if rpmove[n]<0))
-                pool.close()
-                pool.join()
-                i=0
-                for n in move_list:
-                    if rpmove[n]<0:
-                        self.nodes[n].xyz = newXyzs[i]
-                        i+=1
+                dqs = [rpmove[n]*self.nodes[n].constraints[:,0] for n,ntan in moving]
+                newXyzs = self.coordinate_pool.newCartesian(self.nodes[0].coord_obj,[self.nodes[n].xyz for n,ntan in moving],dqs,Vecs)
+                for (n,ntan),xyz in zip(moving,newXyzs):
+                    self.nodes[n].xyz = xyz
             else:
                 for nmove,ntan in zip(move_list,tan_list):
                     if rpmove[nmove] <0:
@@ -812,6 +857,17 @@ class MainGSM(GSM):
         Ht = np.dot(self.newic.Hessian,tan)                         # (nicd,nicd)(nicd,1) = nicd,1
         tHt = np.dot(tan.T,Ht) 
 
+        if self.ts_mode_hvp:
+            # exact curvature along the lowest mode, the rest of the Hessian is kept
+            eig,mode = self.nodes[TSnode].lowest_Hessian_mode(tan,precond=self.newic.Hessian)
+            P = np.eye(len(mode)) - np.outer(mode,mode)
+            self.newic.Hessian = np.dot(P,np.dot(self.newic.Hessian,P)) + eig*np.outer(mode,mode)
+            self.nodes[TSnode].TS_mode = block_matrix.dot(Vecs,mode)
+            print(" tHt %1.3f lowest mode curvature %1.3f overlap with tangent %1.2f" % (tHt,eig,abs(np.dot(mode.T,tan)[0,0])/np.linalg.norm(tan)))
+            self.nodes[TSnode].Hessian = self.newic.Hessian.copy()
+            self.nodes[TSnode].newHess = 5
+            return
+
         a = abs(q0-qm1)
         b = abs(qp1-q0)
         c = 2*(Em1/a/(a+b) - E0/a/b + Ep1/b/(a+b))
@@ -977,7 +1033,8 @@ class MainGSM(GSM):
         alluptol2=0.5
         allup=True
         diss=False
-        energies = self.energies
+        # only the energy profile is needed
+        energies = self.node_energies('energy')
         for n in range(1,len(energies[:nnodes])):
             if energies[n]+alluptol<energies[n-1]:
                 allup=False
@@ -1201,6 +1258,7 @@ class MainGSM(GSM):
             self.xyz_writer('grown_string_{:03}.xyz'.format(self.ID),self.geometries,self.energies,self.gradrmss,self.dEs)
 
         if restart_energies:
+            self.evaluate_nodes(range(nstructs-1))
             # initial energy
             self.nodes[0].V0 = self.nodes[0].energy 
             self.energies[0] = 0.
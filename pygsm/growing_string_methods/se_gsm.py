@@ -233,6 +233,7 @@ class SE_GSM(MainGSM):
         for i in range(newnodes):
             self.add_GSM_nodeR()
 
+    @profiler.timed('ic_reparam_g')
     def ic_reparam_g(self,ic_reparam_steps=4,n0=0,nconstraints=1):  #see line 3863 of gstring.cpp
         '''
         Dont do ic_reparam_g for SE-GSM
@@ -0,0 +1,165 @@
+from __future__ import print_function
+
+# standard library imports
+import multiprocessing as mp
+import traceback
+from collections import OrderedDict
+
+# third party
+import numpy as np
+
+# local application imports
+from utilities import nifty
+
+# coordinate objects kept in the workers, e.g. the one of newic and the one of the reactant
+MAX_RESIDENT = 4
+
+
+def _fingerprint(coord_obj):
+    '''
+    The state of a coordinate object the workers depend on, so that the object is
+    only sent to the workers again when it changes: the primitives (Prims.basis_version
+    and the version of the primitive list, bumped by every change of the primitives)
+    and the settings (the scalar and array options). The basis (Vecs) goes with each job.
+    '''
+    settings = []
+    for key in coord_obj.options.keys():
+        value = coord_obj.options[key]
+        if isinstance(value, np.ndarray):
+            value = hash(value.tobytes())
+        elif not isinstance(value, (bool, int, float, str, type(None))):
+            continue
+        settings.append((key, value))
+    return (coord_obj.Prims.basis_version, coord_obj.Prims.Internals.version, tuple(settings))
+
+
+def _worker_loop(conn):
+    '''
+    Worker process main loop. The coordinate objects are received once and
+    kept resident, afterwards only arrays are sent through the pipe.
+    '''
+    resident = {}
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        task = msg[0]
+        if task == 'close':
+            break
+        try:
+            if task == 'set':
+                resident[msg[1]] = msg[2]
+                continue
+            elif task == 'drop':
+                resident.pop(msg[1], None)
+                continue
+            coord_obj = resident[msg[1]]
+            if task == 'build_dlc':
+                results = [coord_obj.build_dlc(xyz, tan) for xyz, tan in msg[2]]
+            elif task == 'newCartesian':
+                results = []
+                for xyz, dq, Vecs in msg[2]:
+                    # setting Vecs changes basis_version, which is part of the cache keys
+                    coord_obj.Vecs = Vecs
+                    results.append(coord_obj.newCartesian(xyz, dq))
+            else:
+                raise ValueError("unknown task {}".format(task))
+            conn.send((True, results))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+    conn.close()
+
+
+class CoordinateWorkerPool(object):
+    '''
+    Long-lived pool of processes for the build_dlc/newCartesian fan-out of a string.
+
+    Each worker holds its own copies of the string coordinate objects (up to
+    MAX_RESIDENT), which are sent only once (and again only if their primitives
+    or options change, see _fingerprint). Per call only xyz, tangent/dq arrays
+    and the coordinate basis are sent. Jobs are distributed round-robin and the
+    results are returned in the order they were given.
+    '''
+
+    def __init__(self, nprocs):
+        self.nprocs = nprocs
+        # id(coord_obj) -> (coord_obj,fingerprint), the reference keeps the id from being reused
+        self.resident = OrderedDict()
+        self.conns = []
+        self.procs = []
+        for i in range(nprocs):
+            parent_conn, child_conn = mp.Pipe()
+            p = mp.Process(target=_worker_loop, args=(child_conn,))
+            p.daemon = True
+            p.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.procs.append(p)
+        print(" Started coordinate worker pool with {} processes".format(nprocs))
+
+    def set_coord_obj(self, coord_obj):
+        ''' Sends coord_obj to the workers if they don't have it in this state, returns its key '''
+        key = id(coord_obj)
+        fingerprint = _fingerprint(coord_obj)
+        if key in self.resident and self.resident[key][1] == fingerprint:
+            self.resident.move_to_end(key)
+            return key
+        for conn in self.conns:
+            conn.send(('set', key, coord_obj))
+        self.resident[key] = (coord_obj, fingerprint)
+        self.resident.move_to_end(key)
+        while len(self.resident) > MAX_RESIDENT:
+            old, _ = self.resident.popitem(last=False)
+            for conn in self.conns:
+                conn.send(('drop', old))
+        return key
+
+    def _map(self, task, key, jobs):
+        jobs = list(jobs)
+        nworkers = min(self.nprocs, len(jobs))
+        chunks = [jobs[i::self.nprocs] for i in range(nworkers)]
+        for conn, chunk in zip(self.conns, chunks):
+            conn.send((task, key, chunk))
+
+        answers = []
+        errors = []
+        for conn in self.conns[:nworkers]:
+            ok, ans = conn.recv()
+            if not ok:
+                errors.append(ans)
+            answers.append(ans)
+        if errors:
+            raise RuntimeError("coordinate worker failed:\n{}".format(errors[0]))
+
+        # undo the round-robin distribution
+        results = [None]*len(jobs)
+        for i, ans in enumerate(answers):
+            results[i::self.nprocs] = ans
+        return results
+
+    def build_dlc(self, coord_obj, xyzs, tans):
+        ''' Returns the coordinate basis for each (xyz,tangent) pair '''
+        key = self.set_coord_obj(coord_obj)
+        return self._map('build_dlc', key, zip(xyzs, tans))
+
+    def newCartesian(self, coord_obj, xyzs, dqs, Vecs):
+        ''' Returns the new Cartesian coordinates for each (xyz,dq,basis) '''
+        key = self.set_coord_obj(coord_obj)
+        return self._map('newCartesian', key, zip(xyzs, dqs, Vecs))
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(('close',))
+                conn.close()
+            except (OSError, IOError):
+                pass
+        for p in self.procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                nifty.logger.warning(" coordinate worker {} did not exit, terminating".format(p.pid))
+                p.terminate()
+        self.conns = []
+        self.procs = []
+        self.resident = OrderedDict()
@@ -26,11 +26,16 @@ class ASELoT(Lot):
     Warning:
         multiplicity is not implemented, the calculator ignores it
     """
+    batch_capable = True
+
+    # the copies share the ASE calculator
+    thread_safe = False
 
     def __init__(self, calculator: Calculator, options):
         super(ASELoT, self).__init__(options)
 
         self.ase_calculator = calculator
+        self.batch_atoms = None
 
     @classmethod
     def from_options(cls, calculator: Calculator, **kwargs):
@@ -42,6 +47,12 @@ class ASELoT(Lot):
         assert isinstance(lot, ASELoT)
         return cls(lot.ase_calculator, lot.options.copy().set_values(options))
 
+    def fingerprint_settings(self):
+        # the calculator and its parameters
+        calc = self.ase_calculator
+        parameters = calc.todict() if hasattr(calc, "todict") else {}
+        return (type(calc).__module__, type(calc).__name__, sorted((k, repr(v)) for k, v in parameters.items()))
+
     @classmethod
     def from_calculator_string(cls, calculator_import: str, calculator_kwargs: dict = dict(), **kwargs):
         # this imports the calculator
@@ -69,7 +80,21 @@ class ASELoT(Lot):
 
     def run(self, geom, mult, ad_idx, runtype='gradient'):
         # run ASE
-        self.run_ase_atoms(xyz_to_ase(geom), mult, ad_idx, runtype)
+        if self.batch_atoms is not None:
+            # within runall_batch only the positions of the Atoms object change
+            self.batch_atoms.set_positions([x[1:4] for x in geom])
+            self.run_ase_atoms(self.batch_atoms, mult, ad_idx, runtype)
+        else:
+            self.run_ase_atoms(xyz_to_ase(geom), mult, ad_idx, runtype)
+
+    def batch_setup(self):
+        super(ASELoT, self).batch_setup()
+        self.batch_atoms = xyz_to_ase(self.geom)
+        self.batch_atoms.set_calculator(self.ase_calculator)
+
+    def batch_teardown(self):
+        self.batch_atoms = None
+        super(ASELoT, self).batch_teardown()
 
     def run_ase_atoms(self, atoms: Atoms, mult, ad_idx, runtype='gradient'):
         # set the calculator
@@ -0,0 +1,86 @@
+# standard library imports
+import threading
+from concurrent import futures
+
+'''
+Backends for Lot.submit. A backend runs a job (a callable) and returns a
+concurrent.futures.Future.
+
+ thread  jobs run in a pool of threads of this process. The external programs
+         (QChem, TeraChem, ORCA, ...) run as subprocesses, so the jobs of
+         different nodes overlap.
+ serial  jobs run immediately in the calling thread. Pure-Python stand-in that
+         needs no threads, useful for testing and debugging.
+'''
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class SerialExecutor(object):
+    ''' Executor with the concurrent.futures interface that runs the job at submission '''
+
+    def submit(self, fn, *args, **kwargs):
+        future = futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def get_executor(backend, workers):
+    ''' Executors are shared by all level of theory objects of the process '''
+    key = (backend, workers)
+    with _executors_lock:
+        if key not in _executors:
+            if backend == 'thread':
+                _executors[key] = futures.ThreadPoolExecutor(max_workers=workers)
+            elif backend == 'serial':
+                _executors[key] = SerialExecutor()
+            else:
+                raise ValueError("unknown async backend {}".format(backend))
+        return _executors[key]
+
+
+def shutdown_executors():
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=True)
+        _executors.clear()
+
+
+class LotFuture(object):
+    '''
+    Handle of a job submitted with Lot.submit. result() waits for the job and
+    returns the dictionaries of Energies, Gradients and Couplings, re-raising
+    any exception of the job.
+    '''
+
+    def __init__(self, lot, coords, future):
+        self.lot = lot
+        self.coords = coords
+        self.future = future
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        try:
+            return self.future.result(timeout)
+        finally:
+            if self.future.done() and self.lot._pending is self:
+                self.lot._pending = None
+
+    def __repr__(self):
+        state = 'done' if self.done() else 'running'
+        return "LotFuture({} node {} {})".format(self.lot.__class__.__name__, self.lot.node_id, state)
+
+
+def gather(lot_futures, timeout=None):
+    ''' Waits for all the jobs and returns their results in order '''
+    futures.wait([f.future for f in lot_futures], timeout=timeout)
+    return [f.result(timeout=0 if timeout is not None else None) for f in lot_futures]
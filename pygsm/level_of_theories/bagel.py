@@ -14,9 +14,11 @@ sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
 try:
     from .base_lot import Lot
     from .file_options import File_Options
+    from . import scratch
 except:
     from base_lot import Lot
     from file_options import File_Options
+    import scratch
 from utilities import *
 
 class BAGEL(Lot):
@@ -25,7 +27,7 @@ class BAGEL(Lot):
         super(BAGEL,self).__init__(options)
 
         print(" making folder scratch/{}".format(self.node_id))
-        os.system('mkdir -p scratch/{}'.format(self.node_id))
+        scratch.makedirs('scratch/{}'.format(self.node_id))
 
         # regular options
         self.file_options.set_active('basis','6-31g',str,'')
@@ -79,13 +81,16 @@ class BAGEL(Lot):
         for key in self.file_options.ActiveOptions:
             setattr(self, key, self.file_options.ActiveOptions[key])
 
+    def scratch_dirs(self):
+        return super(BAGEL,self).scratch_dirs() + ['scratch/{}'.format(self.node_id)]
+
     @classmethod
     def copy(cls,lot,options,copy_wavefunction=True):
 
         # Get node id for new struct
         node_id = options.get('node_id',1)
         print(" making folder scratch/{}".format(node_id))
-        os.system('mkdir -p scratch/{}'.format(node_id))
+        scratch.makedirs('scratch/{}'.format(node_id))
 
         file_options = File_Options.copy(lot.file_options)
         options['file_options'] = file_options
@@ -93,10 +98,8 @@ class BAGEL(Lot):
         if node_id != lot.node_id and copy_wavefunction:
             old_path = 'scratch/{}/orbs.archive'.format(lot.node_id)
             new_path = 'scratch/{}/orbs.archive'.format(node_id)
-            cmd = 'cp -r ' + old_path +' ' + new_path
-            print(" copying scr files\n {}".format(cmd))
-            os.system(cmd)
-            os.system('wait')
+            print(" copying scr files\n {} {}".format(old_path,new_path))
+            scratch.copy(old_path,new_path)
         return cls(lot.options.copy().set_values(options))
 
     def write_input(self,geom,runtype='gradient'):
@@ -1,29 +1,47 @@
 # standard library imports
 import os
+import pickle
+import hashlib
 
 # third party 
 import numpy as np
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
 
 # local application imports
-from utilities import manage_xyz,options,elements,nifty,units
+from utilities import manage_xyz,options,elements,nifty,units,profiler
+from utilities.lru_cache import LRUCache
 try:
     from .file_options import File_Options
+    from .gradient_db import GradientDB
+    from . import async_jobs
+    from . import resident_driver
+    from . import scratch
 except:
     from file_options import File_Options
+    from gradient_db import GradientDB
+    import async_jobs
+    import resident_driver
+    import scratch
 
 ELEMENT_TABLE = elements.ElementData()
 from collections import namedtuple
 
+# module level so that results (and Lot objects) can be pickled
+Energy = namedtuple('Energy','value unit')
+Gradient = namedtuple('Gradient','value unit')
+Coupling = namedtuple('Coupling','value unit')
+
 #TODO take out all job-specific data -- encourage external files since those are most customizable
 #TODO fix tuple searches
 
 #TODO Make energies,grada dictionaries
 
 def copy_file(path1,path2):
-   cmd = 'cp -r ' + path1 +' ' + path2
-   print(" copying scr files\n {}".format(cmd))
-   os.system(cmd)
-   os.system('wait')
+   print(" copying scr files\n {} {}".format(path1,path2))
+   return scratch.copy(path1,path2)
 
 
 class LoTError(Exception):
@@ -33,6 +51,17 @@ class LoTError(Exception):
 class Lot(object):
     """ Lot object for level of theory calculators """
 
+    # runall_batch is cheaper than one job per geometry (in-process calculators)
+    batch_capable = False
+
+    # run_multistate calculates all the states in one program invocation
+    multistate_capable = False
+
+    # copies of the object can run jobs at the same time in threads of one process
+    # (the finite difference Hessian workers). Not for in-process calculators that
+    # share an engine or calculator object between the copies
+    thread_safe = True
+
     @staticmethod
     def default_options():
         """ Lot default options. """
@@ -174,6 +203,156 @@ class Lot(object):
                 doc='xTB electronic_temperature'
                 )
 
+        opt.add_option(
+                key='result_cache_size',
+                value=0,
+                required=False,
+                allowed_types=[int],
+                doc='maximum number of energies/gradients/couplings kept in the result cache.\
+                     Each (multiplicity,state) result at a geometry is one entry. 0 (the default) disables\
+                     the cache. Needed for the batched evaluation of the nodes (GSM.evaluate_nodes) of\
+                     in-process backends, which hands the results over through it.'
+                )
+
+        opt.add_option(
+                key='result_cache_decimals',
+                value=8,
+                required=False,
+                allowed_types=[int],
+                doc='number of decimals (Angstrom) the coordinates are rounded to when looking up the result cache'
+                )
+
+        opt.add_option(
+                key='result_cache_file',
+                value=None,
+                required=False,
+                allowed_types=[str],
+                doc='file to persist the result cache to. Each node has its own file, with the node_id\
+                     before the extension (cache.pkl -> cache_3.pkl). It is read on construction if it exists\
+                     and the results of each new calculation are appended to it. The file is not tied to a\
+                     level of theory, only use it with the same settings.'
+                )
+
+        opt.add_option(
+                key='gradient_db',
+                value=None,
+                required=False,
+                allowed_types=[str],
+                doc='SQLite file recording every energy/gradient/coupling calculated. Records\
+                     are keyed by the level of theory settings (class, lot_inp_file contents,\
+                     charge, states) and the geometry, later runs answer from it.'
+                )
+
+        opt.add_option(
+                key='gradient_db_tol',
+                value=1e-5,
+                required=False,
+                allowed_types=[float],
+                doc='maximum deviation (Angstrom) of any Cartesian component for a gradient_db record to be used'
+                )
+
+        opt.add_option(
+                key='async_backend',
+                value='thread',
+                required=False,
+                allowed_types=[str],
+                allowed_values=['thread','serial'],
+                doc='backend running the jobs of submit. thread runs them in a thread pool\
+                     (the external programs run concurrently), serial runs them at submission.'
+                )
+
+        opt.add_option(
+                key='async_workers',
+                value=4,
+                required=False,
+                allowed_types=[int],
+                doc='maximum number of jobs running at the same time with the thread backend'
+                )
+
+        opt.add_option(
+                key='lazy_gradients',
+                value=False,
+                required=False,
+                allowed_types=[bool],
+                doc='the callers that only need energies (line searches, peak search, energy grids) pass\
+                     runtype energy to get_energy, with lazy_gradients these are energy-only jobs and the\
+                     gradients are calculated when get_gradient asks for them. Without it they are full jobs.'
+                )
+
+        opt.add_option(
+                key='multistate_job',
+                value=False,
+                required=False,
+                allowed_types=[bool],
+                doc='runall calculates the energies, gradients and coupling of all the states in one\
+                     program invocation (run_multistate) instead of one run per state. Only for the\
+                     backends that support it (multistate_capable).'
+                )
+
+        opt.add_option(
+                key='scratch_root',
+                value='scratch',
+                required=False,
+                allowed_types=[str],
+                doc='folder holding the scratch folders {ID:03}/{node_id} of the programs, e.g. a\
+                     memory file system (/dev/shm/pygsm) instead of a shared file system'
+                )
+
+        opt.add_option(
+                key='energy_file_interval',
+                value=1,
+                required=False,
+                allowed_types=[int],
+                doc='write the energies to E_{node_id}.txt in the scratch folder every this many\
+                     jobs (1 after every job). 0 never writes the file.'
+                )
+
+        opt.add_option(
+                key='driver',
+                value='subprocess',
+                required=False,
+                allowed_types=[str],
+                allowed_values=['subprocess','resident'],
+                doc='subprocess starts the program for every job. resident sends the geometries to\
+                     a long-lived server (one per worker thread) and reads back the energies,\
+                     gradients and coupling, see resident_driver.'
+                )
+
+        opt.add_option(
+                key='server_protocol',
+                value='json',
+                required=False,
+                allowed_types=[str],
+                allowed_values=['json','tcpb'],
+                doc='protocol of the resident server, json (e.g. fake_server.py) or tcpb\
+                     (TeraChem protocol buffer server, terachem -s PORT)'
+                )
+
+        opt.add_option(
+                key='server_address',
+                value=None,
+                required=False,
+                allowed_types=[str],
+                doc='host:port of a running resident server'
+                )
+
+        opt.add_option(
+                key='server_command',
+                value=None,
+                required=False,
+                allowed_types=[str],
+                doc='command starting a resident server for each worker when server_address\
+                     is not given, {port} is replaced by a free port. e.g. "terachem -s {port}"'
+                )
+
+        opt.add_option(
+                key='server_timeout',
+                value=60.,
+                required=False,
+                allowed_types=[float,int],
+                doc='seconds to wait for the resident server to accept the connection'
+                )
+
         Lot._default_options = opt
         return Lot._default_options.copy()
 
@@ -185,9 +364,9 @@ class Lot(object):
         self.options = options
 
         # properties
-        self.Energy = namedtuple('Energy','value unit')
-        self.Gradient = namedtuple('Gradient','value unit')
-        self.Coupling = namedtuple('Coupling','value unit')
+        self.Energy = Energy
+        self.Gradient = Gradient
+        self.Coupling = Coupling
         self._Energies={}
         self._Gradients={}
         self._Couplings={}
@@ -253,6 +432,23 @@ class Lot(object):
         self.hasRanForCurrentCoords =False
         self.has_nelectrons =False
 
+        # Results of previous calculations
+        if self.options['result_cache_size']>0:
+            self.result_cache = LRUCache(max_bytes=None,max_entries=self.options['result_cache_size'])
+            self.load_result_cache()
+        else:
+            self.result_cache = None
+
+        # opened on first use, see gradient_db
+        self._gradient_db = None
+
+        # job submitted with submit that has not been waited for
+        self._pending = None
+
+        if self.options['multistate_job'] and not self.multistate_capable:
+            print(" {} runs one job per state, turning off multistate_job".format(type(self).__name__))
+            self.options['multistate_job'] = False
+
         # Read file options if they exist and not already set
         if self.file_options is None:
             self.file_options = File_Options(self.lot_inp_file)
@@ -264,8 +460,10 @@ class Lot(object):
         # pytc? TODO
         self.options['job_data']['lot'] = self.options['job_data'].get('lot',None)
 
-        print(" making folder scratch/{:03}/{}".format(self.ID,self.node_id))
-        os.system('mkdir -p scratch/{:03}/{}'.format(self.ID,self.node_id))
+        self.scratch = scratch.Scratch(self.options['scratch_root'],self.ID,self.node_id)
+        self._energy_file_count = 0
+        print(" making folder {}".format(self.scratch.node_dir))
+        self.scratch.create()
 
     @classmethod
     def from_options(cls,**kwargs):
@@ -367,7 +565,55 @@ class Lot(object):
 
     @classmethod
     def copy(cls,lot,options,copy_wavefunction=True):
-        return cls(lot.options.copy().set_values(options))
+        new = cls(lot.options.copy().set_values(options))
+        if copy_wavefunction and new.node_id!=lot.node_id:
+            new.seed_guess(lot)
+        return new
+
+    def scratch_dirs(self):
+        '''
+        The folders this object writes its files to. Backends that keep files
+        outside of the node folder add theirs.
+        '''
+        return [self.scratch.node_dir]
+
+    def remove_scratch(self):
+        ''' Removes the scratch folders of a temporary copy '''
+        for path in self.scratch_dirs():
+            scratch.remove(path)
+
+    def wavefunction_files(self):
+        '''
+        The files (or folders) in which the program leaves the orbitals or CAS vectors
+        of this node, as a dictionary label:path. The next job of the node starts
+        from them, and a new node copied from this one gets them (seed_guess).
+        Backends with a guess override it.
+        '''
+        return {}
+
+    def has_wavefunction(self,label):
+        return os.path.exists(self.wavefunction_files()[label])
+
+    def use_guess(self,labels):
+        ''' Called after seed_guess copied the wavefunction files labels '''
+        pass
+
+    def seed_guess(self,lot):
+        '''
+        Starts the next job from the wavefunction of lot, the neighbouring node this
+        object is copied from, instead of a cold guess. Returns the labels copied.
+        '''
+        dest = self.wavefunction_files()
+        labels = []
+        for label,path in lot.wavefunction_files().items():
+            if label in dest and dest[label]!=path and lot.has_wavefunction(label):
+                scratch.remove(dest[label])
+                scratch.copy(path,dest[label])
+                labels.append(label)
+        if labels:
+            print(" node {} starts from the wavefunction of node {} ({})".format(self.node_id,lot.node_id,', '.join(str(l) for l in labels)))
+            self.use_guess(labels)
+        return labels
 
     def check_multiplicity(self,multiplicity):
         if multiplicity > self.n_electrons + 1:
@@ -386,13 +632,280 @@ class Lot(object):
         self.check_multiplicity(multiplicity)
         return 
 
-    def get_energy(self,coords,multiplicity,state,runtype=None):
-        if self.hasRanForCurrentCoords==False or (coords != self.currentCoords).any():
-            self.currentCoords = coords.copy()
-            geom = manage_xyz.np_to_xyz(self.geom,self.currentCoords)
+    def _result_key(self,coords,kind,key):
+        coords = np.round(np.asarray(coords,dtype=float),self.options['result_cache_decimals'])+0.  # +0. to fold -0.
+        return (coords.tobytes(),kind)+tuple(key)
+
+    def lookup_result(self,coords,kind,key):
+        '''
+        Returns the cached Energy/Gradient/Coupling namedtuple for coords, or None.
+        kind is one of 'Energies', 'Gradients' or 'Couplings' and key is (multiplicity,state)
+        or (state1,state2) for couplings.
+        '''
+        if self.result_cache is None:
+            return None
+        ans = self.result_cache.get(self._result_key(coords,kind,key))
+        if ans is None:
+            return None
+        return self._make_result(kind,*ans)
+
+    def _make_result(self,kind,value,unit):
+        if isinstance(value,np.ndarray):
+            value = value.copy()
+        return {'Energies':self.Energy,'Gradients':self.Gradient,'Couplings':self.Coupling}[kind](value,unit)
+
+    @property
+    def gradient_db(self):
+        '''
+        The gradient database, or None. It is opened on first use, after the
+        subclass has set up the settings that go into settings_fingerprint.
+        '''
+        if self._gradient_db is None and self.options['gradient_db'] is not None:
+            self._gradient_db = GradientDB(self.options['gradient_db'],self.settings_fingerprint(),self.options['gradient_db_tol'])
+        return self._gradient_db
+
+    def fingerprint_settings(self):
+        '''
+        Settings of the backend that change the results and are not in the lot_inp_file,
+        e.g. a calculator or model parameters. Goes into settings_fingerprint.
+        '''
+        return ()
+
+    def settings_fingerprint(self):
+        ''' Hash of the settings that determine the results of a calculation '''
+        inp = ''
+        if self.lot_inp_file is not None and os.path.isfile(self.lot_inp_file):
+            with open(self.lot_inp_file) as f:
+                inp = f.read()
+        settings = (
+                self.__class__.__name__,
+                inp,
+                self.charge,
+                sorted(self.states),
+                self.xTB_Hamiltonian,
+                self.xTB_accuracy,
+                self.xTB_electronic_temperature,
+                )
+        backend = self.fingerprint_settings()
+        if backend:
+            settings += (backend,)
+        return hashlib.sha1(repr(settings).encode()).hexdigest()
+
+    def last_results(self,results=None):
+        '''
+        List of (kind,key,value,unit) of the last runall, or of results, a dictionary
+        of Energies, Gradients and Couplings as returned by submit and runall_batch
+        '''
+        if results is None:
+            results = {'Energies':self.Energies,'Gradients':self.Gradients,'Couplings':self.Couplings}
+        flat = []
+        for kind in ['Energies','Gradients','Couplings']:
+            for key,result in results[kind].items():
+                if result.value is None:
+                    continue
+                value = result.value.copy() if isinstance(result.value,np.ndarray) else result.value
+                flat.append((kind,key,value,result.unit))
+        return flat
+
+    def store_results(self,coords,results=None,record=True):
+        '''
+        Puts the results of the last runall (or results) in the result cache and,
+        if record, in the gradient database
+        '''
+        flat = self.last_results(results)
+        if record and self.gradient_db is not None:
+            self.gradient_db.record(coords,flat)
+        if self.result_cache is None:
+            return
+        entries = [(self._result_key(coords,kind,key),(value,unit)) for kind,key,value,unit in flat]
+        for key,value in entries:
+            self.result_cache.put(key,value)
+        self.save_result_cache(entries)
+
+    def result_cache_path(self):
+        ''' The result cache file of this node, result_cache_file with the node_id before the extension '''
+        fname = self.options['result_cache_file']
+        if fname is None:
+            return None
+        root,ext = os.path.splitext(fname)
+        return '{}_{}{}'.format(root,self.node_id,ext)
+
+    def load_result_cache(self):
+        fname = self.result_cache_path()
+        if self.result_cache is None or fname is None or not os.path.isfile(fname):
+            return
+        # the file is a sequence of pickled lists of entries, one per calculation
+        entries = []
+        broken = False
+        with open(fname,'rb') as f:
+            while True:
+                try:
+                    entries.extend(pickle.load(f))
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError,ValueError) as e:
+                    # e.g. the last record of a run that was killed while writing
+                    nifty.logger.warning(" Could not read all of result cache {}: {}".format(fname,e))
+                    broken = True
+                    break
+        for key,value in entries:
+            self.result_cache.put(key,value)
+        print(" read {} cached results from {}".format(len(self.result_cache),fname))
+        # drop the entries that fell out of the cache and a broken record from the file
+        if broken or len(entries) > len(self.result_cache):
+            self.compact_result_cache()
+
+    def save_result_cache(self,entries):
+        ''' Appends the entries of one calculation to the result cache file '''
+        fname = self.result_cache_path()
+        if self.result_cache is None or fname is None:
+            return
+        with open(fname,'ab') as f:
+            pickle.dump(entries,f,protocol=pickle.HIGHEST_PROTOCOL)
+
+    def compact_result_cache(self):
+        ''' Rewrites the result cache file with the entries of the cache '''
+        fname = self.result_cache_path()
+        if self.result_cache is None or fname is None:
+            return
+        tmp = '{}.{}.tmp'.format(fname,os.getpid())
+        with open(tmp,'wb') as f:
+            pickle.dump(list(self.result_cache.data.items()),f,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp,fname)
+
+    def result_cache_stats(self):
+        if self.result_cache is None:
+            return {}
+        return self.result_cache.stats()
+
+    def print_result_cache_stats(self,label=''):
+        if self.result_cache is not None:
+            print(" {} result cache: {}".format(label,self.result_cache))
+        if self.gradient_db is not None:
+            print(" {} gradient db: {}".format(label,self.gradient_db))
+
+    def __getstate__(self):
+        self.wait()
+        state = self.__dict__.copy()
+        state['_pending'] = None
+        return state
+
+    def job_runtype(self,runtype):
+        ''' Energy-only jobs are only run with lazy_gradients, otherwise runtype energy is a full job '''
+        if runtype=='energy' and not self.options['lazy_gradients']:
+            return None
+        return runtype
+
+    def has_results(self,coords,runtype=None):
+        '''
+        True if the energies and gradients of all states at coords are available without
+        a job, only the energies for runtype energy
+        '''
+        energy_only = self.job_runtype(runtype)=='energy'
+        if self.hasRanForCurrentCoords and (coords == self.currentCoords).all():
+            if energy_only or all(self.Gradients.get(state) is not None and self.Gradients[state].value is not None for state in (self.gradient_states or [])):
+                return True
+        if self.result_cache is None:
+            return False
+        keys = [('Energies',state) for state in self.states]
+        if not energy_only:
+            keys += [('Gradients',state) for state in (self.gradient_states or [])]
+        return all(self._result_key(coords,kind,key) in self.result_cache for kind,key in keys)
+
+    def _run_job(self,coords,runtype=None):
+        runtype = self.job_runtype(runtype)
+        self.currentCoords = coords.copy()
+        geom = manage_xyz.np_to_xyz(self.geom,self.currentCoords)
+        profiler.count('Lot.runall {}'.format(runtype or 'default'))
+        with profiler.timer('Lot.runall'):
             self.runall(geom,runtype)
-        
-        Energy = self.Energies[(multiplicity,state)]
+        self.store_results(self.currentCoords)
+        return {'Energies':self.Energies,'Gradients':self.Gradients,'Couplings':self.Couplings}
+
+    def submit(self,coords,runtype=None):
+        '''
+        Starts the calculation at coords without waiting for it and returns a LotFuture.
+        Only one job per level of theory object runs at a time, a second submit waits
+        for the first. The following get_energy/get_gradient calls at coords wait
+        for the job and are answered from the result cache.
+        '''
+        self.wait()
+        coords = coords.copy()
+        if self.has_results(coords,runtype):
+            future = async_jobs.SerialExecutor().submit(lambda: None)
+        else:
+            executor = async_jobs.get_executor(self.options['async_backend'],self.options['async_workers'])
+            future = executor.submit(self._run_job,coords,runtype)
+        self._pending = async_jobs.LotFuture(self,coords,future)
+        return self._pending
+
+    def wait(self):
+        ''' Waits for the submitted job, if any, re-raising its exception '''
+        pending,self._pending = self._pending,None
+        if pending is not None:
+            pending.result()
+
+    def batch_setup(self):
+        '''
+        Called before the geometries of runall_batch are calculated. Limits the
+        BLAS/OpenMP threads to nproc if threadpoolctl is available. In-process
+        backends extend it to create their calculator once for the batch.
+        '''
+        self._thread_limits = None
+        if threadpool_limits is not None:
+            self._thread_limits = threadpool_limits(limits=self.nproc)
+
+    def batch_teardown(self):
+        if getattr(self,'_thread_limits',None) is not None:
+            self._thread_limits.unregister()
+        self._thread_limits = None
+
+    def runall_batch(self,geoms,runtype=None):
+        '''
+        Calculates all the geometries in geoms with this object and returns the list
+        of results (dictionaries of Energies, Gradients and Couplings). The results
+        are put in the result cache and gradient database, other level of theory
+        objects can take them with store_results(coords,results,record=False).
+        '''
+        self.wait()
+        results = []
+        self.batch_setup()
+        try:
+            for geom in geoms:
+                results.append(self._run_job(manage_xyz.xyz_to_np(geom),runtype))
+        finally:
+            self.batch_teardown()
+        return results
+
+    @staticmethod
+    def gather(lot_futures,timeout=None):
+        ''' Waits for many submitted jobs, see async_jobs.gather '''
+        return async_jobs.gather(lot_futures,timeout)
+
+    def _get_result(self,coords,kind,key,runtype=None):
+        '''
+        Returns the result for coords, from the last calculation, the result cache,
+        the gradient database or by running a new calculation.
+        '''
+        self.wait()
+        if self.hasRanForCurrentCoords and (coords == self.currentCoords).all():
+            # an energy-only job has no gradients
+            result = getattr(self,kind).get(key)
+            if result is not None and result.value is not None:
+                return result
+        result = self.lookup_result(coords,kind,key)
+        if result is not None:
+            return result
+        if self.gradient_db is not None:
+            ans = self.gradient_db.lookup(coords,kind,key)
+            if ans is not None:
+                if self.result_cache is not None:
+                    self.result_cache.put(self._result_key(coords,kind,key),ans)
+                return self._make_result(kind,*ans)
+        return self._run_job(coords,runtype)[kind][key]
+
+    def get_energy(self,coords,multiplicity,state,runtype=None):
+        Energy = self._get_result(coords,'Energies',(multiplicity,state),runtype)
         if Energy.unit=="Hartree":
             return Energy.value*units.KCAL_MOL_PER_AU
         elif Energy.unit=='kcal/mol':
@@ -401,11 +914,7 @@ class Lot(object):
             return Energy.value
 
     def get_gradient(self,coords,multiplicity,state,frozen_atoms=None):
-        if self.hasRanForCurrentCoords==False or (coords != self.currentCoords).any():
-            self.currentCoords = coords.copy()
-            geom = manage_xyz.np_to_xyz(self.geom,self.currentCoords)
-            self.runall(geom)
-        Gradient = self.Gradients[(multiplicity,state)]
+        Gradient = self._get_result(coords,'Gradients',(multiplicity,state))
         if Gradient.value is not None:
             if frozen_atoms is not None:
                 for a in frozen_atoms:
@@ -420,11 +929,7 @@ class Lot(object):
             return None
 
     def get_coupling(self,coords,multiplicity,state1,state2,frozen_atoms=None):
-        if self.hasRanForCurrentCoords==False or (coords != self.currentCoords).any():
-            self.currentCoords = coords.copy()
-            geom = manage_xyz.np_to_xyz(self.geom,self.currentCoords)
-            self.runall(geom)
-        Coupling = self.Couplings[(state1,state2)]
+        Coupling = self._get_result(coords,'Couplings',(state1,state2))
 
         if Coupling.value is not None:
             if frozen_atoms is not None:
@@ -439,20 +944,113 @@ class Lot(object):
         #return np.reshape(self.coup,(3*len(self.geom),1))*units.ANGSTROM_TO_AU
 
     def write_E_to_file(self):
-        with open('scratch/{:03}/E_{}.txt'.format(self.ID,self.node_id),'w') as f:
+        ''' Writes the energies of the last job, every energy_file_interval calls '''
+        interval = self.options['energy_file_interval']
+        if interval<=0:
+            return
+        self._energy_file_count += 1
+        if self._energy_file_count % interval:
+            return
+        with open(os.path.join(self.scratch.string_dir,'E_{}.txt'.format(self.node_id)),'w') as f:
             for key,Energy in self.Energies.items():
                 f.write('{} {} {:9.7f} Hartree\n'.format(key[0],key[1],Energy.value))
 
     def run(self,geom,mult,ad_idx,runtype='gradient'):
         raise NotImplementedError
 
+    def run_multistate(self,geom,runtype=None):
+        '''
+        Calculates the energies of all the states, the gradients of gradient_states
+        (none for runtype energy) and the coupling of coupling_states with one
+        invocation of the program. Called by runall when multistate_job is set.
+        '''
+        raise NotImplementedError
+
+    def server_options(self,multiplicity,ad_idx,runtype):
+        '''
+        Job options sent to the resident server with each geometry (TeraChem
+        keywords, which fake_server reads too). Backends add their method options.
+        '''
+        options = {
+                'charge':self.charge,
+                'spinmult':multiplicity,
+                }
+        if runtype=='gradient':
+            options['castarget'] = ad_idx
+        elif runtype=='coupling':
+            options['nacstate1'] = self.coupling_states[0]
+            options['nacstate2'] = self.coupling_states[1]
+        return options
+
+    def run_resident(self,geom,runtype=None):
+        '''
+        Calculates the states with the resident server of this worker (driver
+        resident) instead of starting the program for the job.
+        '''
+        server = (self.options['server_protocol'],self.options['server_address'],self.options['server_command'])
+        client = resident_driver.get_client(*server,timeout=self.options['server_timeout'])
+        atoms = manage_xyz.get_atoms(geom)
+        xyz = manage_xyz.xyz_to_np(geom)
+        try:
+            for state in self.states:
+                multiplicity,ad_idx = state
+                if runtype!='energy' and self.calc_grad and state in (self.gradient_states or []):
+                    jobtype = 'gradient'
+                else:
+                    jobtype = 'energy'
+                result = client.compute(jobtype,atoms,xyz,self.server_options(multiplicity,ad_idx,jobtype))
+                energy = result['energy']
+                if np.ndim(energy)>0:
+                    # all the roots
+                    energy = energy[ad_idx]
+                self._Energies[state] = self.Energy(float(energy),'Hartree')
+                if jobtype=='gradient':
+                    self._Gradients[state] = self.Gradient(np.reshape(result['gradient'],(-1,3)),'Hartree/Bohr')
+                else:
+                    self._Gradients[state] = self.Gradient(None,None)
+            if self.coupling_states and runtype!='energy':
+                result = client.compute('coupling',atoms,xyz,self.server_options(self.states[0][0],None,'coupling'))
+                self._Couplings[self.coupling_states] = self.Coupling(np.reshape(result['nacme'],(-1,1)),'Hartree/Bohr')
+        except (OSError,IOError):
+            # reconnect (and restart the server) for the next job
+            resident_driver.drop_client(*server)
+            raise
+        self.hasRanForCurrentCoords=True
+
+    def prepare_multistate(self,states,coupling=None):
+        '''
+        Sets up the object for a surface combining states (Avg_PES, Penalty_PES).
+        Both gradients are needed at every geometry, so the gradients of all the
+        states are calculated with the energies in the same job.
+        '''
+        gradient_states = list(self.gradient_states or [])
+        for state in states:
+            if state not in gradient_states:
+                gradient_states.append(state)
+        self.gradient_states = gradient_states
+        if coupling is not None:
+            self.do_coupling = True
+            self.coupling_states = coupling
+        if self.options['lazy_gradients']:
+            print(" the gradients of {} are needed with the energies, turning off lazy_gradients".format(states))
+            self.options['lazy_gradients'] = False
+
     def runall(self,geom,runtype=None):
         self.Gradients={}
         self.Energies = {}
         self.Couplings = {}
+        if self.options['driver']=='resident':
+            self.run_resident(geom,runtype)
+            return
+        if self.options['multistate_job']:
+            self.run_multistate(geom,runtype)
+            self.hasRanForCurrentCoords=True
+            return
         for state in self.states:
             mult,ad_idx = state
-            if state in self.gradient_states or runtype=="gradient":
+            if runtype=="energy":
+                self.run(geom,mult,ad_idx,'energy')
+            elif state in self.gradient_states or runtype=="gradient":
                 self.run(geom,mult,ad_idx)
             elif state in self.coupling_states:
                 self.run(geom,mult,ad_idx,'coupling')
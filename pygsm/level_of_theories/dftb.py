@@ -12,8 +12,10 @@ import numpy as np
 sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
 try:
     from .base_lot import Lot 
+    from . import scratch
 except:
     from base_lot import Lot 
+    import scratch
 
 from utilities import *
 
@@ -21,28 +23,31 @@ class DFTB(Lot):
 
     def __init__(self,options):
         super(DFTB,self).__init__(options)
-        os.system('rm -f dftb_jobs.txt')
+        scratch.remove('dftb_jobs.txt')
         print(" making folder scratch/{}".format(self.node_id))
-        os.system('mkdir -p scratch/{}'.format(self.node_id))
-        os.system('cp {} scratch/{}'.format(self.lot_inp_file,self.node_id))
+        scratch.makedirs('scratch/{}'.format(self.node_id))
+        scratch.copy(self.lot_inp_file,'scratch/{}/'.format(self.node_id))
+
+    def scratch_dirs(self):
+        return super(DFTB,self).scratch_dirs() + ['scratch/{}'.format(self.node_id)]
 
     def run(self,geom):
-        owd = os.getcwd()
-        manage_xyz.write_xyz('scratch/{}/tmp.xyz'.format(self.node_id),geom,scale=1.0)
-        os.system('./xyz2gen scratch/{}/tmp.xyz'.format(self.node_id))
-        os.chdir('scratch/{}'.format(self.node_id))
-        os.system('pwd')
+        # run in the node folder with cwd, os.chdir would move the other threads too
+        rundir = 'scratch/{}'.format(self.node_id)
+        manage_xyz.write_xyz('{}/tmp.xyz'.format(rundir),geom,scale=1.0)
+        subprocess.call([os.path.abspath('xyz2gen'),'tmp.xyz'],cwd=rundir)
         cmd = "dftb+"
         proc = subprocess.Popen(cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
+                cwd=rundir,
                 )
         stdout,stderr = proc.communicate()
         #with open('dftb_jobs.txt','a') as out:
         #    out.write(stdout)
         #    out.write(stderr)
 
-        ofilepath = "detailed.out"
+        ofilepath = "{}/detailed.out".format(rundir)
         with open(ofilepath,'r') as ofile:
             olines = ofile.readlines()
 
@@ -73,10 +78,9 @@ class DFTB(Lot):
                 self.grada.append((3,i[1],tmpgrada[count]))
         self.hasRanForCurrentCoords=True
 
-        os.chdir(owd)
         return
 
-    def get_energy(self,coords,multiplicity,state):
+    def get_energy(self,coords,multiplicity,state,runtype=None):
         if self.hasRanForCurrentCoords==False or (coords != self.currentCoords).any():
             self.currentCoords = coords.copy()
             geom = manage_xyz.np_to_xyz(self.geom,self.currentCoords)
@@ -0,0 +1,109 @@
+# standard library imports
+import sys
+import os
+from os import path
+import argparse
+import json
+import socket
+
+# third party
+import numpy as np
+
+# local application imports
+sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
+sys.path.append(path.dirname( path.abspath(__file__)))
+try:
+    from .model_lot import ModelLot
+except:
+    from model_lot import ModelLot
+from utilities import *
+
+'''
+Stand-in for a resident electronic structure server, for testing the resident
+driver without TeraChem. It speaks the json protocol of resident_driver and
+answers with the model potentials of model_lot. The model is built on the first
+request from the reference geometries of the client (options reference_coords
+and reference_geoms, sent by a ModelLot client), so it is the model of the
+client, or else from the first geometry received:
+
+    python fake_server.py --port 12345 --nstates 2 --lot_inp_file model.txt
+
+or in a level of theory object, server_command='python fake_server.py --port {port}'.
+'''
+
+
+class FakeServer(object):
+
+    def __init__(self, nstates=2, lot_inp_file=None):
+        self.nstates = nstates
+        self.lot_inp_file = lot_inp_file
+        self.lot = None
+        self.njobs = 0
+
+    def compute(self, request):
+        atoms = request['atoms']
+        xyz = np.asarray(request['coords'], dtype=float)
+        options = request.get('options', {})
+        geom = [[a] + list(x) for a, x in zip(atoms, xyz)]
+        mult = options.get('spinmult', 1)
+        if self.lot is None:
+            ref = options.get('reference_coords', xyz)
+            self.lot = ModelLot.from_options(
+                    states=[(mult, i) for i in range(self.nstates)],
+                    geom=[[a] + list(x) for a, x in zip(atoms, ref)],
+                    lot_inp_file=self.lot_inp_file,
+                    result_cache_size=0,
+                    job_data={'reference_geoms': [[[a] + list(x) for a, x in zip(atoms, ref_xyz)] for ref_xyz in options.get('reference_geoms', [])]},
+                    )
+
+        runtype = request['runtype']
+        if runtype == 'coupling':
+            self.lot.coupling_states = (options['nacstate1'], options['nacstate2'])
+            self.lot.runall(geom, 'gradient')
+            coup = self.lot.Couplings[self.lot.coupling_states].value
+            reply = {'nacme': np.reshape(coup, (-1, 3)).tolist()}
+        else:
+            self.lot.runall(geom, runtype)
+            states = [(mult, i) for i in range(self.nstates)]
+            reply = {'energy': [self.lot.Energies[s].value/units.KCAL_MOL_PER_AU for s in states]}
+            if runtype == 'gradient':
+                G = self.lot.Gradients[(mult, options.get('castarget', 0))].value
+                reply['gradient'] = (G*units.KCAL_MOL_TO_AU/units.ANGSTROM_TO_AU).tolist()
+        self.njobs += 1
+        reply['njobs'] = self.njobs
+        return reply
+
+    def serve(self, port):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('localhost', port))
+        listener.listen(1)
+        while True:
+            conn, _ = listener.accept()
+            stream = conn.makefile('rw')
+            for line in stream:
+                request = json.loads(line)
+                if request['runtype'] == 'exit':
+                    stream.close()
+                    conn.close()
+                    listener.close()
+                    return
+                try:
+                    reply = self.compute(request)
+                except Exception as e:
+                    reply = {'error': '{}: {}'.format(type(e).__name__, e)}
+                stream.write(json.dumps(reply) + '\n')
+                stream.flush()
+            stream.close()
+            conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fake resident server with the model potentials')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--nstates', type=int, default=2)
+    parser.add_argument('--lot_inp_file', type=str, default=None)
+    args = parser.parse_args()
+    # the model potential prints on construction, keep stdout of the client readable
+    sys.stdout = open(os.devnull, 'w')
+    FakeServer(args.nstates, args.lot_inp_file).serve(args.port)
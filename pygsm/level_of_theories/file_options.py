@@ -112,6 +112,9 @@ class File_Options(object):
         self.InactiveWarnings[key] = msg
 
     def __getattr__(self,key):
+        # during unpickling the dictionaries are not set yet
+        if key.startswith('__') or key in ['ActiveOptions','InactiveOptions']:
+            raise AttributeError(key)
         if key in self.ActiveOptions:
             return self.ActiveOptions[key]
         elif key in self.InactiveOptions:
@@ -0,0 +1,118 @@
+# standard library imports
+import os
+import pickle
+import sqlite3
+
+# third party
+import numpy as np
+
+
+class GradientDB(object):
+    '''
+    On-disk store (SQLite) of the energies, gradients and couplings computed by a
+    level of theory. Records are keyed by a fingerprint of the level of theory
+    settings and by the geometry. A lookup returns the results of the stored
+    geometry closest to the query if every Cartesian component is within tol (Angstrom).
+
+    The connection is opened lazily and not pickled, so the object can be sent
+    to worker processes. It may be used from an async job thread, but only by
+    one thread at a time.
+    '''
+
+    def __init__(self, filename, fingerprint, tol=1e-5):
+        self.filename = filename
+        self.fingerprint = fingerprint
+        self.tol = tol
+        self.hits = 0
+        self.misses = 0
+        self.records = 0
+        self._conn = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            dirname = os.path.dirname(self.filename)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self._conn = sqlite3.connect(self.filename, timeout=60., check_same_thread=False)
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS geometries (
+                    id INTEGER PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    natoms INTEGER NOT NULL,
+                    norm REAL NOT NULL,
+                    coords BLOB NOT NULL);
+                CREATE INDEX IF NOT EXISTS geometries_idx ON geometries (fingerprint, natoms, norm);
+                CREATE TABLE IF NOT EXISTS results (
+                    geom_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    key1 INTEGER NOT NULL,
+                    key2 INTEGER NOT NULL,
+                    value BLOB,
+                    unit TEXT,
+                    PRIMARY KEY (geom_id, kind, key1, key2));
+                ''')
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def find_geometry(self, coords):
+        ''' Returns the id of the closest stored geometry within tol, or None '''
+        coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        norm = np.linalg.norm(coords)
+        # | |x|-|y| | <= |x-y| <= sqrt(3N) max|x-y|
+        window = self.tol*np.sqrt(coords.size)
+        rows = self.conn.execute(
+                'SELECT id, coords FROM geometries WHERE fingerprint=? AND natoms=? AND norm BETWEEN ? AND ?',
+                (self.fingerprint, len(coords), norm-window, norm+window)).fetchall()
+        best = None
+        best_diff = self.tol
+        for geom_id, blob in rows:
+            diff = np.max(np.abs(np.frombuffer(blob, dtype=float).reshape(-1, 3) - coords))
+            if diff <= best_diff:
+                best, best_diff = geom_id, diff
+        return best
+
+    def lookup(self, coords, kind, key):
+        ''' Returns (value,unit) stored for the geometry or None '''
+        geom_id = self.find_geometry(coords)
+        row = None
+        if geom_id is not None:
+            row = self.conn.execute(
+                    'SELECT value, unit FROM results WHERE geom_id=? AND kind=? AND key1=? AND key2=?',
+                    (geom_id, kind, int(key[0]), int(key[1]))).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(row[0]), row[1]
+
+    def record(self, coords, results):
+        ''' Stores a list of (kind,key,value,unit) computed at coords '''
+        if not results:
+            return
+        coords = np.ascontiguousarray(coords, dtype=float).reshape(-1, 3)
+        with self.conn:
+            geom_id = self.find_geometry(coords)
+            if geom_id is None:
+                cur = self.conn.execute(
+                        'INSERT INTO geometries (fingerprint, natoms, norm, coords) VALUES (?,?,?,?)',
+                        (self.fingerprint, len(coords), float(np.linalg.norm(coords)), sqlite3.Binary(coords.tobytes())))
+                geom_id = cur.lastrowid
+            for kind, key, value, unit in results:
+                self.conn.execute(
+                        'INSERT OR REPLACE INTO results (geom_id, kind, key1, key2, value, unit) VALUES (?,?,?,?,?,?)',
+                        (geom_id, kind, int(key[0]), int(key[1]),
+                            sqlite3.Binary(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)), unit))
+        self.records += len(results)
+
+    def __repr__(self):
+        return "{} hits {} misses {} records written {}".format(self.filename, self.hits, self.misses, self.records)
@@ -0,0 +1,261 @@
+# standard library imports
+import sys
+from os import path
+
+# third party
+import numpy as np
+
+# local application imports
+sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
+try:
+    from .base_lot import Lot
+except:
+    from base_lot import Lot
+from utilities import *
+
+'''
+Analytic model potentials in pure NumPy, for testing, profiling and benchmarking
+without an electronic structure program. Energies are in kcal/mol.
+
+ morse         Morse bonds between the atoms bonded in the reference geometry
+               (the geometry the object is built with) and a harmonic wall
+               keeping the other atoms apart. The bonds of the geometries in
+               job_data['reference_geoms'] (e.g. the product of a DE-GSM run)
+               are added, with their distances in that geometry.
+ lj            Lennard-Jones between all pairs of atoms (e.g. rare gas clusters).
+ muller_brown  Morse bonds plus a Muller-Brown surface in two bond distances
+               (mb_bonds). The reference geometry sits in minimum A, stretching the
+               first bond and compressing the second leads over the saddle to minimum B.
+
+With more than one state, state k (in the order of states) is shifted by
+k*(seam_gap + seam_slope*(q-q_ref)), where q is the first MB coordinate or the
+first bond length. The states cross on the seam q = q_ref - seam_gap/seam_slope.
+
+With driver resident the jobs go to a server instead (fake_server.py), which
+builds the same model from the reference geometries sent with the requests.
+'''
+
+# Muller-Brown parameters
+MB_A = np.array([-200., -100., -170., 15.])
+MB_a = np.array([-1., -1., -6.5, 0.7])
+MB_b = np.array([0., 0., 11., 0.6])
+MB_c = np.array([-10., -10., -6.5, 0.7])
+MB_x0 = np.array([1., 0., -0.5, -1.])
+MB_y0 = np.array([0., 0.5, 1.5, 1.])
+MB_MINIMUM_A = (-0.558224, 1.441726)
+
+
+def muller_brown(x, y):
+    ''' Returns the Muller-Brown energy and its derivatives with respect to x and y '''
+    dx = x - MB_x0
+    dy = y - MB_y0
+    terms = MB_A*np.exp(MB_a*dx**2 + MB_b*dx*dy + MB_c*dy**2)
+    E = np.sum(terms)
+    dEdx = np.sum(terms*(2.*MB_a*dx + MB_b*dy))
+    dEdy = np.sum(terms*(MB_b*dx + 2.*MB_c*dy))
+    return E, dEdx, dEdy
+
+
+def pair_gradient(natoms, i, j, d, r, dEdr):
+    ''' Cartesian gradient of a sum of pair terms, d = xyz[i]-xyz[j] '''
+    f = (dEdr/r)[:, None]*d
+    G = np.zeros((natoms, 3))
+    for k in range(3):
+        G[:, k] = np.bincount(i, f[:, k], natoms) - np.bincount(j, f[:, k], natoms)
+    return G
+
+
+class ModelLot(Lot):
+    def __init__(self,options):
+        super(ModelLot,self).__init__(options)
+
+        self.file_options.set_active('potential','morse',str,'Model potential',allowed=['morse','lj','muller_brown'])
+        self.file_options.set_active('bond_scale',1.2,float,'Atoms closer than bond_scale times the sum of covalent radii in the reference geometry are bonded')
+        self.file_options.set_active('morse_de',100.,float,'Morse well depth (kcal/mol)')
+        self.file_options.set_active('morse_a',2.,float,'Morse width parameter (1/Angstrom)')
+        self.file_options.set_active('wall_k',100.,float,'Force constant of the wall between non-bonded atoms (kcal/mol/Angstrom^2)')
+        self.file_options.set_active('wall_scale',1.5,float,'The wall acts below wall_scale times the sum of covalent radii')
+        self.file_options.set_active('lj_epsilon',0.2,float,'Lennard-Jones well depth (kcal/mol)',depend=(self.file_options.potential=='lj'),msg='only for lj')
+        self.file_options.set_active('lj_sigma',None,float,'Lennard-Jones sigma (Angstrom), default from the covalent radii',depend=(self.file_options.potential=='lj'),msg='only for lj')
+        self.file_options.set_active('cutoff',8.,float,'Cutoff of the pair terms (Angstrom)')
+        self.file_options.set_active('mb_bonds',[[0,1],[2,3]],list,'The two atom pairs whose distances are the Muller-Brown coordinates',depend=(self.file_options.potential=='muller_brown'),msg='only for muller_brown')
+        self.file_options.set_active('mb_length',1.,float,'Change of the distances (Angstrom) per Muller-Brown unit',depend=(self.file_options.potential=='muller_brown'),msg='only for muller_brown')
+        self.file_options.set_active('mb_scale',1.,float,'Scale factor of the Muller-Brown energy',depend=(self.file_options.potential=='muller_brown'),msg='only for muller_brown')
+        self.file_options.set_active('seam_gap',10.,float,'Energy gap (kcal/mol) between consecutive states at the reference geometry')
+        self.file_options.set_active('seam_slope',-20.,float,'Change of the gap with the seam coordinate (kcal/mol/Angstrom)')
+
+        for key in self.file_options.ActiveOptions:
+            setattr(self, key, self.file_options.ActiveOptions[key])
+
+        # pairs and reference distances from the reference geometry
+        E = elements.ElementData()
+        xyz = manage_xyz.xyz_to_np(self.geom)
+        self.natoms = len(xyz)
+        radii = np.array([E.from_symbol(a).covalent_radius for a in self.atoms])
+        i, j = np.triu_indices(self.natoms, k=1)
+        rcov = radii[i] + radii[j]
+        r = np.linalg.norm(xyz[i]-xyz[j], axis=1)
+        other_refs = [manage_xyz.xyz_to_np(geom) for geom in self.options['job_data'].get('reference_geoms', [])]
+
+        self.mb_pairs = []
+        self.r0 = np.zeros(0)
+        self.seam_ref = 0.
+        if self.potential == 'lj':
+            self.pairs = (i, j)
+            if self.lj_sigma is None:
+                self.sigma = rcov/2.**(1./6)
+            else:
+                self.sigma = np.full(len(i), self.lj_sigma)
+            return
+
+        exclude = np.zeros(len(i), dtype=bool)
+        self.mb_ref = []
+        if self.potential == 'muller_brown':
+            for a, b in self.mb_bonds:
+                a, b = min(a, b), max(a, b)
+                k = np.where((i == a) & (j == b))[0][0]
+                exclude[k] = True
+                self.mb_pairs.append((a, b))
+                self.mb_ref.append(r[k])
+
+        bonded = (r < self.bond_scale*rcov) & ~exclude
+        # bonds of the other reference geometries, at their distance there
+        r = r.copy()
+        for ref in other_refs:
+            r_ref = np.linalg.norm(ref[i]-ref[j], axis=1)
+            new = (r_ref < self.bond_scale*rcov) & ~exclude & ~bonded
+            r[new] = r_ref[new]
+            bonded |= new
+        self.bonds = (i[bonded], j[bonded])
+        self.r0 = r[bonded]
+        nonbonded = ~bonded & ~exclude
+        self.nonbonded = (i[nonbonded], j[nonbonded])
+        self.rmin = self.wall_scale*rcov[nonbonded]
+
+        if self.mb_pairs:
+            self.seam_ref = MB_MINIMUM_A[0]
+        elif len(self.r0):
+            self.seam_ref = self.r0[0]
+
+    def fingerprint_settings(self):
+        ''' The parameters and the terms built from the reference geometry '''
+        model = [sorted((k, repr(v)) for k, v in self.file_options.ActiveOptions.items())]
+        for name in ['bonds', 'r0', 'nonbonded', 'rmin', 'pairs', 'sigma', 'mb_pairs', 'mb_ref', 'seam_ref']:
+            value = getattr(self, name, None)
+            if value is not None:
+                value = np.round(np.asarray(value, dtype=float), 8).tolist()
+            model.append((name, value))
+        return tuple(model)
+
+    def server_options(self, multiplicity, ad_idx, runtype):
+        # the server builds its model from the same reference geometries
+        options = super(ModelLot, self).server_options(multiplicity, ad_idx, runtype)
+        options['reference_coords'] = manage_xyz.xyz_to_np(self.geom).tolist()
+        options['reference_geoms'] = [manage_xyz.xyz_to_np(geom).tolist() for geom in self.options['job_data'].get('reference_geoms', [])]
+        return options
+
+    def seam_coordinate(self, xyz):
+        ''' Returns q and dq/dxyz '''
+        dq = np.zeros((self.natoms, 3))
+        if self.mb_pairs:
+            a, b = self.mb_pairs[0]
+            scale = self.mb_length
+            ref = MB_MINIMUM_A[0] - self.mb_ref[0]/scale
+        elif len(self.r0):
+            a, b = self.bonds[0][0], self.bonds[1][0]
+            scale = 1.
+            ref = 0.
+        else:
+            return 0., dq
+        d = xyz[a]-xyz[b]
+        r = np.linalg.norm(d)
+        dq[a] = d/r/scale
+        dq[b] = -d/r/scale
+        return ref + r/scale, dq
+
+    def model_energy(self, xyz):
+        ''' Energy (kcal/mol) and gradient (kcal/mol/Angstrom) of the ground state '''
+        if self.potential == 'lj':
+            i, j = self.pairs
+            d = xyz[i]-xyz[j]
+            r = np.linalg.norm(d, axis=1)
+            mask = r < self.cutoff
+            i, j, d, r, sigma = i[mask], j[mask], d[mask], r[mask], self.sigma[mask]
+            sr6 = (sigma/r)**6
+            E = np.sum(4.*self.lj_epsilon*(sr6**2 - sr6))
+            dEdr = 4.*self.lj_epsilon*(-12.*sr6**2 + 6.*sr6)/r
+            return E, pair_gradient(self.natoms, i, j, d, r, dEdr)
+
+        # Morse bonds
+        i, j = self.bonds
+        d = xyz[i]-xyz[j]
+        r = np.linalg.norm(d, axis=1)
+        ex = np.exp(-self.morse_a*(r-self.r0))
+        E = np.sum(self.morse_de*(1.-ex)**2)
+        dEdr = 2.*self.morse_de*self.morse_a*(1.-ex)*ex
+        G = pair_gradient(self.natoms, i, j, d, r, dEdr)
+
+        # wall between non-bonded atoms
+        i, j = self.nonbonded
+        d = xyz[i]-xyz[j]
+        r = np.linalg.norm(d, axis=1)
+        mask = r < self.rmin
+        if mask.any():
+            i, j, d, r = i[mask], j[mask], d[mask], r[mask]
+            dr = r - self.rmin[mask]
+            E += np.sum(self.wall_k*dr**2)
+            G += pair_gradient(self.natoms, i, j, d, r, 2.*self.wall_k*dr)
+
+        # Muller-Brown surface in the two distances
+        if self.mb_pairs:
+            coords = []
+            grads = []
+            for (a, b), ref, x0 in zip(self.mb_pairs, self.mb_ref, MB_MINIMUM_A):
+                d = xyz[a]-xyz[b]
+                r = np.linalg.norm(d)
+                coords.append(x0 + (r-ref)/self.mb_length)
+                grads.append((a, b, d/r/self.mb_length))
+            Emb, dEdx, dEdy = muller_brown(*coords)
+            E += self.mb_scale*Emb
+            for (a, b, dx), dE in zip(grads, (dEdx, dEdy)):
+                G[a] += self.mb_scale*dE*dx
+                G[b] -= self.mb_scale*dE*dx
+        return E, G
+
+    def runall(self, geom, runtype=None):
+        if self.options['driver'] == 'resident':
+            return super(ModelLot, self).runall(geom, runtype)
+        self.Gradients = {}
+        self.Energies = {}
+        self.Couplings = {}
+
+        xyz = manage_xyz.xyz_to_np(geom)
+        E0, G0 = self.model_energy(xyz)
+        q, dq = self.seam_coordinate(xyz)
+        shift = self.seam_gap + self.seam_slope*(q - self.seam_ref)
+        for k, state in enumerate(self.states):
+            self._Energies[state] = self.Energy(E0 + k*shift, 'kcal/mol')
+            if runtype == 'energy':
+                self._Gradients[state] = self.Gradient(None, None)
+            else:
+                self._Gradients[state] = self.Gradient(G0 + k*self.seam_slope*dq, 'kcal/mol/Angstrom')
+
+        if self.coupling_states and runtype != 'energy':
+            # model derivative coupling along the gradient difference of the two states
+            # (state1,state2) or [(mult,state1),(mult,state2)]
+            s1, s2 = [s[1] if isinstance(s, tuple) else s for s in self.coupling_states]
+            k1 = [k for k, state in enumerate(self.states) if state[1] == s1][0]
+            k2 = [k for k, state in enumerate(self.states) if state[1] == s2][0]
+            coup = (k2-k1)*self.seam_slope*dq*units.KCAL_MOL_TO_AU/units.ANGSTROM_TO_AU
+            self._Couplings[(s1, s2)] = self.Coupling(np.reshape(coup, (-1, 1)), 'Hartree/Bohr')
+
+        self.hasRanForCurrentCoords = True
+
+
+if __name__=="__main__":
+    geom = manage_xyz.read_xyzs('../../data/ethylene.xyz')[0]
+    xyz = manage_xyz.xyz_to_np(geom)
+    lot = ModelLot.from_options(states=[(1,0),(1,1)],geom=geom)
+    for state in [(1,0),(1,1)]:
+        print(lot.get_energy(xyz+0.01,*state))
+        print(lot.get_gradient(xyz+0.01,*state))
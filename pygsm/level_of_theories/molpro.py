@@ -11,8 +11,10 @@ import numpy as np
 sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
 try:
     from .base_lot import Lot
+    from . import scratch
 except:
     from base_lot import Lot
+    import scratch
 from utilities import *
 import subprocess 
 
@@ -37,6 +39,9 @@ class Molpro(Lot):
                 self.get_nelec(self.geom,i[0])
 
 
+    def scratch_dirs(self):
+        return super(Molpro,self).scratch_dirs() + ['scratch/{}'.format(self.node_id),'scratch/mp_{:04d}_{:04d}'.format(self.ID,self.node_id)]
+
     def write_input_file(self,tempfilename):
         #TODO gopro needs a number
         tempfile = open(tempfilename,'w')
@@ -196,9 +201,10 @@ class Molpro(Lot):
         #print(" old node id = ",self.node_id)
         node_id = options.get('node_id',1)
         if node_id != lot.node_id and copy_wavefunction:
-            cmd = "cp scratch/mp_{:04d}_{:04d} scratch/mp_{:04d}_{:04d}".format(lot.ID,lot.node_id,lot.ID,node_id)
-            print(cmd)
-            os.system(cmd)
+            old_path = "scratch/mp_{:04d}_{:04d}".format(lot.ID,lot.node_id)
+            new_path = "scratch/mp_{:04d}_{:04d}".format(lot.ID,node_id)
+            print(" copying scr files\n {} {}".format(old_path,new_path))
+            scratch.copy(old_path,new_path)
         return cls(lot.options.copy().set_values(options))
 
 if __name__=='__main__':
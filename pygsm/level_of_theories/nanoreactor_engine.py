@@ -23,6 +23,9 @@ from utilities import *
 '''
 
 class nanoreactor_engine(Lot):
+    # the copies share the engine of job_data
+    thread_safe = False
+
 
     def __init__(self,options):
         super(nanoreactor_engine,self).__init__(options)
@@ -22,6 +22,12 @@ from utilities import *
 from coordinate_systems import Dihedral
 
 class OpenMM(Lot):
+    # the simulation context is created once, runall_batch only updates positions
+    batch_capable = True
+
+    # the copies share the simulation context
+    thread_safe = False
+
     def __init__(self,options):
 
         super(OpenMM,self).__init__(options)
@@ -100,6 +106,12 @@ class OpenMM(Lot):
                     integrator,
                     )
 
+    def fingerprint_settings(self):
+        # the force field and restraints of the system
+        if self.simulation is None:
+            return ()
+        return (openmm.XmlSerializer.serialize(self.simulation.system),)
+
     def add_restraints(self,system):
         # Bond Restraints
         if self.restrain_bondfile is not None:
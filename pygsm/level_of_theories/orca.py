@@ -2,6 +2,8 @@
 import sys
 import os
 from os import path
+import shutil
+import subprocess
 
 # third party 
 import numpy as np
@@ -9,16 +11,27 @@ import numpy as np
 # local application imports
 sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
 from .base_lot import Lot
+from . import scratch
 from utilities import *
 
 class Orca(Lot):
+
+    multistate_capable = True
    
-    def write_input_file(self, geom, multiplicity):
+    def fingerprint_settings(self):
+        # the default input is not in a lot_inp_file
+        if not self.lot_inp_file:
+            return (getattr(self,'functional',None),getattr(self,'basis',None))
+        return ()
+
+    def input_string(self, geom, multiplicity, engrad=True):
         if self.lot_inp_file == False:
             inpstring = '!'
             inpstring += ' '+self.functional
             inpstring += ' '+self.basis
-            inpstring += ' EnGrad\n\n'# SOSCF SlowConv \n\n'
+            if engrad:
+                inpstring += ' EnGrad'
+            inpstring += '\n\n'# SOSCF SlowConv \n\n'
             inpstring += '%scf\nMaxIter 300\nconvergence strong\n sthresh 1e-7\n'
             inpstring += 'thresh 1e-11\n tcut 1e-13 \n directresetfreq 1 \n SOSCFStart 0.00033\nend\n'
             #inpstring += '%scf\nMaxIter 300\nend\n'
@@ -31,28 +44,27 @@ class Orca(Lot):
             for line in lot_inp_lines:
                 inpstring += line
 
+        # start from the orbitals of the last job of this node or of the node it was copied from
+        if self.has_wavefunction(multiplicity):
+            inpstring += '\n! MORead\n%moinp "{}"\n'.format(os.path.abspath(self.wavefunction_files()[multiplicity]))
+
         inpstring += '\n*xyz {} {}\n'.format(self.charge,multiplicity)
         for coord in geom:
             for i in coord:
                 inpstring += str(i)+' '
             inpstring += '\n'
         inpstring += '*'
+        return inpstring
+
+    def write_input_file(self, geom, multiplicity, runscr, engrad=True):
         tempfilename = 'tempORCAinp_{}'.format(multiplicity)
-        tempfile = open(tempfilename,'w')
-        tempfile.write(inpstring)
+        tempfile = open(os.path.join(runscr,tempfilename),'w')
+        tempfile.write(self.input_string(geom, multiplicity, engrad))
         tempfile.close()
         return tempfilename
 
-    def run(self,geom,multiplicity,ad_idx,runtype='gradient'):
-
-        assert ad_idx == 0,"pyGSM ORCA doesn't currently support ad_idx!=0"
-        
-        # Write input file
-        tempfilename = self.write_input_file(geom, multiplicity)
-
-        path2orca = os.popen('which orca').read().rstrip()
+    def run_scratch(self):
         user = os.environ['USER']
-        cwd = os.environ['PWD']
         try:
             slurmID = os.environ['SLURM_ARRAY_JOB_ID']
             try:
@@ -65,42 +77,140 @@ class Orca(Lot):
             orcascr = 'temporcarun'
             #runscr = '/tmp/'+user+'/'+orcascr
             runscr ='/tmp/'+pbsID+'/'+orcascr
+        return runscr
+
+    def run_dir(self):
+        '''
+        The folder ORCA runs in, one per copy (string ID and node_id) under run_scratch,
+        so that the copies of the nodes and of the finite difference workers don't
+        overwrite each other's input and output files
+        '''
+        return scratch.Scratch(self.run_scratch(),self.ID,self.node_id).node_dir
+
+    def scratch_dirs(self):
+        return super(Orca,self).scratch_dirs() + [self.run_dir()]
+
+    def run(self,geom,multiplicity,ad_idx,runtype='gradient'):
+
+        assert ad_idx == 0,"pyGSM ORCA doesn't currently support ad_idx!=0"
+        
+        path2orca = shutil.which('orca')
+        runscr = scratch.makedirs(self.run_dir())
+
+        # Write input file
+        tempfilename = self.write_input_file(geom, multiplicity, runscr, engrad=(runtype!='energy'))
 
-        os.system('mkdir -p {}'.format(runscr))
-        os.system('mv {} {}/'.format(tempfilename,runscr))
-        cmd = 'cd {}; {} {} > {}/{}.log; cd {}'.format(runscr,path2orca,tempfilename,runscr,tempfilename,cwd)
-        os.system(cmd)
+        with open('{}/{}.log'.format(runscr,tempfilename),'w') as log:
+            subprocess.call([path2orca,tempfilename],cwd=runscr,stdout=log)
 
         # parse output
-        self.parse(multiplicity, runscr, tempfilename)
+        self.parse(multiplicity, runscr, tempfilename, runtype)
+
+        # keep the orbitals in the node folder, seed_guess copies them from there
+        scratch.copy('{}/{}.gbw'.format(runscr,tempfilename),self.wavefunction_files()[multiplicity])
 
         return
 
-    def parse(self, multiplicity, runscr, tempfilename):
-        engradpath = runscr+'/{}.engrad'.format(tempfilename) 
-        with open(engradpath) as engradfile:
-            engradlines = engradfile.readlines()
+    def wavefunction_files(self):
+        ''' The .gbw orbitals of each multiplicity '''
+        return {state[0]:self.scratch.path('orca_{}.gbw'.format(state[0])) for state in self.states}
+
+    def run_multistate(self,geom,runtype=None):
+        '''
+        Calculates all the multiplicities with one ORCA invocation, one job per
+        multiplicity in the same input (separated by $new_job). ORCA starts each
+        job from the orbitals of the previous one.
+        '''
+
+        for state in self.states:
+            assert state[1] == 0,"pyGSM ORCA doesn't currently support ad_idx!=0"
 
-        temp = 100000
-        for i,lines in enumerate(engradlines):
-            if '# The current total energy in Eh\n' in lines:
-                temp = i
-            if i > temp+1:
-                self._Energies[(multiplicity,0)] = self.Energy(float(lines.split()[0]),'Hartree')
-                break
+        multiplicities = []
+        for state in self.states:
+            if state[0] not in multiplicities:
+                multiplicities.append(state[0])
+        engrads = [runtype!='energy' and (multiplicity,0) in (self.gradient_states or []) for multiplicity in multiplicities]
+        inpstring = '\n\n$new_job\n\n'.join(self.input_string(geom, multiplicity, engrad) for multiplicity,engrad in zip(multiplicities,engrads))
+        tempfilename = 'tempORCAinp_multi'
 
-        temp = 100000
+        path2orca = shutil.which('orca')
+        runscr = scratch.makedirs(self.run_dir())
+
+        with open('{}/{}'.format(runscr,tempfilename),'w') as tempfile:
+            tempfile.write(inpstring)
+        with open('{}/{}.log'.format(runscr,tempfilename),'w') as log:
+            subprocess.call([path2orca,tempfilename],cwd=runscr,stdout=log)
+
+        energies,gradients = self.parse_multijob('{}/{}.log'.format(runscr,tempfilename))
+        if len(energies)!=len(multiplicities) or len(gradients)!=sum(engrads):
+            raise RuntimeError("expected {} jobs in {}/{}.log, found {} energies and {} gradients".format(
+                len(multiplicities),runscr,tempfilename,len(energies),len(gradients)))
+        gradients = iter(gradients)
+        for multiplicity,energy,engrad in zip(multiplicities,energies,engrads):
+            self._Energies[(multiplicity,0)] = self.Energy(energy,'Hartree')
+            if engrad:
+                self._Gradients[(multiplicity,0)] = self.Gradient(next(gradients),'Hartree/Bohr')
+            else:
+                self._Gradients[(multiplicity,0)] = self.Gradient(None,None)
+
+    @staticmethod
+    def parse_multijob(logpath):
+        ''' Returns the energies and gradients (natoms,3) of the jobs in an ORCA output, in order '''
+        energies = []
+        gradients = []
+        grad = None
+        with open(logpath) as logfile:
+            for line in logfile:
+                if 'FINAL SINGLE POINT ENERGY' in line:
+                    energies.append(float(line.split()[-1]))
+                elif line.strip() == 'CARTESIAN GRADIENT':
+                    grad = []
+                elif grad is not None:
+                    # "   1   C   :   -0.000012345    0.000000000   -0.000012345"
+                    if ':' in line:
+                        grad.append([float(i) for i in line.split(':')[1].split()])
+                    elif grad and not line.strip():
+                        gradients.append(np.asarray(grad))
+                        grad = None
+        return energies,gradients
+
+    def parse(self, multiplicity, runscr, tempfilename, runtype='gradient'):
+        if runtype=='energy':
+            # single point, no .engrad file, the energy is in the output
+            energies,_ = self.parse_multijob('{}/{}.log'.format(runscr,tempfilename))
+            if not energies:
+                raise RuntimeError("no energy in {}/{}.log".format(runscr,tempfilename))
+            self._Energies[(multiplicity,0)] = self.Energy(energies[-1],'Hartree')
+            self._Gradients[(multiplicity,0)] = self.Gradient(None,None)
+            return
+
+        engradpath = runscr+'/{}.engrad'.format(tempfilename) 
+
+        # one pass over the .engrad file, the values start two lines after their comment
+        section = None
+        skip = 0
         tmp = []
         tmp2 = []
-        for i,lines in enumerate(engradlines):
-            if '# The current gradient in Eh/bohr\n' in lines:
-                temp = i
-            if  i> temp+1:
-                if "#" in lines:
-                    break
-                tmp2.append(float(lines.split()[0]))
-            if len(tmp2) == 3:
-                tmp.append(tmp2)
-                tmp2 = []
+        with open(engradpath) as engradfile:
+            for lines in engradfile:
+                if '# The current total energy in Eh\n' in lines:
+                    section,skip = 'energy',1
+                    continue
+                if '# The current gradient in Eh/bohr\n' in lines:
+                    section,skip = 'gradient',1
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                if section == 'energy':
+                    self._Energies[(multiplicity,0)] = self.Energy(float(lines.split()[0]),'Hartree')
+                    section = None
+                elif section == 'gradient':
+                    if "#" in lines:
+                        break
+                    tmp2.append(float(lines.split()[0]))
+                    if len(tmp2) == 3:
+                        tmp.append(tmp2)
+                        tmp2 = []
         self._Gradients[(multiplicity,0)] = self.Gradient(np.asarray(tmp),'Hartree/Bohr')
 
@@ -19,8 +19,10 @@ import json
 sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
 try:
     from .base_lot import Lot
+    from . import scratch
 except:
     from base_lot import Lot
+    import scratch
 
 from utilities import *
 
@@ -32,6 +34,9 @@ class pDynamo(Lot):
     called system
     """
 
+    # the copies share the pDynamo system
+    thread_safe = False
+
     def __init__(self,options):
 
         super(pDynamo,self).__init__(options)
@@ -40,7 +45,7 @@ class pDynamo(Lot):
         self.system = self.options['job_data'].get('system',None)
 
         print(" making folder scratch/{}".format(self.node_id))
-        os.system('mkdir -p scratch/{}'.format(self.node_id))
+        scratch.makedirs('scratch/{}'.format(self.node_id))
         
         # if simulation doesn't exist create it
         if self.lot_inp_file is not None and self.simulation is None:
@@ -95,6 +100,9 @@ class pDynamo(Lot):
         for key in self.file_options.ActiveOptions:
             setattr(self, key, self.file_options.ActiveOptions[key])
 
+    def scratch_dirs(self):
+        return super(pDynamo,self).scratch_dirs() + ['scratch/{}'.format(self.node_id)]
+
     def build_system(self):
         
         # save xyz file
@@ -191,7 +199,7 @@ class pDynamo(Lot):
         self.grada.append((multiplicity,gradient))
         #print(gradient)
 
-    def get_energy(self,coords,multiplicity,state):
+    def get_energy(self,coords,multiplicity,state,runtype=None):
         if self.hasRanForCurrentCoords==False or (coords != self.currentCoords).any():
             self.currentCoords = coords.copy()
             geom = manage_xyz.np_to_xyz(self.geom,self.currentCoords)
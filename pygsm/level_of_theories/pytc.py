@@ -23,6 +23,9 @@ class PyTC(Lot):
     Inherits from Lot. Requires a PSIW object
     """
 
+    # the copies share the psiw object of job_data
+    thread_safe = False
+
     def __init__(self,options):
         super(PyTC,self).__init__(options)
         if self.lot_inp_file is not None and self.lot is None:
@@ -167,7 +170,7 @@ class PyTC(Lot):
     def lot(self,value):
         self.options['job_data']['lot']=value
 
-    def get_energy(self,coords,multiplicity,state):
+    def get_energy(self,coords,multiplicity,state,runtype=None):
         if self.hasRanForCurrentCoords==False or (coords != self.currentCoords).all():
             self.currentCoords = coords.copy()
             geom = manage_xyz.np_to_xyz(self.geom,self.currentCoords)
@@ -9,10 +9,14 @@ import numpy as np
 # local application imports
 sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
 from .base_lot import Lot
+from . import scratch
 from utilities import *
 import subprocess 
 
 class QChem(Lot):
+
+    multistate_capable = True
+
     def __init__(self,options):
         super(QChem,self).__init__(options)
 
@@ -20,20 +24,30 @@ class QChem(Lot):
         for state in self.states:
             tempfolder = qcscratch + '/string_{:03d}/{}.{}/'.format(self.ID,self.node_id,state[0])
             print(" making temp folder {}".format(tempfolder))
-            os.system('mkdir -p {}'.format(tempfolder))
+            scratch.makedirs(tempfolder)
 
         copy_input_file = os.getcwd() + "/QChem_input.txt"
         print(copy_input_file)
         self.write_preamble(self.geom,self.states[0][0],copy_input_file)
-        print(" making folder scratch/{}".format(self.node_id))
-        os.system('mkdir -p scratch/{}'.format(self.node_id))
 
-    def write_preamble(self,geom,multiplicity,tempfilename,jobtype='FORCE'):
+    def scratch_dirs(self):
+        qcscratch = os.environ['QCSCRATCH']
+        return super(QChem,self).scratch_dirs() + [qcscratch + '/string_{:03d}/{}.{}/'.format(self.ID,self.node_id,state[0]) for state in self.states]
 
-        tempfile = open(tempfilename,'w')
+    def fingerprint_settings(self):
+        # the default preamble is not in a lot_inp_file
+        if not self.lot_inp_file:
+            return (getattr(self,'functional',None),getattr(self,'basis',None))
+        return ()
+
+    def write_preamble(self,geom,multiplicity,tempfilename,jobtype='FORCE',scf_guess=None,mode='w'):
+
+        tempfile = open(tempfilename,mode)
         if not self.lot_inp_file:
             tempfile.write(' $rem\n')
             tempfile.write(' JOBTYPE {}\n'.format(jobtype))
+            if scf_guess is not None:
+                tempfile.write(' SCF_GUESS {}\n'.format(scf_guess))
             tempfile.write(' EXCHANGE {}\n'.format(self.functional))
             tempfile.write(' SCF_ALGORITHM rca_diis\n')
             tempfile.write(' SCF_MAX_CYCLES 300\n')
@@ -51,7 +65,7 @@ class QChem(Lot):
         else:
             with open(self.lot_inp_file) as lot_inp:
                 lot_inp_lines = lot_inp.readlines()
-            for line in lot_inp_lines:
+            for line in self.rem_lines(lot_inp_lines,jobtype,scf_guess):
                 tempfile.write(line)
 
         tempfile.write('{} {}\n'.format(self.charge,multiplicity))
@@ -72,6 +86,37 @@ class QChem(Lot):
         tempfile.write('$end')
         tempfile.close()
     
+    @staticmethod
+    def rem_lines(lines,jobtype,scf_guess=None):
+        '''
+        The lines of a lot_inp_file with JOBTYPE (and SCF_GUESS if given) of the
+        $rem block replaced, the values in the file are dropped. Without a guess
+        an SCF_GUESS READ of the file is dropped too, there are no saved orbitals
+        of this node to read (has_wavefunction)
+        '''
+        keys = {'jobtype':jobtype}
+        if scf_guess is not None:
+            keys['scf_guess'] = scf_guess
+        new_lines = []
+        in_rem = False
+        for line in lines:
+            tokens = line.replace('=',' ').split()
+            key = tokens[0].lower() if tokens else ''
+            if key=='$rem':
+                in_rem = True
+                new_lines.append(line)
+                for k,v in keys.items():
+                    new_lines.append(' {} {}\n'.format(k.upper(),v))
+                continue
+            elif key=='$end':
+                in_rem = False
+            elif in_rem and key in keys:
+                continue
+            elif in_rem and key=='scf_guess' and len(tokens)>1 and tokens[1].lower()=='read':
+                continue
+            new_lines.append(line)
+        return new_lines
+
     def run(self,geom,multiplicity,ad_idx,runtype='gradient'):
 
         assert ad_idx == 0,"pyGSM Q-Chem doesn't currently support ad_idx!=0"
@@ -79,10 +124,12 @@ class QChem(Lot):
         qcscratch = os.environ['QCSCRATCH']
         tempfilename = qcscratch + '/string_{:03d}/{}.{}/tempQCinp'.format(self.ID,self.node_id,multiplicity)
 
+        # start from the orbitals of the last job of this node or of the node it was copied from
+        scf_guess = 'READ' if self.has_wavefunction(multiplicity) else None
         if self.calc_grad and runtype!="energy":
-           self.write_preamble(geom,multiplicity,tempfilename)
+           self.write_preamble(geom,multiplicity,tempfilename,scf_guess=scf_guess)
         else:
-           self.write_preamble(geom,multiplicity,tempfilename,jobtype='SP')
+           self.write_preamble(geom,multiplicity,tempfilename,jobtype='SP',scf_guess=scf_guess)
         
         cmd = ['qchem']
         args = ['-nt',str(self.nproc),
@@ -96,55 +143,124 @@ class QChem(Lot):
         #  Run the process
         output = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr = subprocess.PIPE).communicate()[0]
 
-        self.parse(qcscratch, multiplicity)
+        self.parse(qcscratch, multiplicity, runtype)
        
         return 
 
-    def parse(self, qcscratch, multiplicity):
+    def parse(self, qcscratch, multiplicity, runtype='gradient'):
         # PARSE OUTPUT #
-        if self.calc_grad:
+        if self.calc_grad and runtype!="energy":
             efilepath = qcscratch + '/string_{:03d}/{}.{}/GRAD'.format(self.ID,self.node_id,multiplicity)
-            with open(efilepath) as efile:
-                elines = efile.readlines()
-            
-            temp = 0
-            for lines in elines:
-                if temp == 1:
-                    # defaulting to the ground-state
-                    self._Energies[(multiplicity,0)] = self.Energy(float(lines.split()[0]),'Hartree')
-                    break
-                if "$" in lines:
-                    temp += 1
-
-            with open(efilepath) as efile:
-                gradlines = efile.readlines()
+            # one pass: the energy is the line after the first $ line, the gradient is between the second and third
             temp = 0
             tmp=[]
-            for lines in gradlines:
-                if '$' in lines:
-                    temp+=1
-                elif temp == 2:
-                    tmpline = lines.split()
-                    tmp.append([float(i) for i in tmpline])
-                elif temp == 3:
-                    break
+            energy = None
+            with open(efilepath) as efile:
+                for lines in efile:
+                    if '$' in lines:
+                        temp+=1
+                        if temp == 3:
+                            break
+                    elif temp == 1 and energy is None:
+                        # defaulting to the ground-state
+                        energy = float(lines.split()[0])
+                        self._Energies[(multiplicity,0)] = self.Energy(energy,'Hartree')
+                    elif temp == 2:
+                        tmpline = lines.split()
+                        tmp.append([float(i) for i in tmpline])
             self._Gradients[(multiplicity,0)] = self.Gradient(np.asarray(tmp),'Hartree/Bohr')
         else:
-            raise NotImplementedError
+            # single point, the energy is in the output
+            outfilepath = qcscratch + '/string_{:03d}/{}.{}/tempQCinp.qchem.out'.format(self.ID,self.node_id,multiplicity)
+            energy = None
+            with open(outfilepath) as outfile:
+                for line in outfile:
+                    if "Total energy in the final basis set" in line:
+                        energy = float(line.split()[-1])
+            if energy is None:
+                raise RuntimeError("no energy in {}".format(outfilepath))
+            self._Energies[(multiplicity,0)] = self.Energy(energy,'Hartree')
+            self._Gradients[(multiplicity,0)] = self.Gradient(None,None)
         self.write_E_to_file()
 
-    @classmethod
-    def copy(cls,lot,options,copy_wavefunction=True):
-        base = os.environ['QCSCRATCH']
-        node_id = options.get('node_id',1)
-
-        if node_id != lot.node_id:  #and copy_wavefunction: # other theories are more sensitive than qchem -- commenting out
-            for state in lot.states:
-                multiplicity = state[0]
-                efilepath_old=base+ '/string_{:03d}/{}.{}'.format(lot.ID,lot.node_id,multiplicity)
-                efilepath_new =base+ '/string_{:03d}/{}.{}'.format(lot.ID,node_id,multiplicity)
-                cmd = 'cp -r ' + efilepath_old +' ' + efilepath_new
-                print(" copying QCSCRATCH files\n {}".format(cmd))
-                os.system(cmd)
-        return cls(lot.options.copy().set_values(options))
+    def run_multistate(self,geom,runtype=None):
+        '''
+        Calculates all the multiplicities with one Q-Chem invocation, one job per
+        multiplicity in the same input (separated by @@@). The jobs after the first
+        read the SCF guess the previous job left in the saved scratch folder.
+        '''
+
+        for state in self.states:
+            assert state[1] == 0,"pyGSM Q-Chem doesn't currently support ad_idx!=0"
+
+        qcscratch = os.environ['QCSCRATCH']
+        multiplicities = []
+        for state in self.states:
+            if state[0] not in multiplicities:
+                multiplicities.append(state[0])
+        # the folder of the first multiplicity, the one copy carries over to new nodes
+        savename = 'string_{:03d}/{}.{}'.format(self.ID,self.node_id,multiplicities[0])
+        tempfilename = qcscratch + '/' + savename + '/tempQCinp'
+
+        forces = []
+        for i,multiplicity in enumerate(multiplicities):
+            force = self.calc_grad and runtype!="energy" and (multiplicity,0) in (self.gradient_states or [])
+            forces.append(force)
+            if i>0:
+                with open(tempfilename,'a') as tempfile:
+                    tempfile.write('\n\n@@@\n\n')
+            self.write_preamble(geom,multiplicity,tempfilename,
+                    jobtype='FORCE' if force else 'SP',
+                    scf_guess='READ' if i>0 or self.has_wavefunction(multiplicity) else None,
+                    mode='w' if i==0 else 'a')
+
+        cmd = ['qchem','-nt',str(self.nproc),'-save',tempfilename,'{}.qchem.out'.format(tempfilename),savename]
+        output = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr = subprocess.PIPE).communicate()[0]
+
+        energies,gradients = self.parse_multijob('{}.qchem.out'.format(tempfilename),len(geom))
+        if len(energies)!=len(multiplicities) or len(gradients)!=sum(forces):
+            raise RuntimeError("expected {} jobs in {}.qchem.out, found {} energies and {} gradients".format(
+                len(multiplicities),tempfilename,len(energies),len(gradients)))
+        gradients = iter(gradients)
+        for multiplicity,energy,force in zip(multiplicities,energies,forces):
+            self._Energies[(multiplicity,0)] = self.Energy(energy,'Hartree')
+            if force:
+                self._Gradients[(multiplicity,0)] = self.Gradient(next(gradients),'Hartree/Bohr')
+            else:
+                self._Gradients[(multiplicity,0)] = self.Gradient(None,None)
+        self.write_E_to_file()
+
+    @staticmethod
+    def parse_multijob(outfilepath,natoms):
+        ''' Returns the SCF energies and gradients (natoms,3) of the jobs in a Q-Chem output, in order '''
+        energies = []
+        gradients = []
+        grad = None
+        with open(outfilepath) as outfile:
+            for line in outfile:
+                if "Total energy in the final basis set" in line:
+                    energies.append(float(line.split()[-1]))
+                elif "Gradient of SCF Energy" in line:
+                    grad = [[],[],[]]
+                elif grad is not None:
+                    if "Max gradient component" in line:
+                        gradients.append(np.asarray(grad).T)
+                        grad = None
+                        continue
+                    tokens = line.split()
+                    # rows 1-3 (x,y,z) of a block of atom columns, the header lines hold atom numbers
+                    if len(tokens)>1 and '.' in tokens[1]:
+                        grad[int(tokens[0])-1].extend([float(i) for i in tokens[1:]])
+        for grad in gradients:
+            assert grad.shape==(natoms,3),"can't parse the gradient in {}".format(outfilepath)
+        return energies,gradients
+
+    def wavefunction_files(self):
+        ''' The saved scratch folder of each multiplicity '''
+        qcscratch = os.environ['QCSCRATCH']
+        return {state[0]:qcscratch + '/string_{:03d}/{}.{}'.format(self.ID,self.node_id,state[0]) for state in self.states}
+
+    def has_wavefunction(self,label):
+        # 53.0 holds the MO coefficients SCF_GUESS READ starts from
+        return os.path.isfile(os.path.join(self.wavefunction_files()[label],'53.0'))
 
@@ -0,0 +1,227 @@
+# standard library imports
+import atexit
+import json
+import multiprocessing.util
+import os
+import shlex
+import socket
+import subprocess
+import threading
+import time
+
+# third party
+import numpy as np
+try:
+    from tcpb import TCProtobufClient
+except ImportError:
+    TCProtobufClient = None
+
+'''
+Clients of long-lived electronic structure servers, used by the Lot driver
+"resident". Each worker thread of each process keeps its own connection, and
+its own server process when the Lot starts the server with server_command.
+The program and basis set are set up once, each job only exchanges a geometry
+and the results. A forked child (node worker) does not use the connections of
+its parent, and the servers of a process are stopped when it exits, also in
+the multiprocessing workers that skip atexit.
+
+ json  newline-delimited JSON over a local socket. A request is
+           {"runtype": "energy"|"gradient"|"coupling", "atoms": [...],
+            "coords": [[x,y,z],...] (Angstrom), "options": {...}}
+       and the reply
+           {"energy": E or [E0,E1,...], "gradient": [[gx,gy,gz],...], "nacme": [...]}
+       in Hartree and Hartree/Bohr, or {"error": message}. {"runtype": "exit"}
+       stops the server. fake_server.py implements it with the model potentials.
+ tcpb  TeraChem protocol buffer server (terachem -s PORT) through the tcpb client.
+'''
+
+_clients = {}
+_clients_lock = threading.Lock()
+# the process that registered shutdown_clients as multiprocessing finalizer
+_finalizer_pid = None
+
+
+def free_port():
+    ''' A TCP port of localhost that is free now '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def parse_address(address):
+    ''' "host:port" or "port" '''
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+class JSONClient(object):
+
+    def __init__(self, host, port, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.settimeout(None)
+        self.stream = self.sock.makefile('rw')
+
+    def compute(self, runtype, atoms, coords, options):
+        request = {
+                'runtype': runtype,
+                'atoms': list(atoms),
+                'coords': np.asarray(coords).tolist(),
+                'options': options,
+                }
+        self.stream.write(json.dumps(request) + '\n')
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise RuntimeError("the server closed the connection")
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise RuntimeError("server error: {}".format(reply['error']))
+        return reply
+
+    def exit(self):
+        self.stream.write(json.dumps({'runtype': 'exit'}) + '\n')
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+
+class TCPBClient(object):
+
+    def __init__(self, host, port, timeout=None):
+        if TCProtobufClient is None:
+            raise ImportError("the tcpb package is needed for the TeraChem protocol buffer server")
+        self.client = TCProtobufClient(host=host, port=port)
+        self.client.connect()
+
+    def compute(self, runtype, atoms, coords, options):
+        options = dict(options)
+        options['atoms'] = list(atoms)
+        return self.client.compute_job_sync(jobType=runtype, geom=np.asarray(coords), unitType='angstrom', **options)
+
+    def exit(self):
+        pass
+
+    def close(self):
+        self.client.disconnect()
+
+
+PROTOCOLS = {
+        'json': JSONClient,
+        'tcpb': TCPBClient,
+        }
+
+
+class ResidentClient(object):
+    '''
+    Connection of one worker to a server, with the server process if it was
+    started here (command, where {port} is replaced by a free port).
+    '''
+
+    def __init__(self, protocol, address=None, command=None, timeout=60.):
+        if protocol not in PROTOCOLS:
+            raise ValueError("unknown server protocol {}".format(protocol))
+        self.process = None
+        if address is not None:
+            host, port = parse_address(address)
+        elif command is not None:
+            host, port = 'localhost', free_port()
+            self.process = subprocess.Popen(shlex.split(command.format(port=port)))
+        else:
+            raise ValueError("the resident driver needs server_address or server_command")
+
+        # wait for the server to listen
+        t0 = time.time()
+        while True:
+            try:
+                self.client = PROTOCOLS[protocol](host, port, timeout)
+                break
+            except (OSError, IOError):
+                if self.process is not None and self.process.poll() is not None:
+                    raise RuntimeError("the server {} exited with {}".format(command, self.process.returncode))
+                if time.time() - t0 > timeout:
+                    self.shutdown()
+                    raise RuntimeError("no server listening on {}:{} after {} s".format(host, port, timeout))
+                time.sleep(0.05)
+
+    def compute(self, runtype, atoms, coords, options):
+        return self.client.compute(runtype, atoms, coords, options)
+
+    def shutdown(self):
+        client = getattr(self, 'client', None)
+        if client is not None:
+            if self.process is not None:
+                try:
+                    client.exit()
+                except (OSError, IOError):
+                    pass
+            client.close()
+        if self.process is not None:
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+                self.process.wait()
+
+
+def _client_key(protocol, address, command):
+    return (protocol, address, command, os.getpid(), threading.current_thread().ident)
+
+
+def get_client(protocol, address=None, command=None, timeout=60.):
+    ''' The client of the calling thread, connected (and the server started) on first use '''
+    global _finalizer_pid
+    key = _client_key(protocol, address, command)
+    with _clients_lock:
+        client = _clients.get(key)
+    if client is None:
+        client = ResidentClient(protocol, address, command, timeout)
+        with _clients_lock:
+            _clients[key] = client
+            if _finalizer_pid != os.getpid():
+                # multiprocessing workers leave with os._exit, atexit is not run there
+                multiprocessing.util.Finalize(None, shutdown_clients, exitpriority=10)
+                _finalizer_pid = os.getpid()
+    return client
+
+
+def drop_client(protocol, address=None, command=None):
+    ''' Closes the client of the calling thread, e.g. after a broken connection '''
+    key = _client_key(protocol, address, command)
+    with _clients_lock:
+        client = _clients.pop(key, None)
+    if client is not None:
+        try:
+            client.shutdown()
+        except (OSError, IOError):
+            pass
+
+
+def shutdown_clients():
+    ''' Stops the servers of this process and closes the connections '''
+    with _clients_lock:
+        clients = [client for key, client in _clients.items() if key[3] == os.getpid()]
+        _clients.clear()
+    for client in clients:
+        try:
+            client.shutdown()
+        except (OSError, IOError):
+            pass
+
+
+def _forget_inherited_clients():
+    '''
+    After a fork the child has copies of the connections of the parent. They are
+    forgotten, not shut down: the servers still belong to the parent.
+    '''
+    global _clients_lock, _finalizer_pid
+    _clients.clear()
+    _clients_lock = threading.Lock()
+    _finalizer_pid = None
+
+
+atexit.register(shutdown_clients)
+os.register_at_fork(after_in_child=_forget_inherited_clients)
@@ -0,0 +1,83 @@
+# standard library imports
+import os
+import shutil
+
+'''
+Scratch folders of the level of theory objects. The files of the programs live
+under one root (the scratch_root option, "scratch" by default, a memory file
+system such as /dev/shm/pygsm saves the metadata traffic of a shared file
+system), in root/{ID:03}/{node_id}. Folders are created, copied and removed
+here with os/shutil instead of shell commands.
+'''
+
+
+def makedirs(path):
+    ''' mkdir -p '''
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def copy(src, dst):
+    '''
+    cp -r, dst is a file name or a folder to copy into (an existing one, or one
+    ending with /). Returns False (and copies nothing) if src does not exist.
+    '''
+    if not os.path.exists(src):
+        return False
+    if dst.endswith(os.sep):
+        makedirs(dst)
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(os.path.normpath(src)))
+    if os.path.isdir(src):
+        if os.path.exists(dst):
+            shutil.rmtree(dst)
+        shutil.copytree(src, dst)
+    else:
+        makedirs(os.path.dirname(dst) or '.')
+        shutil.copyfile(src, dst)
+    return True
+
+
+def move(src, dst):
+    ''' mv, dst is a file name or an existing folder to move into '''
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(os.path.normpath(src)))
+    os.replace(src, dst)
+    return dst
+
+
+def remove(path):
+    ''' rm -rf '''
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+class Scratch(object):
+    ''' The scratch folder root/{ID:03}/{node_id} of one level of theory object '''
+
+    def __init__(self, root='scratch', ID=0, node_id=0):
+        self.root = root
+        self.ID = ID
+        self.node_id = node_id
+
+    @property
+    def string_dir(self):
+        return os.path.join(self.root, '{:03}'.format(self.ID))
+
+    @property
+    def node_dir(self):
+        return os.path.join(self.string_dir, str(self.node_id))
+
+    def path(self, *names):
+        ''' A file of the node folder '''
+        return os.path.join(self.node_dir, *names)
+
+    def node_path(self, node_id, *names):
+        ''' A file of the folder of another node of the same string '''
+        return os.path.join(self.string_dir, str(node_id), *names)
+
+    def create(self):
+        return makedirs(self.node_dir)
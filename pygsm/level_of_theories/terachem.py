@@ -3,6 +3,7 @@ import sys
 import os
 from os import path
 import re
+import subprocess
 
 # third party
 import numpy as np
@@ -11,11 +12,13 @@ import numpy as np
 sys.path.append(path.dirname( path.dirname( path.abspath(__file__))))
 
 try:
-    from .base_lot import Lot,copy_file
+    from .base_lot import Lot
     from .file_options import File_Options
+    from . import scratch
 except:
-    from base_lot import Lot,copy_file
+    from base_lot import Lot
     from file_options import File_Options
+    import scratch
 from utilities import *
 
 '''
@@ -141,10 +144,10 @@ class TeraChem(Lot):
         self.file_options.set_active('gpumem',None,int,'')
 
    
-        self.file_options.set_active('scrdir','scratch/{:03}/{}/scr/'.format(self.ID,self.node_id),str,doc='')
-        self.file_options.force_active('scrdir','scratch/{:03}/{}/scr/'.format(self.ID,self.node_id))
-        self.file_options.set_active('coordinates','scratch/{:03}/{}/tmp.xyz'.format(self.ID,self.node_id),str,doc='',)
-        self.file_options.force_active('coordinates','scratch/{:03}/{}/tmp.xyz'.format(self.ID,self.node_id))
+        self.file_options.set_active('scrdir',self.scratch.path('scr/'),str,doc='')
+        self.file_options.force_active('scrdir',self.scratch.path('scr/'))
+        self.file_options.set_active('coordinates',self.scratch.path('tmp.xyz'),str,doc='',)
+        self.file_options.force_active('coordinates',self.scratch.path('tmp.xyz'))
         self.file_options.set_active('charge',0,int,doc='')
        
         # Deactivate useless keys 
@@ -165,7 +168,7 @@ class TeraChem(Lot):
         if self.file_options.prmtop==None:
             self.file_options.deactivate('prmtop')
         else:
-            self.file_options.force_active('coordinates','scratch/{:03}/{}/tmp.inpcrd'.format(self.ID,self.node_id))
+            self.file_options.force_active('coordinates',self.scratch.path('tmp.inpcrd'))
 
         # delete?
         #if self.file_options.xtol==None:
@@ -189,15 +192,15 @@ class TeraChem(Lot):
           if state[0] == 2:
               self.unrestricted=True
 
-        self.file_options.set_active('casguess','scratch/{:03}/{}/c0.casscf'.format(self.ID,self.node_id),str,doc='guess for casscf',depend=(self.file_options.casscf=="yes"),msg='')
+        self.file_options.set_active('casguess',self.scratch.path('c0.casscf'),str,doc='guess for casscf',depend=(self.file_options.casscf=="yes"),msg='')
 
         if self.unrestricted:
-            guess_file = 'scratch/{:03}{}/ca0'.format(self.ID,self.node_id)
+            guess_file = self.scratch.path('ca0')
         else:
-            guess_file='scratch/{:03}/{}/c0'.format(self.ID,self.node_id)
+            guess_file=self.scratch.path('c0')
         if os.path.isfile(guess_file):
             if self.unrestricted:
-                guess_file2 = 'scratch/{:03}{}/ca0'.format(self.ID,self.node_id)
+                guess_file2 = self.scratch.path('ca0')
                 self.file_options.set_active('guess',guess_file+guess_file2,str,doc='guess for dft/HF',
                         clash=(self.file_options.casscf or self.file_options.fomo),
                         depend=(os.path.isfile(guess_file)),msg='guess does not exist deactivating for now')
@@ -221,43 +224,41 @@ class TeraChem(Lot):
     
     @classmethod
     def copy(cls,lot,options,copy_wavefunction=True):
-
-        node_id = options.get('node_id',lot.node_id)
-
         file_options = File_Options.copy(lot.file_options)
         options['file_options'] =file_options
+        return super(TeraChem,cls).copy(lot,options,copy_wavefunction)
 
-        if node_id != lot.node_id and copy_wavefunction:
-            if "casscf" in lot.file_options.ActiveOptions:
-                old_path = 'scratch/{:03}/{}/c0.casscf'.format(lot.ID,lot.node_id)
-                new_path = 'scratch/{:03}/{}/c0.casscf'.format(lot.ID,node_id)
-                copy_file(old_path,new_path)
-            else:
-                if lot.unrestricted:
-                    old_path = 'scratch/{:03}/{}/ca0'.format(lot.ID,lot.node_id)
-                    new_path = 'scratch/{:03}/{}/'.format(lot.ID,node_id)
-                    if os.path.isfile(old_path):
-                        copy_file(old_path,new_path)
-                    else:
-                        print(" no file to copy")
-                    old_path = 'scratch/{:03}/{}/cb0'.format(lot.ID,lot.node_id)
-                    new_path = 'scratch/{:03}/{}/'.format(lot.ID,node_id)
-                    if os.path.isfile(old_path):
-                        copy_file(old_path,new_path)
-                    else:
-                        print(" no file to copy")
-                else:
-                    old_path = 'scratch/{:03}/{}/c0'.format(lot.ID,lot.node_id)
-                    new_path = 'scratch/{:03}/{}/'.format(lot.ID,node_id)
-                    if os.path.isfile(old_path):
-                        copy_file(old_path,new_path)
-                    else:
-                        print(" no file to copy")
-            #cmd = 'cp -r ' + old_path +' ' + new_path
-            #print(" copying scr files\n {}".format(cmd))
-            #os.system(cmd)
-            #os.system('wait')
-        return cls(lot.options.copy().set_values(options))
+    def wavefunction_files(self):
+        if "casscf" in self.file_options.ActiveOptions:
+            names = ['c0.casscf']
+        elif self.unrestricted:
+            names = ['ca0','cb0']
+        else:
+            names = ['c0']
+        return {name:self.scratch.path(name) for name in names}
+
+    def use_guess(self,labels):
+        if "casscf" in self.file_options.ActiveOptions:
+            self.file_options.force_active('casguess',self.scratch.path('c0.casscf'))
+        elif self.unrestricted:
+            self.file_options.force_active('guess','{} {}'.format(self.scratch.path('ca0'),self.scratch.path('cb0')))
+        else:
+            self.file_options.force_active('guess',self.scratch.path('c0'))
+
+    def server_options(self,multiplicity,ad_idx,runtype):
+        ''' The input file options, without the files the server manages itself '''
+        options = {key:value for key,value in self.file_options.ActiveOptions.items()
+                if key not in ['scrdir','coordinates','guess','casguess']}
+        options.update(super(TeraChem,self).server_options(multiplicity,ad_idx,runtype))
+        if runtype=='gradient':
+            # same targets as write_input
+            target = options.pop('castarget')
+            if "casscf" in self.file_options.ActiveOptions or "casci" in self.file_options.ActiveOptions:
+                options['castarget'] = target
+                options['castargetmult'] = multiplicity
+            elif "cis" in self.file_options.ActiveOptions or "hhtda" in self.file_options.ActiveOptions:
+                options['cistarget'] = target
+        return options
 
     def write_input(self,inpfilename,geom,mult,ad_idx,runtype='gradient'):
         # first write the file, run it, and the read the output
@@ -290,31 +291,31 @@ class TeraChem(Lot):
 
         # Write the temporary geometry files
         if "prmtop" in self.file_options.ActiveOptions:
-            manage_xyz.write_amber_xyz('scratch/{:03}/{}/tmp.inpcrd'.format(self.ID,self.node_id),geom)
+            manage_xyz.write_amber_xyz(self.scratch.path('tmp.inpcrd'),geom)
         else:
-            manage_xyz.write_xyz('scratch/{:03}/{}/tmp.xyz'.format(self.ID,self.node_id),geom,scale=1.0)
+            manage_xyz.write_xyz(self.scratch.path('tmp.xyz'),geom,scale=1.0)
 
         return
     
     def run(self,geom,mult,ad_idx,runtype='gradient'):
         ''' compute an individual gradient or NACME '''
 
-        inpfilename = 'scratch/{:03}/{}/{}'.format(self.ID,self.node_id,self.lot_inp_file)
-        outfilename = 'scratch/{:03}/{}/output.dat'.format(self.ID,self.node_id)
+        inpfilename = self.scratch.path(os.path.basename(self.lot_inp_file))
+        outfilename = self.scratch.path('output.dat')
 
         # Write input file
         self.write_input(inpfilename,geom,mult,ad_idx,runtype)
 
         ### RUN THE CALCULATION ###
-        cmd = "terachem {} > {}".format(inpfilename,outfilename)
-        os.system(cmd)
+        with open(outfilename,'w') as out:
+            subprocess.call(['terachem',inpfilename],stdout=out)
 
         # Turn on C0 for non-CASSCF calculations after running
         if 'guess' not in self.file_options.ActiveOptions and 'casscf' not in self.file_options.ActiveOptions or self.file_options.guess in ["sad","generate"]:
             if self.unrestricted:
-                self.file_options.force_active('guess','scratch/{:03}/{}/ca0 scratch/{:03}/{}/cb0'.format(self.ID,self.node_id,self.ID,self.node_id))
+                self.file_options.force_active('guess','{} {}'.format(self.scratch.path('ca0'),self.scratch.path('cb0')))
             else:
-                self.file_options.force_active('guess','scratch/{:03}/{}/c0'.format(self.ID,self.node_id))
+                self.file_options.force_active('guess',self.scratch.path('c0'))
 
         # if QM/MM get link atoms
         if "prmtop" in self.file_options.ActiveOptions and self.link_atoms is None:
@@ -336,35 +337,28 @@ class TeraChem(Lot):
 
         ## POST PROCESSING  ##
         # copy the wavefunction file
+        scr = self.scratch.path('scr')
         if "casscf" in self.file_options.ActiveOptions:
-            cp_cmd = 'cp scratch/{:03}/{}/scr/c0.casscf scratch/{:03}/{}/'.format(self.ID,self.node_id,self.ID,self.node_id)
-            os.system(cp_cmd)
+            scratch.copy(os.path.join(scr,'c0.casscf'),self.scratch.node_dir)
         else:
             if self.unrestricted:
-                cp_cmd = 'cp scratch/{:03}/{}/scr/ca0 scratch/{:03}/{}/'.format(self.ID,self.node_id,self.ID,self.node_id)
-                os.system(cp_cmd)
-                cp_cmd = 'cp scratch/{:03}/{}/scr/cb0 scratch/{:03}/{}/'.format(self.ID,self.node_id,self.ID,self.node_id)
-                os.system(cp_cmd)
+                scratch.copy(os.path.join(scr,'ca0'),self.scratch.node_dir)
+                scratch.copy(os.path.join(scr,'cb0'),self.scratch.node_dir)
             else:
-                cp_cmd = 'cp scratch/{:03}/{}/scr/c0 scratch/{:03}/{}/'.format(self.ID,self.node_id,self.ID,self.node_id)
-                os.system(cp_cmd)
+                scratch.copy(os.path.join(scr,'c0'),self.scratch.node_dir)
 
         if "casscf" in self.file_options.ActiveOptions:
-            cp_cmd = 'cp scratch/{:03}/{}/scr/casscf.molden scratch/{:03}/{}/'.format(self.ID,self.node_id,self.ID,self.node_id)
-            os.system(cp_cmd)
+            scratch.copy(os.path.join(scr,'casscf.molden'),self.scratch.node_dir)
 
         # Get the gradient and coupling
         if "prmtop" not in self.file_options.ActiveOptions:
             if runtype=='gradient':
-                cp_grad = 'cp scratch/{:03}/{}/scr/grad.xyz scratch/{:03}/{}/grad_{}_{}.xyz'.format(self.ID,self.node_id,self.ID,self.node_id,mult,ad_idx)
-                os.system(cp_grad)
+                scratch.copy(os.path.join(scr,'grad.xyz'),self.scratch.path('grad_{}_{}.xyz'.format(mult,ad_idx)))
             elif runtype == "coupling":
-                cp_coup = 'cp scratch/{:03}/{}/scr/grad.xyz scratch/{:03}/{}/coup_{}_{}.xyz'.format(self.ID,self.node_id,self.ID,self.node_id,self.coupling_states[0],self.coupling_states[1])
-                os.system(cp_coup)
+                scratch.copy(os.path.join(scr,'grad.xyz'),self.scratch.path('coup_{}_{}.xyz'.format(self.coupling_states[0],self.coupling_states[1])))
 
         # clean up
-        rm_cmd = 'rm -rf scratch/{:03}/{}/scr'.format(self.ID,self.node_id)
-        os.system(rm_cmd)
+        scratch.remove(scr)
 
         return
         #Done go
@@ -376,7 +370,12 @@ class TeraChem(Lot):
         self.Energies = {}
         self.Couplings = {}
 
-        tempfileout='scratch/{:03}/{}/output.dat'.format(self.ID,self.node_id)
+        if self.options['driver']=='resident':
+            self.run_resident(geom,runtype)
+            self.write_E_to_file()
+            return
+
+        tempfileout=self.scratch.path('output.dat')
         if not self.gradient_states and not self.coupling_states or runtype=="energy":
             print(" only calculating energies")
             # TODO what about multiple multiplicities? 
@@ -409,7 +408,7 @@ class TeraChem(Lot):
     def parse_E(self):
         # parse the output for Energies  --> This can be done on any of the files since they should be the same
 
-        tempfileout='scratch/{:03}/{}/output.dat'.format(self.ID,self.node_id)
+        tempfileout=self.scratch.path('output.dat')
 
         #TODO Parse other multiplicities is broken here
         if "casscf" in self.file_options.ActiveOptions or "casci" in self.file_options.ActiveOptions:
@@ -420,27 +419,38 @@ class TeraChem(Lot):
                     tmp.append(float(match.group(1)))
         # Terachem has weird printout for td-dft energy
         elif 'cis' in self.file_options.ActiveOptions:
-            tmp =[]
+            # one pass over the output, the excited states start 4 lines after the header
             pattern = re.compile(r'FINAL ENERGY: ([-+]?[0-9]*\.?[0-9]+) a.u.')
-            for i,line in enumerate(open(tempfileout)):
-                for match in re.finditer(pattern,line):
-                    tmp.append(float(match.group(1)))
-            lines=open(tempfileout).readlines()
-            lines = lines[([x for x,y in enumerate(lines) if re.match(r'^\s+Final Excited State Results:', y)][0]+4):]
-            for line in lines:
-                mobj = re.match(r'^\s*(\d+)\s+(\S+)\s+(\S+)\s+(\S+)', line)
-                if mobj:
-                    tmp.append(float(mobj.group(2)))
+            ground = []
+            excited = []
+            skip = None
+            with open(tempfileout) as f:
+                for line in f:
+                    for match in re.finditer(pattern,line):
+                        ground.append(float(match.group(1)))
+                    if skip is None:
+                        if re.match(r'^\s+Final Excited State Results:', line):
+                            skip = 3
+                    elif skip>0:
+                        skip -= 1
+                    else:
+                        mobj = re.match(r'^\s*(\d+)\s+(\S+)\s+(\S+)\s+(\S+)', line)
+                        if mobj:
+                            excited.append(float(mobj.group(2)))
+            tmp = ground + excited
 
         elif 'hhtda' in self.file_options.ActiveOptions:
             tmp=[]
-            lines=open(tempfileout).readlines()
-            lines = lines[([x for x,y in enumerate(lines) if re.match(r'^\s+ Root   Mult.', y)][0]+1):]
-            for line in lines:
-                mobj = re.match(r'^\s*(\d+)\s+(\S+)\s+(\S+)', line)
-                if mobj:
-                    if mobj.group(2)=="singlet":
-                        tmp.append(float(mobj.group(3)))
+            found = False
+            with open(tempfileout) as f:
+                for line in f:
+                    if not found:
+                        found = re.match(r'^\s+ Root   Mult.', line) is not None
+                        continue
+                    mobj = re.match(r'^\s*(\d+)\s+(\S+)\s+(\S+)', line)
+                    if mobj:
+                        if mobj.group(2)=="singlet":
+                            tmp.append(float(mobj.group(3)))
         else:
             pattern = re.compile(r'FINAL ENERGY: ([-+]?[0-9]*\.?[0-9]+) a.u.')
             tmp =[]
@@ -462,7 +472,7 @@ class TeraChem(Lot):
             ):
 
         if tempfileout==None:
-            tempfileout ='scratch/{:03}/{}/output.dat'.format(self.ID,self.node_id)
+            tempfileout =self.scratch.path('output.dat')
         # GET GRADIENT FOR QMMMM -- REGULAR GRADIENT IS PARSED THROUGH grad.xyz
         # QMMM is done differently :(
         if "prmtop" in self.file_options.ActiveOptions:
@@ -498,13 +508,13 @@ class TeraChem(Lot):
             grad[self.mm_indices] = tmpgrad[len(self.qmindices):]
         else:  
             # getting gradient of non-prmtop job
-            gradfile='scratch/{:03}/{}/grad_{}_{}.xyz'.format(self.ID,self.node_id,state[0],state[1])
+            gradfile=self.scratch.path('grad_{}_{}.xyz'.format(state[0],state[1]))
             grad = manage_xyz.read_xyz(gradfile,scale=1.0)
             grad = manage_xyz.xyz_to_np(grad)
         self._Gradients[state] = self.Gradient(grad,"Hartree/Bohr")
 
     def parse_coup(self):
-        tempfileout ='scratch/{:03}/{}/output.dat'.format(self.ID,self.node_id)
+        tempfileout =self.scratch.path('output.dat')
         if "prmtop" in self.file_options.ActiveOptions:
             tmpcoup = []
             with open(tempfileout,"r") as f:
@@ -536,7 +546,7 @@ class TeraChem(Lot):
             coup[self.qmindices] = tmpcoup[:len(self.qmindices)]
             coup[self.mm_indices] = tmpcoup[len(self.qmindices):]
         else:
-            coupfile='scratch/{:03}/{}/coup_{}_{}.xyz'.format(self.ID,self.node_id,self.coupling_states[0],self.coupling_states[1])
+            coupfile=self.scratch.path('coup_{}_{}.xyz'.format(self.coupling_states[0],self.coupling_states[1]))
             coup = manage_xyz.read_xyz(coupfile,scale=1.0)
             coup = manage_xyz.xyz_to_np(coup)
         self.Couplings[self.coupling_states] = self.Coupling(coup,'Hartree/Bohr') 
@@ -19,8 +19,11 @@ except:
 from utilities import *
 
 class xTB_lot(Lot):
+    batch_capable = True
+
     def __init__(self,options):
         super(xTB_lot,self).__init__(options)
+        self.batch_calc = None
 
         numbers = []
         E = elements.ElementData()
@@ -37,14 +40,16 @@ class xTB_lot(Lot):
 
         # convert to bohr
         positions = coords* units.ANGSTROM_TO_AU
-        calc = Calculator(get_method(self.xTB_Hamiltonian), self.numbers, positions, charge=self.charge)
-
-        calc.set_accuracy(self.xTB_accuracy)
-        calc.set_electronic_temperature(self.xTB_electronic_temperature)
-        
-        calc.set_output('lot_jobs_{}.txt'.format(self.node_id))
-        res = calc.singlepoint()  # energy printed is only the electronic part
-        calc.release_output()
+        if self.batch_calc is not None:
+            # within runall_batch, the calculator (and its output) is kept
+            calc = self.batch_calc
+            calc.update(positions)
+            res = calc.singlepoint()
+        else:
+            calc = self.new_calculator(positions)
+            calc.set_output('lot_jobs_{}.txt'.format(self.node_id))
+            res = calc.singlepoint()  # energy printed is only the electronic part
+            calc.release_output()
      
         # energy in hartree
         self._Energies[(multiplicity,state)] = self.Energy(res.get_energy(),'Hartree')
@@ -59,6 +64,25 @@ class xTB_lot(Lot):
 
         return res
 
+    def new_calculator(self,positions):
+        calc = Calculator(get_method(self.xTB_Hamiltonian), self.numbers, positions, charge=self.charge)
+        calc.set_accuracy(self.xTB_accuracy)
+        calc.set_electronic_temperature(self.xTB_electronic_temperature)
+        return calc
+
+    def batch_setup(self):
+        super(xTB_lot,self).batch_setup()
+        positions = manage_xyz.xyz_to_np(self.geom)*units.ANGSTROM_TO_AU
+        self.batch_calc = self.new_calculator(positions)
+        self.batch_calc.set_output('lot_jobs_{}.txt'.format(self.node_id))
+
+    def batch_teardown(self):
+        if self.batch_calc is not None:
+            self.batch_calc.release_output()
+        # the calculator cannot be pickled, don't keep it
+        self.batch_calc = None
+        super(xTB_lot,self).batch_teardown()
+
 
 if __name__=="__main__":
     
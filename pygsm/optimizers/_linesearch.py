@@ -166,10 +166,11 @@ def double_golden_section(x,xyz1,xyz7,f1,f7,molecule):
     
     sys.stdout.flush()
     
-    f2 = molecule.PES.get_energy(xyz2)
-    f3 = molecule.PES.get_energy(xyz3)
-    f5 = molecule.PES.get_energy(xyz5)
-    f6 = molecule.PES.get_energy(xyz6)
+    # only the energies of the bracketing points are used
+    f2 = molecule.PES.get_energy(xyz2,runtype='energy')
+    f3 = molecule.PES.get_energy(xyz3,runtype='energy')
+    f5 = molecule.PES.get_energy(xyz5,runtype='energy')
+    f6 = molecule.PES.get_energy(xyz6,runtype='energy')
     print(" Initial Double Golden Section %5.4f %5.4f %5.4f %5.4f %5.4f %5.4f %5.4f kcal/mol" % (f1-refE,f2-refE,f3-refE,f4-refE,f5-refE,f6-refE,f7-refE))
     l = [f1, f2, f3, f4, f5, f6, f7 ]
     sys.stdout.flush()
@@ -558,8 +558,12 @@ class base_optimizer(object):
         if self.options['SCALEQN']>10.0: SCALE=10.0
 
         ## constraint vector
-        norm = np.linalg.norm(ictan)
-        C = ictan/norm
+        # the lowest Hessian mode from Hessian-vector products replaces the tangent if available
+        if molecule.TS_mode is not None and molecule.TS_mode.shape==ictan.shape:
+            C = molecule.TS_mode/np.linalg.norm(molecule.TS_mode)
+        else:
+            norm = np.linalg.norm(ictan)
+            C = ictan/norm
         Vecs = molecule.coord_basis
         Cn = block_matrix.dot(block_matrix.dot(Vecs,block_matrix.transpose(Vecs)),C)
         norm = np.linalg.norm(Cn)
@@ -627,6 +631,7 @@ class base_optimizer(object):
         path_overlap_n = np.argmax(absoverlap)
         return path_overlap,path_overlap_n
 
+    @profiler.timed('update_Hessian')
     def update_Hessian(self,molecule,mode='BFGS'):
         '''
         mode 1 is BFGS, mode 2 is BOFILL
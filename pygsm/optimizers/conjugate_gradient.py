@@ -85,6 +85,11 @@ class conjugate_gradient(base_optimizer):
             # normalize the direction
             actual_step = np.linalg.norm(d)
             print(" actual_step= %1.2f"% actual_step)
+            if actual_step==0.:
+                # zero gradient, e.g. a geometry exactly at a minimum of a model potential
+                print(" zero step, the gradient is zero")
+                self.converged=True
+                break
             d = d/actual_step #normalize
             if actual_step>self.options['DMAX']:
                 step=self.options['DMAX']
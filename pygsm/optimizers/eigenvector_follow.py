@@ -116,6 +116,11 @@ class eigenvector_follow(base_optimizer):
 
             actual_step = np.linalg.norm(dq)
             #print(" actual_step= %1.2f"% actual_step)
+            if actual_step==0.:
+                # zero gradient, e.g. a geometry exactly at a minimum of a model potential
+                print(" zero step, the gradient is zero")
+                self.converged=True
+                break
             dq = dq/actual_step #normalize
             if actual_step>self.DMAX:
                 step=self.DMAX
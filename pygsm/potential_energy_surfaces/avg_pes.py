@@ -28,19 +28,20 @@ class Avg_PES(PES):
             }))
         self._dE=1000.
         self.lot = lot
-        self.lot.do_coupling = True
-        self.lot.coupling_states = (PES1.ad_idx, PES2.ad_idx)
+        # one job per geometry gives both energies, both gradients and the coupling
+        self.lot.prepare_multistate([(PES1.multiplicity,PES1.ad_idx),(PES2.multiplicity,PES2.ad_idx)],
+                coupling=(PES1.ad_idx, PES2.ad_idx))
 
     @classmethod
     def create_pes_from(cls,PES,options={},copy_wavefunction=True):
         lot = type(PES.lot).copy(PES.lot,options,copy_wavefunction)
         return cls(PES.PES1,PES.PES2,lot)
 
-    def get_energy(self,xyz):
+    def get_energy(self,xyz,runtype=None):
         if self.PES1.multiplicity==self.PES2.multiplicity:
             assert self.PES2.ad_idx>self.PES1.ad_idx,"dgrad wrong direction"
-        self.dE = self.PES2.get_energy(xyz) - self.PES1.get_energy(xyz)
-        return 0.5*(self.PES1.get_energy(xyz) + self.PES2.get_energy(xyz))
+        self.dE = self.PES2.get_energy(xyz,runtype) - self.PES1.get_energy(xyz,runtype)
+        return 0.5*(self.PES1.get_energy(xyz,runtype) + self.PES2.get_energy(xyz,runtype))
 
     def get_gradient(self,xyz,frozen_atoms=None):
         return 0.5*(self.PES1.get_gradient(xyz,frozen_atoms) + self.PES2.get_gradient(xyz,frozen_atoms))
@@ -20,6 +20,7 @@ class Penalty_PES(PES):
             sigma=1.0,
             alpha=0.02*units.KCAL_MOL_PER_AU,
             ):
+        self.options = PES1.options
         self.PES1 = PES(PES1.options.copy().set_values({
             "lot": lot,
             }))
@@ -27,6 +28,7 @@ class Penalty_PES(PES):
             "lot": lot,
             }))
         self.lot = lot
+        self.lot.prepare_multistate([(self.PES1.multiplicity,self.PES1.ad_idx),(self.PES2.multiplicity,self.PES2.ad_idx)])
         self.alpha = alpha
         self.dE = 1000.
         self.sigma = sigma
@@ -37,9 +39,9 @@ class Penalty_PES(PES):
         lot = type(PES.lot).copy(PES.lot,options,copy_wavefunction)
         return cls(PES.PES1,PES.PES2,lot,PES.sigma,PES.alpha)
 
-    def get_energy(self,geom):
-        E1 = self.PES1.get_energy(geom)
-        E2 = self.PES2.get_energy(geom)
+    def get_energy(self,geom,runtype=None):
+        E1 = self.PES1.get_energy(geom,runtype)
+        E2 = self.PES2.get_energy(geom,runtype)
    
         #avgE = 0.5*(self.PES1.get_energy(geom) + self.PES2.get_energy(geom))
         avgE = 0.5*(E1+E2)
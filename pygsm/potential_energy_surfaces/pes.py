@@ -1,6 +1,7 @@
 # standard library imports
 import sys
 from os import path
+from concurrent import futures
 
 # third party
 import numpy as np
@@ -12,6 +13,9 @@ from coordinate_systems import rotate
 
 ELEMENT_TABLE = elements.ElementData()
 
+# node_id offset of the level of theory copies of the parallel finite difference Hessian
+FD_WORKER_NODE_ID = 1000
+
 class PES(object):
     """ PES object """
 
@@ -60,6 +64,30 @@ class PES(object):
                 doc='Mass is sometimes required'
                 )
 
+        opt.add_option(
+                key='fd_workers',
+                value=1,
+                required=False,
+                allowed_types=[int],
+                doc='number of displaced gradients of the finite difference Hessian calculated at the same time'
+                )
+
+        opt.add_option(
+                key='fd_symmetrize',
+                value=False,
+                required=False,
+                allowed_types=[bool],
+                doc='symmetrize the finite difference Hessian'
+                )
+
+        opt.add_option(
+                key='fd_one_sided',
+                value=False,
+                required=False,
+                allowed_types=[bool],
+                doc='forward differences (3N+1 gradients) instead of central differences (6N gradients) for the finite difference Hessian'
+                )
+
         PES._default_options = opt
         return PES._default_options.copy()
 
@@ -159,7 +187,7 @@ class PES(object):
          
         return energies
 
-    def get_energy(self,xyz):
+    def get_energy(self,xyz,runtype=None):
         fdE=0.
         if self.FORCE is not None:
             for i in self.FORCE:
@@ -174,22 +202,38 @@ class PES(object):
                 a=i[0]
                 force=i[1]   # In kcal/mol/Ang^2?
                 kdE += 0.5*force*(xyz[a] - self.reference_xyz[a])**2
-        return self.lot.get_energy(xyz,self.multiplicity,self.ad_idx) +fdE +kdE   # Kcal/mol
+        return self.lot.get_energy(xyz,self.multiplicity,self.ad_idx,runtype=runtype) +fdE +kdE   # Kcal/mol
 
 
-    def get_finite_difference_hessian(self,coords,qm_region=None):
+    def get_finite_difference_hessian(self,coords,qm_region=None,workers=None,symmetrize=None,one_sided=None,FD_STEP_LENGTH=0.001):
         ''' Calculate Finite Differnce Hessian
 
         Params:
             coords ((natoms,3) np.ndarray - system coordinates  (x,y,z)
             qm_region list of QM atoms in a QMMM simulation to obtain environment perturbed Hessian with the size of the QM region
+            workers number of displaced gradients calculated at the same time. Each worker
+                has its own copy of the PES and level of theory (and so its own scratch
+                folder), the level of theory of this PES is not used when workers>1
+            symmetrize return (H+H^T)/2
+            one_sided forward differences (3N+1 gradients) instead of central differences (6N gradients)
+            workers, symmetrize and one_sided default to the fd_workers, fd_symmetrize and
+                fd_one_sided options
 
         Returns:
             Hessian (N1,N1) np.ndarray 
 
         '''
+        if workers is None:
+            workers = self.options['fd_workers']
+        if symmetrize is None:
+            symmetrize = self.options['fd_symmetrize']
+        if one_sided is None:
+            one_sided = self.options['fd_one_sided']
+        if workers>1 and not self.lot.thread_safe:
+            print(" {} is not thread safe, calculating the finite difference gradients serially".format(type(self.lot).__name__))
+            workers = 1
+
         if qm_region is None:
-            hess = np.zeros((len(coords)*3,len(coords)*3))
             n1_region = [ x for x in range(3*len(coords)) ]
         else:
             n1_region =[]
@@ -198,26 +242,72 @@ class PES(object):
                     n1_region.append(n*3+j)
             print('n1_region')
             print(n1_region)
-            #hess = np.zeros((len(coords[qm_region])*3,len(coords[qm_region])*3))
-            hess = np.zeros((len(n1_region),len(n1_region)))
+        hess = np.zeros((len(n1_region),len(n1_region)))
         print("hess shape", hess.shape)
 
-        def gen_row(n):
-            vec = np.zeros(coords.shape[0]*3)
-            vec[n] = 1.
-            return vec
-       
-        n_actual = 0
-        for n in range(len(coords)*3):
-            if n in n1_region:
-                print("on hessian product ",n)
-                row = gen_row(n)
-                ans = self.get_finite_difference_hessian_product(coords,row)
-                #hess[n_actual] = np.squeeze(self.get_finite_difference_hessian_product(coords,row))
-                hess[n_actual] = np.squeeze(ans[n1_region])
-                n_actual +=1
+        # displaced geometries, the gradient at coords is the reference for one-sided differences
+        jobs = []
+        for n in n1_region:
+            fdstep = np.zeros(coords.size)
+            fdstep[n] = FD_STEP_LENGTH
+            fdstep = fdstep.reshape(coords.shape)
+            jobs.append(coords+fdstep)
+            if not one_sided:
+                jobs.append(coords-fdstep)
+        if one_sided:
+            jobs.append(coords.copy())
+
+        if workers>1:
+            grads = self.fd_gradients_parallel(jobs,workers)
+        else:
+            grads = []
+            for i,xyz in enumerate(jobs):
+                print("on hessian gradient {} of {}".format(i+1,len(jobs)))
+                grads.append(self.get_gradient(xyz))
+
+        # calculate grad fwd and bwd in a.u. (Bohr/Ha)
+        grads = [np.squeeze(grad)/units.ANGSTROM_TO_AU for grad in grads]
+        for n_actual in range(len(n1_region)):
+            if one_sided:
+                ans = (grads[n_actual]-grads[-1])/FD_STEP_LENGTH
+            else:
+                ans = (grads[2*n_actual]-grads[2*n_actual+1])/(FD_STEP_LENGTH*2)
+            hess[n_actual] = ans[n1_region]
+
+        if symmetrize:
+            hess = 0.5*(hess+hess.T)
         return hess
 
+    def fd_gradients_parallel(self,geoms,workers):
+        '''
+        Gradients at geoms with a pool of worker threads. Worker w calculates geoms
+        w, w+workers, ... with a copy of this PES made in its thread, the copies
+        have node_id FD_WORKER_NODE_ID*(w+1)+node_id so each has a scratch folder.
+        The external programs run as subprocesses, so the jobs run concurrently.
+        The scratch folders of the copies are removed afterwards.
+        '''
+        workers = min(workers,len(geoms))
+        print(" Calculating {} finite difference gradients with {} workers".format(len(geoms),workers))
+
+        def worker(w):
+            pes = type(self).create_pes_from(self,{
+                'node_id': FD_WORKER_NODE_ID*(w+1)+self.lot.node_id,
+                'result_cache_file': None,
+                })
+            if hasattr(self,'reference_xyz'):
+                pes.reference_xyz = self.reference_xyz
+            try:
+                return [(i,pes.get_gradient(geoms[i])) for i in range(w,len(geoms),workers)]
+            finally:
+                pes.lot.remove_scratch()
+
+        grads = [None]*len(geoms)
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for result in executor.map(worker,range(workers)):
+                for i,grad in result:
+                    grads[i] = grad
+        return grads
+
     def get_finite_difference_hessian_product(self,coords,direction,FD_STEP_LENGTH=0.001):
 
         # format the direction
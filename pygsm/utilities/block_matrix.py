@@ -1,5 +1,6 @@
 import numpy as np
 from scipy.linalg import block_diag
+import scipy.sparse as sparse
 from .nifty import printcool,pvec1d
 import sys
 from .math_utils import orthogonalize,conjugate_orthogonalize
@@ -26,7 +27,27 @@ class block_matrix(object):
 
     @staticmethod
     def full_matrix(A):
-        return block_diag(*A.matlist)
+        return block_diag(*[block_matrix.dense_block(m) for m in A.matlist])
+
+    # Blocks can be dense np.ndarrays or scipy.sparse matrices (see the sparse_wilsonB
+    # coordinate option). These two helpers are used wherever a block is touched directly.
+    @staticmethod
+    def dense_block(A):
+        if sparse.issparse(A):
+            return A.toarray()
+        return A
+
+    @staticmethod
+    def block_dot(A,B):
+        if sparse.issparse(A):
+            return A.dot(B)
+        elif sparse.issparse(B):
+            return B.T.dot(A.T).T
+        return np.dot(A,B)
+
+    @staticmethod
+    def is_sparse(BM):
+        return any(sparse.issparse(A) for A in BM.matlist)
 
     @property
     def num_blocks(self):
@@ -343,7 +364,7 @@ class block_matrix(object):
 
     @staticmethod
     def diagonal(BM):
-        la = [ np.diagonal(A) for A in BM.matlist ]
+        la = [ A.diagonal() for A in BM.matlist ]
         return np.concatenate(la)
     
     @staticmethod
@@ -406,7 +427,7 @@ class block_matrix(object):
         return self.__mul__(lhs)
 
     def __len__(self):  #size along first axis
-        return np.sum([len(A) for A in self.matlist])
+        return np.sum([A.shape[0] for A in self.matlist])
 
     def __truediv__(self,rhs):
         if isinstance(rhs, self.__class__):
@@ -447,7 +468,7 @@ class block_matrix(object):
             result=[]
             for A in block.matlist:
                 e = s + np.shape(A)[1]
-                result.append(np.dot(A,vec[s:e]))
+                result.append(block_matrix.block_dot(A,vec[s:e]))
                 s=e
             return np.reshape(np.concatenate(result),(-1,1))
         def vec_block_dot(vec,block,**kwargs):
@@ -458,13 +479,13 @@ class block_matrix(object):
             result=[]
             for A in block.matlist:
                 e = s + np.shape(A)[1]
-                result.append(np.dot(vec[s:e],A))
+                result.append(block_matrix.block_dot(vec[s:e],A))
                 s=e
             return np.reshape(np.concatenate(result),(-1,1))
 
         # (1) both are block matrices
         if isinstance(left,block_matrix) and isinstance(right,block_matrix):
-            return block_matrix([np.dot(A,B) for A,B in zip(left.matlist,right.matlist)])
+            return block_matrix([block_matrix.block_dot(A,B) for A,B in zip(left.matlist,right.matlist)])
         # (2) left is np.ndarray with a vector shape
         elif isinstance(left,np.ndarray) and (left.ndim==1 or left.shape[1]==1) and isinstance(right,block_matrix):
             return vec_block_dot(left,right)
@@ -480,7 +501,7 @@ class block_matrix(object):
             tmp_ans=[]
             for A in right.matlist:
                 ec = sc+A.shape[0]
-                tmp_ans.append(np.dot(left[:,sc:ec],A))
+                tmp_ans.append(block_matrix.block_dot(left[:,sc:ec],A))
                 sc=ec
             dot_product=np.hstack(tmp_ans)
             return dot_product
@@ -493,7 +514,7 @@ class block_matrix(object):
             tmp_ans=[]
             for A in left.matlist:
                 ec = sc+A.shape[1]
-                tmp_ans.append(np.dot(A,right[sc:ec,:]))
+                tmp_ans.append(block_matrix.block_dot(A,right[sc:ec,:]))
                 sc=ec
             dot_product=np.vstack(tmp_ans)
             return dot_product
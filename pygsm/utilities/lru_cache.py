@@ -0,0 +1,91 @@
+from __future__ import print_function
+
+# standard library imports
+from collections import OrderedDict
+
+# third party
+import numpy as np
+import scipy.sparse as sparse
+
+
+def nbytes(obj):
+    '''
+    Approximate memory used by the arrays in obj. Handles numpy arrays,
+    scipy.sparse matrices, block_matrix-like objects (matlist) and tuples/lists.
+    '''
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    elif sparse.issparse(obj):
+        obj = obj.tocsr() if not hasattr(obj, 'indptr') else obj
+        return obj.data.nbytes + obj.indices.nbytes + obj.indptr.nbytes
+    elif hasattr(obj, 'matlist'):
+        return sum(nbytes(m) for m in obj.matlist)
+    elif isinstance(obj, (tuple, list)):
+        return sum(nbytes(m) for m in obj)
+    return 0
+
+
+class LRUCache(object):
+    '''
+    Least-recently-used cache with a limit on the number of entries and on the
+    total number of bytes stored. Keeps hit/miss/eviction counters.
+    '''
+
+    def __init__(self, max_bytes=100*1024**2, max_entries=1000):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.sizes = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits += 1
+            return self.data[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if key in self.data:
+            self.current_bytes -= self.sizes.pop(key)
+            del self.data[key]
+        size = nbytes(value)
+        # an entry larger than the budget is never stored
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        self.data[key] = value
+        self.sizes[key] = size
+        self.current_bytes += size
+        while len(self.data) > self.max_entries or (self.max_bytes is not None and self.current_bytes > self.max_bytes):
+            old_key, _ = self.data.popitem(last=False)
+            self.current_bytes -= self.sizes.pop(old_key)
+            self.evictions += 1
+
+    def clear(self):
+        ''' Remove the entries, the counters are kept '''
+        self.data.clear()
+        self.sizes = {}
+        self.current_bytes = 0
+
+    def stats(self):
+        return {
+                'entries': len(self.data),
+                'bytes': self.current_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                }
+
+    def __repr__(self):
+        s = self.stats()
+        return "entries {entries} ({mb:.1f} MB) hits {hits} misses {misses} evictions {evictions}".format(mb=s['bytes']/1024.**2, **s)
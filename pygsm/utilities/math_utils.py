@@ -198,3 +198,61 @@ def orthogonalize(vecs,numCvecs=0):
         raise RuntimeError("error in orthonormality")
     return basis
 
+
+
+def davidson_lowest(matvec, guess, precond=None, thre=1e-3, max_iter=10):
+    """
+    Lowest eigenpair of a symmetric matrix A that is only available through
+    matrix-vector products (e.g. finite difference Hessian-vector products).
+
+    Params:
+        matvec function returning A*v for a flat vector v
+        guess  starting vector (e.g. the reaction path tangent)
+        precond approximate A (n,n) np.ndarray, the correction vector solves
+                (precond - theta*I) t = -r. Without it the residual is used.
+        thre    convergence threshold on the norm of the residual
+        max_iter maximum number of matrix-vector products
+
+    Returns:
+        theta (float) - eigenvalue
+        x ((n,) np.ndarray) - normalized eigenvector
+        niter (int) - number of matrix-vector products
+        converged (bool)
+    """
+
+    V = np.zeros((len(guess),0))
+    AV = np.zeros((len(guess),0))
+    t = np.asarray(guess,dtype=float).flatten()
+    theta = 0.
+    x = t/np.linalg.norm(t)
+    converged = False
+    for niter in range(1,max_iter+1):
+        # orthonormalize the new direction against the subspace (twice for stability)
+        for _ in range(2):
+            t = t - np.dot(V,np.dot(V.T,t))
+        tnorm = np.linalg.norm(t)
+        if tnorm < 1e-8:
+            niter -= 1
+            break
+        t = t/tnorm
+        V = np.column_stack((V,t))
+        AV = np.column_stack((AV,matvec(t)))
+
+        # Rayleigh-Ritz in the subspace
+        S = np.dot(V.T,AV)
+        eigen,vecs = np.linalg.eigh(0.5*(S+S.T))
+        theta = eigen[0]
+        x = np.dot(V,vecs[:,0])
+        r = np.dot(AV,vecs[:,0]) - theta*x
+        if np.linalg.norm(r) < thre:
+            converged = True
+            break
+
+        # correction vector
+        t = -r
+        if precond is not None:
+            try:
+                t = np.linalg.solve(precond-theta*np.eye(len(r)),-r)
+            except np.linalg.LinAlgError:
+                pass
+    return theta, x/np.linalg.norm(x), niter, converged
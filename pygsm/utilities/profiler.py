@@ -0,0 +1,140 @@
+from __future__ import print_function
+
+# standard library imports
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+'''
+Named timers and counters for the whole process.
+
+    with profiler.timer('build_dlc'):
+        ...
+
+    @profiler.timed('wilsonB')
+    def wilsonB(self,xyz):
+        ...
+
+    profiler.count('newCartesian microiterations')
+
+Times are inclusive (a timer running inside another counts for both).
+print_report() prints a table and write_report() a JSON file. Worker
+processes can send their snapshot() to the parent, which merge()s it.
+'''
+
+enabled = True
+
+_timers = OrderedDict()     # name -> [calls, total, max]
+_counters = OrderedDict()   # name -> count
+_t0 = time.time()
+
+
+def add_time(name, dt):
+    entry = _timers.get(name)
+    if entry is None:
+        _timers[name] = [1, dt, dt]
+    else:
+        entry[0] += 1
+        entry[1] += dt
+        if dt > entry[2]:
+            entry[2] = dt
+
+
+@contextmanager
+def timer(name):
+    if not enabled:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - t)
+
+
+def timed(name):
+    ''' Decorator timing every call of the function under name '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            t = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - t)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def reset():
+    global _t0
+    _timers.clear()
+    _counters.clear()
+    _t0 = time.time()
+
+
+def snapshot():
+    return {
+            'timers': {name: list(entry) for name, entry in _timers.items()},
+            'counters': dict(_counters),
+            }
+
+
+def merge(snap):
+    ''' Adds the timers and counters of a snapshot (e.g. from a worker process) '''
+    for name, (calls, total, tmax) in snap['timers'].items():
+        entry = _timers.get(name)
+        if entry is None:
+            _timers[name] = [calls, total, tmax]
+        else:
+            entry[0] += calls
+            entry[1] += total
+            entry[2] = max(entry[2], tmax)
+    for name, n in snap['counters'].items():
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def report():
+    timers = OrderedDict()
+    for name, (calls, total, tmax) in sorted(_timers.items(), key=lambda x: -x[1][1]):
+        timers[name] = {
+                'calls': calls,
+                'total': total,
+                'mean': total/calls,
+                'max': tmax,
+                }
+    return {
+            'wall_time': time.time() - _t0,
+            'timers': timers,
+            'counters': OrderedDict(sorted(_counters.items())),
+            }
+
+
+def print_report(title='Timings'):
+    rep = report()
+    print(" {} (wall time {:.2f} s)".format(title, rep['wall_time']))
+    if rep['timers']:
+        print(" {:<36s} {:>9s} {:>12s} {:>12s} {:>12s}".format('timer', 'calls', 'total (s)', 'mean (s)', 'max (s)'))
+        for name, t in rep['timers'].items():
+            print(" {:<36s} {:>9d} {:>12.3f} {:>12.3e} {:>12.3e}".format(name, t['calls'], t['total'], t['mean'], t['max']))
+    if rep['counters']:
+        print(" {:<36s} {:>9s}".format('counter', 'count'))
+        for name, n in rep['counters'].items():
+            print(" {:<36s} {:>9d}".format(name, n))
+
+
+def write_report(filename, **extra):
+    ''' Writes the report as JSON, extra key-word arguments are added at the top level '''
+    rep = report()
+    rep.update(extra)
+    with open(filename, 'w') as f:
+        json.dump(rep, f, indent=2)
@@ -16,6 +16,7 @@ from pygsm.coordinate_systems import Angle, DelocalizedInternalCoordinates, Dihe
 from pygsm.growing_string_methods import DE_GSM, SE_Cross, SE_GSM
 from pygsm.level_of_theories.ase import ASELoT
 from pygsm.level_of_theories.xtb_lot import xTB_lot
+from pygsm.level_of_theories.model_lot import ModelLot
 from pygsm.optimizers import beales_cg, conjugate_gradient, eigenvector_follow, lbfgs
 from pygsm.potential_energy_surfaces import Avg_PES, PES, Penalty_PES
 from pygsm.utilities import elements, manage_xyz, nifty
@@ -43,7 +44,7 @@ def parse_arguments(verbose=True):
     parser.add_argument('-package', default="QChem", type=str,
                         help="Electronic structure theory package (default: %(default)s)",
                         choices=["QChem", "Orca", "Molpro", "PyTC", "TeraChemCloud", "OpenMM", "DFTB", "TeraChem",
-                                 "BAGEL", "xTB_lot", "ase"])
+                                 "BAGEL", "xTB_lot", "ase", "ModelLot"])
     parser.add_argument('-lot_inp_file', type=str, default=None,
                         help='external file to specify calculation e.g. qstart,gstart,etc. Highly package specific.',
                         required=False)
@@ -101,6 +102,19 @@ def parse_arguments(verbose=True):
     parser.add_argument('-restart_file', help='restart file', type=str)
     parser.add_argument('-mp_cores', type=int, default=1,
                         help="Use python multiprocessing to parallelize jobs on a single compute node. Set OMP_NUM_THREADS, ncpus accordingly.")
+    parser.add_argument('-node_workers', type=int, default=1,
+                        help="Number of processes used to optimize the string nodes concurrently. Each node runs its own QM jobs, so set -nproc accordingly.")
+    parser.add_argument('-async_lot', action='store_true',
+                        help="Run the energy/gradient jobs of the active nodes concurrently before optimizing them.")
+    parser.add_argument('-ts_mode_hvp', action='store_true',
+                        help="Find the lowest Hessian mode of the TS node from Hessian-vector products when the TS Hessian is modified.")
+    parser.add_argument('-ts_hessian', action='store_true',
+                        help="Calculate the finite difference Cartesian Hessian of the TS node at the end and write it to TSnode_hessian.txt")
+    parser.add_argument('-fd_workers', type=int, default=1,
+                        help="Number of displaced gradients of the finite difference Hessian calculated at the same time, each with its own copy of the level of theory.")
+    parser.add_argument('-fd_symmetrize', action='store_true', help="Symmetrize the finite difference Hessian")
+    parser.add_argument('-fd_one_sided', action='store_true',
+                        help="Forward differences (3N+1 gradients) instead of central differences (6N gradients) for the finite difference Hessian")
     parser.add_argument('-dont_analyze_ICs', action='store_false',
                         help="Don't post-print the internal coordinates primitives and values")  # defaults to true
     parser.add_argument('-hybrid_coord_idx_file', type=str, default=None,
@@ -119,6 +133,31 @@ def parse_arguments(verbose=True):
     parser.add_argument('-interp_method', default='DLC', type=str, help='')
     parser.add_argument('-bonds_file', type=str, help="A file which contains the bond indices (0-based)")
     parser.add_argument('-start_climb_immediately',action='store_true',help='Start climbing immediately when restarting.')
+    parser.add_argument('-gradient_db', type=str, default=None,
+                        help='SQLite file storing every energy/gradient calculated. Reruns with the same level of theory settings reuse them.')
+    parser.add_argument('-gradient_db_tol', type=float, default=1e-5,
+                        help='Maximum Cartesian deviation (Angstrom) for a gradient_db record to be reused (default: %(default)s)')
+    parser.add_argument('-result_cache_size', type=int, default=0,
+                        help='Number of energies/gradients each node keeps for reuse, looked up by the coordinates rounded to 8 decimals. '
+                        'Needed for the batched node evaluation of in-process level of theories (default: %(default)s, off)')
+    parser.add_argument('-result_cache_file', type=str, default=None,
+                        help='File the result cache of each node is kept in (cache.pkl -> cache_3.pkl), the results of each job are appended to it')
+    parser.add_argument('-multistate_job', action='store_true',
+                        help='Calculate all the states in one program invocation (QChem, ORCA) instead of one job per state.')
+    parser.add_argument('-lazy_gradients', action='store_true',
+                        help='Energy-only jobs where only energies are needed (line searches, peak search), gradients when asked for.')
+    parser.add_argument('-scratch_root', type=str, default='scratch',
+                        help='Folder for the scratch files of the electronic structure programs, e.g. /dev/shm/pygsm (default: %(default)s)')
+    parser.add_argument('-energy_file_interval', type=int, default=1,
+                        help='Write the E_{node}.txt energy files every this many jobs, 0 never (default: %(default)s)')
+    parser.add_argument('-driver', type=str, default='subprocess', choices=['subprocess', 'resident'],
+                        help='subprocess starts the program for every job, resident keeps a server per worker (default: %(default)s)')
+    parser.add_argument('-server_protocol', type=str, default='json', choices=['json', 'tcpb'],
+                        help='Protocol of the resident server, tcpb for the TeraChem protocol buffer server (default: %(default)s)')
+    parser.add_argument('-server_address', type=str, default=None,
+                        help='host:port of a running resident server')
+    parser.add_argument('-server_command', type=str, default=None,
+                        help='Command starting a resident server per worker, {port} is replaced by a free port, e.g. "terachem -s {port}"')
 
     # ASE calculator's options
     group_ase = parser.add_argument_group('ASE', 'ASE calculator options')
@@ -160,6 +199,18 @@ def parse_arguments(verbose=True):
         'xTB_Hamiltonian': args.xTB_Hamiltonian,
         'xTB_accuracy': args.xTB_accuracy,
         'xTB_electronic_temperature': args.xTB_electronic_temperature,
+        'gradient_db': args.gradient_db,
+        'gradient_db_tol': args.gradient_db_tol,
+        'result_cache_size': args.result_cache_size,
+        'result_cache_file': args.result_cache_file,
+        'multistate_job': args.multistate_job,
+        'lazy_gradients': args.lazy_gradients,
+        'scratch_root': args.scratch_root,
+        'energy_file_interval': args.energy_file_interval,
+        'driver': args.driver,
+        'server_protocol': args.server_protocol,
+        'server_address': args.server_address,
+        'server_command': args.server_command,
 
         # PES
         'PES_type': args.pes_type,
@@ -214,6 +265,13 @@ def parse_arguments(verbose=True):
         'optimize_meci': args.optimize_meci,
         'bonds_file': args.bonds_file,
         'mp_cores': args.mp_cores,
+        'node_workers': args.node_workers,
+        'async_lot': args.async_lot,
+        'ts_mode_hvp': args.ts_mode_hvp,
+        'ts_hessian': args.ts_hessian,
+        'fd_workers': args.fd_workers,
+        'fd_symmetrize': args.fd_symmetrize,
+        'fd_one_sided': args.fd_one_sided,
         'interp_method': args.interp_method,
         'only_drive': args.only_drive,
         'reparametrize': args.reparametrize,
@@ -246,7 +304,7 @@ def parse_arguments(verbose=True):
     return inpfileq
 
 
-def create_lot(inpfileq: dict, geom):
+def create_lot(inpfileq: dict, geom, reference_geoms=()):
     # decision making
     inpfileq['states'] = [(int(m), int(s)) for m, s in zip(inpfileq["multiplicity"], inpfileq["adiabatic_index"])]
     do_coupling = inpfileq['PES_type'] == "Avg_PES"
@@ -263,6 +321,18 @@ def create_lot(inpfileq: dict, geom):
         nproc=inpfileq["nproc"],
         charge=inpfileq["charge"],
         do_coupling=do_coupling,
+        gradient_db=inpfileq['gradient_db'],
+        gradient_db_tol=inpfileq['gradient_db_tol'],
+        result_cache_size=inpfileq['result_cache_size'],
+        result_cache_file=inpfileq['result_cache_file'],
+        multistate_job=inpfileq['multistate_job'],
+        lazy_gradients=inpfileq['lazy_gradients'],
+        scratch_root=inpfileq['scratch_root'],
+        energy_file_interval=inpfileq['energy_file_interval'],
+        driver=inpfileq['driver'],
+        server_protocol=inpfileq['server_protocol'],
+        server_address=inpfileq['server_address'],
+        server_command=inpfileq['server_command'],
     )
 
     # actual LoT choice
@@ -278,6 +348,11 @@ def create_lot(inpfileq: dict, geom):
             **lot_options
         )
 
+    if lot_name == "ModelLot":
+        # analytic model potentials, options (potential,...) are read from lot_inp_file
+        # the bonds of the reference_geoms (the product) are part of the model too
+        return ModelLot.from_options(job_data={'reference_geoms': list(reference_geoms)}, **lot_options)
+
     if lot_name == "xTB_lot":
         return xTB_lot.from_options(
             xTB_Hamiltonian=inpfileq['xTB_Hamiltonian'],
@@ -299,6 +374,9 @@ def choose_pes(lot, inpfileq: dict):
             multiplicity=inpfileq['multiplicity'][0],
             FORCE=inpfileq['FORCE'],
             RESTRAINTS=inpfileq['RESTRAINTS'],
+            fd_workers=inpfileq['fd_workers'],
+            fd_symmetrize=inpfileq['fd_symmetrize'],
+            fd_one_sided=inpfileq['fd_one_sided'],
         )
     else:
         pes1 = PES.from_options(
@@ -306,6 +384,9 @@ def choose_pes(lot, inpfileq: dict):
             ad_idx=inpfileq['states'][0][1],
             FORCE=inpfileq['FORCE'],
             RESTRAINTS=inpfileq['RESTRAINTS'],
+            fd_workers=inpfileq['fd_workers'],
+            fd_symmetrize=inpfileq['fd_symmetrize'],
+            fd_one_sided=inpfileq['fd_one_sided'],
         )
         pes2 = PES.from_options(
             lot=lot,
@@ -313,6 +394,9 @@ def choose_pes(lot, inpfileq: dict):
             ad_idx=inpfileq['states'][1][1],
             FORCE=inpfileq['FORCE'],
             RESTRAINTS=inpfileq['RESTRAINTS'],
+            fd_workers=inpfileq['fd_workers'],
+            fd_symmetrize=inpfileq['fd_symmetrize'],
+            fd_one_sided=inpfileq['fd_one_sided'],
         )
         if inpfileq['PES_type'] == "Avg_PES":
             pes = Avg_PES(PES1=pes1, PES2=pes2, lot=lot)
@@ -367,7 +451,7 @@ def main():
 
     # LOT
     nifty.printcool("Build the {} level of theory (LOT) object".format(inpfileq['EST_Package']))
-    lot = create_lot(inpfileq, geoms[0])
+    lot = create_lot(inpfileq, geoms[0], geoms[-1:] if inpfileq['gsm_type'] == "DE_GSM" else ())
 
     # PES
     if inpfileq['gsm_type'] == "SE_Cross":
@@ -550,7 +634,7 @@ def main():
     elif inpfileq['gsm_type'] == 'SE_GSM' or inpfileq['gsm_type'] == 'SE_Cross':
         for dc in driving_coord_prims:
             if type(dc) != Distance:  # Already handled in topology
-                if dc not in p1.Internals:
+                if not p1.has_prim(dc):
                     print("Adding driving coord prim {} to Internals".format(dc))
                     p1.append_prim_to_block(dc)
 
@@ -608,6 +692,9 @@ def main():
             print_level=inpfileq['gsm_print_level'],
             xyz_writer=XYZ_WRITERS[inpfileq['xyz_output_format']],
             mp_cores=inpfileq["mp_cores"],
+            node_workers=inpfileq["node_workers"],
+            async_lot=inpfileq["async_lot"],
+            ts_mode_hvp=inpfileq["ts_mode_hvp"],
             interp_method=inpfileq["interp_method"],
         )
     else:
@@ -631,6 +718,9 @@ def main():
             ID=inpfileq['ID'],
             xyz_writer=XYZ_WRITERS[inpfileq['xyz_output_format']],
             mp_cores=inpfileq["mp_cores"],
+            node_workers=inpfileq["node_workers"],
+            async_lot=inpfileq["async_lot"],
+            ts_mode_hvp=inpfileq["ts_mode_hvp"],
             interp_method=inpfileq["interp_method"],
         )
 
@@ -692,9 +782,14 @@ def main():
         else:
             inpfileq['max_opt_steps'] = 20
 
-    if inpfileq["restart_file"] is not None:
-        gsm.setup_from_geometries(geoms, reparametrize=inpfileq["reparametrize"], start_climb_immediately=inpfileq["start_climb_immediately"])
-    gsm.go_gsm(inpfileq['max_gsm_iters'], inpfileq['max_opt_steps'], rtype)
+    # the worker pools are closed also when the run fails, so that no workers (and their servers) are left behind
+    try:
+        if inpfileq["restart_file"] is not None:
+            gsm.setup_from_geometries(geoms, reparametrize=inpfileq["reparametrize"], start_climb_immediately=inpfileq["start_climb_immediately"])
+        gsm.go_gsm(inpfileq['max_gsm_iters'], inpfileq['max_opt_steps'], rtype)
+    finally:
+        gsm.close_pool()
+    gsm.timing_report()
     if inpfileq['gsm_type'] == 'SE_Cross':
         post_processing(
             gsm,
@@ -712,6 +807,9 @@ def main():
             have_TS=True,
         )
         manage_xyz.write_xyz(f'TSnode.xyz', gsm.nodes[gsm.TSnode].geometry)
+        if inpfileq['ts_hessian']:
+            nifty.printcool("FINITE DIFFERENCE HESSIAN OF THE TS NODE")
+            np.savetxt(f'TSnode_hessian.txt', gsm.nodes[gsm.TSnode].finiteDifferenceHessian)
 
     cleanup_scratch(gsm.ID)
 
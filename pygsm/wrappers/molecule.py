@@ -181,12 +181,18 @@ class Molecule(object):
             new_geom = MoleculeA.geometry
             coord_obj = type(MoleculeA.coord_obj)(MoleculeA.coord_obj.options.copy())
 
+        # the Hessians are updated in place, each node needs its own
+        Primitive_Hessian = MoleculeA.Data['Primitive_Hessian']
+        Hessian = MoleculeA.Data['Hessian']
+
         return Molecule(MoleculeA.Data.copy().set_values({
             'PES': PES,
             'coord_obj':coord_obj,
             'geom':new_geom,
             'node_id':new_node_id,
             'copy_wavefunction':copy_wavefunction,
+            'Primitive_Hessian': np.copy(Primitive_Hessian) if Primitive_Hessian is not None else None,
+            'Hessian': np.copy(Hessian) if Hessian is not None else None,
             }))
 
 
@@ -197,6 +203,10 @@ class Molecule(object):
 
         self.Data=options
 
+        # bumped by the xyz setter, derived quantities are memoized per version (see memoize)
+        self.geometry_version = 0
+        self._memo = {}
+
         # => Read in the coordinates <= #
         # important first try to read in geom
 
@@ -288,6 +298,8 @@ class Molecule(object):
         self.isTSnode=False
         self.bdist =0.
         self.newHess = 5
+        # lowest Hessian mode (primitive basis) from lowest_Hessian_mode, followed by the TS step
+        self.TS_mode = None
 
         if self.Data['Hessian'] is None and self.Data['Form_Hessian']:
             if self.Data['Primitive_Hessian'] is None and type(self.coord_obj) is not CartesianCoordinates:
@@ -412,26 +424,45 @@ class Molecule(object):
     def gradx(self):
         return np.reshape(self.PES.get_gradient(self.xyz,frozen_atoms=self.frozen_atoms),(-1,3))
 
+    def memoize(self,name,compute,*inputs):
+        '''
+        Returns compute() for the current geometry and coordinate system. The value is
+        kept until the geometry version, the basis (coord_obj.basis_version) or the
+        primitives (Prims.basis_version) change, or one of inputs (e.g. the Cartesian
+        gradient to transform) differs. A copy is returned, callers may modify it.
+        '''
+        key = (self.geometry_version,self.coord_obj.basis_version,self.coord_obj.Prims.basis_version)
+        memo = self._memo.get(name)
+        if memo is not None and memo[0]==key and all(np.array_equal(a,b) for a,b in zip(memo[1],inputs)):
+            profiler.count('Molecule.{} memoized'.format(name))
+            return memo[2].copy()
+        value = compute()
+        self._memo[name] = (key,[np.array(a,copy=True) for a in inputs],value)
+        return value.copy()
+
+    def transform_gradient(self,name,gradx):
+        return self.memoize(name,lambda: self.coord_obj.calcGrad(self.xyz,gradx),gradx)
+
     @property
     def gradient(self):
         gradx = self.PES.get_gradient(self.xyz,frozen_atoms=self.frozen_atoms) 
-        return self.coord_obj.calcGrad(self.xyz,gradx)  #CartesianCoordinate just returns gradx
+        return self.transform_gradient('gradient',gradx)  #CartesianCoordinate just returns gradx
 
     # for PES seams
     @property
     def avg_gradient(self):
         gradx = self.PES.get_avg_gradient(self.xyz,frozen_atoms=self.frozen_atoms) 
-        return self.coord_obj.calcGrad(self.xyz,gradx)  #CartesianCoordinate just returns gradx
+        return self.transform_gradient('avg_gradient',gradx)  #CartesianCoordinate just returns gradx
 
     @property
     def derivative_coupling(self):
         dvecx = self.PES.get_coupling(self.xyz,frozen_atoms=self.frozen_atoms)
-        return self.coord_obj.calcGrad(self.xyz,dvecx)
+        return self.transform_gradient('derivative_coupling',dvecx)
 
     @property
     def difference_gradient(self):
         dgradx = self.PES.get_dgrad(self.xyz,frozen_atoms=self.frozen_atoms) 
-        return self.coord_obj.calcGrad(self.xyz,dgradx)
+        return self.transform_gradient('difference_gradient',dgradx)
     
     @property
     def difference_energy(self):
@@ -495,6 +526,7 @@ class Molecule(object):
     def xyz(self,newxyz=None):
         if newxyz is not None:
             self.Data['xyz']=newxyz
+            self.geometry_version += 1
 
     @property
     def frozen_atoms(self):
@@ -525,7 +557,39 @@ class Molecule(object):
     @property
     def finiteDifferenceHessian(self):
         return self.PES.get_finite_difference_hessian(self.xyz)
-   
+
+    def lowest_Hessian_mode(self,guess,precond=None,thre=1e-3,max_iter=8):
+        '''
+        Lowest eigenvalue and eigenvector of the Hessian in the coordinate basis from
+        Hessian-vector products (Davidson), without the full Hessian. Each product
+        is two gradients (PES.get_finite_difference_hessian_product) along the
+        Cartesian displacement B^T G^-1 u of the trial vector u. The current Hessian
+        is the default preconditioner.
+
+        Params:
+            guess (num_coordinates,1) starting vector in the coordinate basis, e.g. the tangent
+            precond approximate Hessian in the coordinate basis
+
+        Returns:
+            eigenvalue, eigenvector ((num_coordinates,1) np.ndarray)
+        '''
+        xyz = self.xyz
+        Bmat = self.coord_obj.wilsonB(xyz)
+
+        def matvec(u):
+            dx = block_matrix.dot(block_matrix.transpose(Bmat),self.coord_obj.GSolve(xyz,u))
+            dx = np.asarray(dx).flatten()
+            norm = np.linalg.norm(dx)
+            # Ha/Bohr/Angstrom -> Ha/Angstrom**2 like the gradient
+            Hdx = norm*units.ANGSTROM_TO_AU*np.asarray(self.PES.get_finite_difference_hessian_product(xyz,dx)).flatten()
+            return self.coord_obj.GSolve(xyz,block_matrix.dot(Bmat,Hdx))
+
+        if precond is None:
+            precond = self.Hessian
+        eigen,mode,niter,converged = math_utils.davidson_lowest(matvec,guess,precond,thre,max_iter)
+        print(" lowest Hessian mode {:1.4f} from {} Hessian-vector products (converged: {})".format(eigen,niter,converged))
+        return eigen,np.reshape(mode,(-1,1))
+
     @property
     def primitive_internal_coordinates(self):
         return self.coord_obj.Prims.Internals
@@ -544,8 +608,7 @@ class Molecule(object):
 
     @property
     def primitive_internal_values(self):
-        ans =self.coord_obj.Prims.calculate(self.xyz)
-        return np.asarray(ans)
+        return self.memoize('primitive_internal_values',lambda: np.asarray(self.coord_obj.Prims.calculate(self.xyz)))
 
     @property
     def coord_basis(self):
@@ -573,7 +636,7 @@ class Molecule(object):
 
     @property
     def coordinates(self):
-        return np.reshape(self.coord_obj.calculate(self.xyz),(-1,1))
+        return self.memoize('coordinates',lambda: np.reshape(self.coord_obj.calculate(self.xyz),(-1,1)))
 
     def mult_bm(self,left,right):
         return block_matrix.dot(left,right)
@@ -0,0 +1,102 @@
+"""
+Tests with the analytic model potential (ModelLot), they need no external program.
+
+    python -m pytest tests
+"""
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'pygsm'))
+
+from level_of_theories.model_lot import ModelLot
+from potential_energy_surfaces import PES
+from utilities import manage_xyz, units
+
+
+def read_profile(path):
+    """ Energies of the [GEOCONV] energy block of a molden string file """
+    energies = []
+    with open(path) as f:
+        lines = iter(f)
+        for line in lines:
+            if line.strip() == 'energy':
+                for line in lines:
+                    try:
+                        energies.append(float(line))
+                    except ValueError:
+                        break
+                break
+    return np.array(energies)
+
+
+def run_de_gsm(rundir, node_workers):
+    rundir.mkdir()
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT))
+    cmd = [sys.executable, '-m', 'pygsm.wrappers.main',
+           '-xyzfile', os.path.join(ROOT, 'data', 'diels_alder.xyz'),
+           '-package', 'ModelLot',
+           '-mode', 'DE_GSM',
+           '-num_nodes', '9',
+           '-max_gsm_iters', '6',
+           '-max_opt_steps', '3',
+           '-reactant_geom_fixed', '-product_geom_fixed',
+           '-node_workers', str(node_workers)]
+    with open(str(rundir / 'gsm.log'), 'w') as log:
+        subprocess.check_call(cmd, cwd=str(rundir), stdout=log, stderr=subprocess.STDOUT, env=env)
+    return read_profile(str(rundir / 'opt_converged_000.xyz'))
+
+
+def test_de_gsm_node_workers(tmp_path):
+    ''' Optimizing the nodes with a pool of workers gives the string of the serial run '''
+    serial = run_de_gsm(tmp_path / 'serial', 1)
+    parallel = run_de_gsm(tmp_path / 'parallel', 3)
+    assert len(serial) == 9
+    assert serial.shape == parallel.shape
+    np.testing.assert_allclose(parallel, serial, rtol=0., atol=1e-6)
+
+
+def morse_hessian(lot, xyz):
+    ''' Analytic Hessian (kcal/mol/Angstrom^2) of the Morse bonds of lot '''
+    H = np.zeros((lot.natoms, 3, lot.natoms, 3))
+    for a, b, r0 in zip(lot.bonds[0], lot.bonds[1], lot.r0):
+        d = xyz[a]-xyz[b]
+        r = np.linalg.norm(d)
+        u = d/r
+        ex = np.exp(-lot.morse_a*(r-r0))
+        dEdr = 2.*lot.morse_de*lot.morse_a*(1.-ex)*ex
+        d2Edr2 = 2.*lot.morse_de*lot.morse_a**2*ex*(2.*ex-1.)
+        K = d2Edr2*np.outer(u, u) + dEdr/r*(np.eye(3)-np.outer(u, u))
+        H[a, :, a] += K
+        H[b, :, b] += K
+        H[a, :, b] -= K
+        H[b, :, a] -= K
+    return H.reshape(3*lot.natoms, 3*lot.natoms)
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_finite_difference_hessian(workers, tmp_path, monkeypatch):
+    ''' The finite difference Hessian of the Morse model matches the analytic one '''
+    # the level of theory and its copies make scratch folders in the working directory
+    monkeypatch.chdir(tmp_path)
+    geom = manage_xyz.read_xyzs(os.path.join(ROOT, 'data', 'ethylene.xyz'))[0]
+    xyz = manage_xyz.xyz_to_np(geom)
+    lot = ModelLot.from_options(states=[(1, 0)], geom=geom)
+    pes = PES.from_options(lot=lot, ad_idx=0, multiplicity=1)
+
+    # away from the minimum, so that the gradient terms count too
+    xyz = xyz + 0.05*np.random.RandomState(0).uniform(-1., 1., xyz.shape)
+    # the walls between the non-bonded atoms are not in morse_hessian
+    i, j = lot.nonbonded
+    assert np.all(np.linalg.norm(xyz[i]-xyz[j], axis=1) > lot.rmin)
+
+    hess = pes.get_finite_difference_hessian(xyz, workers=workers, symmetrize=False, one_sided=False)
+    # the finite differences of the gradients (Hartree/Bohr) are taken in Angstrom
+    analytic = morse_hessian(lot, xyz)*units.KCAL_MOL_TO_AU/units.ANGSTROM_TO_AU
+    # central differences, the error goes with FD_STEP_LENGTH**2
+    np.testing.assert_allclose(hess, analytic, rtol=0., atol=1e-5*np.abs(analytic).max())
+    np.testing.assert_allclose(hess, hess.T, rtol=0., atol=1e-5*np.abs(analytic).max())